@@ -1,20 +1,53 @@
-import os
-from dotenv import load_dotenv
+import logging
+import logging.handlers
+import queue
 from src.database.init_db import init_db
 from src.loader import load_routes
 from src.middleware.auth_middleware import auth_middleware
 from src.middleware.logger import logger_middleware
 from src.router import Router
+from src.settings import (
+    HOST,
+    KEEP_ALIVE_TIMEOUT,
+    LOG_LEVEL,
+    PORT,
+    WEB_ROOT_DIR,
+    WORKER_THREADS,
+)
 from src.webserver import WebServer
 
 # from database.db_connection import get_db_connection
-load_dotenv()
-WEB_ROOT_DIR = os.getenv("WEB_ROOT_DIR")
-HOST = os.getenv("HOST")
-PORT = os.getenv("PORT")
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    # The server logs through the logging module instead of print(). INFO by default, set LOG_LEVEL=DEBUG
+    # to also see the per-request debug lines.
+    # Request threads only put the log records on a queue, the QueueListener's own thread formats them
+    # and does the actual writing to stderr, so no request ever waits on a write.
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(LOG_LEVEL)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    return listener
 
 
 def main():
+    log_listener = setup_logging()
+    try:
+        run_server()
+    finally:
+        # Flushes whatever is still on the queue before we exit.
+        log_listener.stop()
+
+
+def run_server():
     # Check if the all .env are set
     if not HOST or not PORT or not WEB_ROOT_DIR:
         print(f"Could not start server as the host or port or web_root_dir is not set.")
@@ -30,7 +63,14 @@ def main():
     print("Routes loaded into router.")
 
     # Initialize the WebServer.
-    server = WebServer(HOST, PORT, WEB_ROOT_DIR, router)
+    server = WebServer(
+        HOST,
+        PORT,
+        WEB_ROOT_DIR,
+        router,
+        worker_threads=WORKER_THREADS,
+        keep_alive_timeout=KEEP_ALIVE_TIMEOUT,
+    )
     # Add the middleware, order matters here auth first and then logger
     server.add_middleware(logger_middleware)
     server.add_middleware(auth_middleware)
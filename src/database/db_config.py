@@ -1,20 +1,48 @@
 from contextlib import contextmanager
-import os
-from dotenv import load_dotenv
 import sqlalchemy as sa
 from sqlalchemy import orm as so
 import psycopg2
+from src.settings import DATABASE_URL
 
-
-# Load the environment variable for database URL
-load_dotenv()
-DATABASE_URL = os.getenv("DATABASE_URL", "")
+# The database URL comes from the environment, see src/settings.py.
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set.")
 
 # Define the database as db, echo is False since we are in prod and pool_recycle is
 # set to reset connection every 1 hr to avoid database server closing idle connection due to timeout.
-db = sa.create_engine(DATABASE_URL, echo=False, pool_recycle=3600)
+# pool_pre_ping checks a connection with a cheap "SELECT 1" when it is checked out, so a connection the
+# server has dropped gets replaced instead of failing the request.
+_engine_options = {
+    "echo": False,
+    "pool_recycle": 3600,
+    "pool_pre_ping": True,
+    "insertmanyvalues_page_size": 1000,
+}
+_database_url = sa.engine.make_url(DATABASE_URL)
+
+# Every client is handled in its own thread, so the pool is sized for concurrent requests rather than
+# the default of 5 (+10 overflow), otherwise busy periods keep opening brand new connections.
+# pool_use_lifo hands out the most recently used connection first, which keeps a small set of
+# connections warm and lets the idle ones time out.
+# These are QueuePool options, which is what Postgres (and file based SQLite) get. Other pools like the
+# one for an in memory SQLite database reject them, so they are only passed when the URL gets a QueuePool.
+if issubclass(
+    _database_url.get_dialect().get_pool_class(_database_url), sa.pool.QueuePool
+):
+    _engine_options["pool_size"] = 20
+    _engine_options["max_overflow"] = 40
+    _engine_options["pool_use_lifo"] = True
+
+# executemany_mode="values_plus_batch" makes psycopg2 pack multi-row INSERTs into a single
+# INSERT ... VALUES (...), (...) and batch UPDATE/DELETE executemany() calls, instead of sending one
+# statement per row when a session flushes several objects at once.
+# These options only exist on the psycopg2 dialect and create_engine() raises a TypeError for any other
+# driver, so they are only passed when the URL actually uses psycopg2.
+if _database_url.get_driver_name() == "psycopg2":
+    _engine_options["executemany_mode"] = "values_plus_batch"
+    _engine_options["executemany_batch_page_size"] = 500
+
+db = sa.create_engine(_database_url, **_engine_options)
 
 # Define a base class for declarative models that all model classes must inherit.
 # It's the foundation upon which your ORM classes are built, allowing them to be mapped to database tables.
@@ -37,8 +65,13 @@ def start_db():
     try:
         # Yield gives the session to the calling block of code and waits for it to exceute.
         # Once it has finished executing the control resumes here and we move to the finally statement.
-        # If there is any exception in the code calling this, it is passed back here and we just
-        # close the session. The errors will be handled by the functions calling this.
+        # If there is any exception in the code calling this, it is passed back here, we roll back
+        # whatever the failed block left in the transaction and re-raise it. The errors will be handled
+        # by the functions calling this.
         yield session
+    except Exception:
+        # Without the rollback the connection goes back to the pool in the middle of a failed transaction.
+        session.rollback()
+        raise
     finally:
         session.close()
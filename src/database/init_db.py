@@ -1,5 +1,5 @@
 from src.database.db_config import Base, db, SessionLocal
-from src.database.user_repository import create_user, get_user_by_username
+from src.database.user_repository import create_user, user_exists
 from src.utils.auth_utils import hash_password
 
 
@@ -18,9 +18,7 @@ def init_db():
     session = SessionLocal()
     try:
         # Checks if initial user exists else it will seed it.
-        admin_user = get_user_by_username(session, "admin")
-
-        if not admin_user:
+        if not user_exists(session, "admin"):
             print("Creating initial 'admin' user...")
             hashed_password = hash_password("admin_password")
             create_user(session, "admin", hashed_password, "admin")
@@ -1,46 +1,201 @@
-from typing import List, Optional
+from collections import OrderedDict
+import threading
+import time
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+from psycopg2.extras import execute_values
+from sqlalchemy import bindparam, delete, insert, select, update
 import sqlalchemy.orm as so
+from sqlalchemy.orm import load_only, raiseload
 from src.database.models import User
 
+# The lookup statements are built once at import time instead of building a new Query on every call.
+# SQLAlchemy caches the compiled SQL against the statement, so every call after the first one only
+# has to bind the parameter and run it.
+_USER_BY_NAME_STMT = select(User).where(User.username == bindparam("u"))
+_USER_BY_ID_STMT = select(User).where(User.id == bindparam("i"))
+# Existence checks only need to know that a row is there, so they select the id alone (straight from the
+# username index) instead of loading a whole User.
+_USER_EXISTS_STMT = select(User.id).where(User.username == bindparam("u")).limit(1)
+# The auth flow and the profile page only use a few columns, so these only fetch what they need instead
+# of every column of the row. The auth one selects plain columns since it ends up as a UserAuthRow anyway,
+# and all of them are in the covering username index so Postgres never has to touch the table.
+_AUTH_ROW_BY_NAME_STMT = select(
+    User.id, User.username, User.role, User.hashed_password
+).where(User.username == bindparam("u"))
+# raiseload("*") makes touching any relationship that was not eagerly loaded raise instead of quietly
+# running one extra query per user (the N+1 problem). If a list view needs a relationship, add an explicit
+# selectinload() for it here.
+_ALL_USERS_STMT = select(User).options(raiseload("*"))
+_USER_PROFILE_BY_NAME_STMT = (
+    select(User)
+    .options(load_only(User.username, User.role, User.created_at))
+    .where(User.username == bindparam("u"))
+)
+
+
+class UserAuthRow(NamedTuple):
+    # Plain tuple with just the columns the auth flow needs, cheap to keep around in the cache below.
+    id: int
+    username: str
+    role: str
+    hashed_password: str
+
+
+# Login and protected routes keep asking for the same handful of usernames, so we keep a small LRU of
+# their auth rows to skip the database round-trip. Every function below that writes to a user row
+# evicts it from here so we never hand out stale data.
+# The server handles each client in its own thread, hence the lock around the OrderedDict.
+# The cache lives in this process only, a change made by another process (another server instance or a
+# script) is not evicted here. So entries also expire after _AUTH_ROW_CACHE_TTL seconds, which bounds
+# how long such a change (a demoted or deleted user) can go unnoticed.
+_AUTH_ROW_CACHE_SIZE = 1024
+_AUTH_ROW_CACHE_TTL = 30.0
+# username -> (row, monotonic time the entry expires at)
+_auth_row_cache: "OrderedDict[str, Tuple[UserAuthRow, float]]" = OrderedDict()
+_auth_row_cache_lock = threading.Lock()
+# Bumped on every invalidation. get_user_auth_row() notes it before running its SELECT and only caches
+# the row if it hasn't changed since, otherwise a write that lands between the SELECT and the cache fill
+# would be invalidated first and then overwritten with the stale row it just replaced.
+_auth_row_generation = 0
+
+
+def _invalidate_auth_row(username: str) -> None:
+    global _auth_row_generation
+    with _auth_row_cache_lock:
+        _auth_row_cache.pop(username, None)
+        _auth_row_generation += 1
+
 
 def get_user_by_username(session: so.Session, username: str) -> Optional[User]:
-    return session.query(User).filter(User.username == username).first()
+    return session.execute(_USER_BY_NAME_STMT, {"u": username}).scalar_one_or_none()
 
 
 def get_user_by_id(session: so.Session, id: int) -> Optional[User]:
-    return session.query(User).filter(User.id == id).first()
+    return session.execute(_USER_BY_ID_STMT, {"i": id}).scalar_one_or_none()
+
+
+def user_exists(session: so.Session, username: str) -> bool:
+    return session.execute(_USER_EXISTS_STMT, {"u": username}).first() is not None
+
+
+def get_user_auth_row(session: so.Session, username: str) -> Optional[UserAuthRow]:
+    # Cached version of get_user_by_username() for the auth flow, returns a UserAuthRow instead of a User.
+    with _auth_row_cache_lock:
+        entry = _auth_row_cache.get(username)
+        if entry is not None:
+            row, expires_at = entry
+            if time.monotonic() < expires_at:
+                _auth_row_cache.move_to_end(username)
+                return row
+            del _auth_row_cache[username]
+        generation = _auth_row_generation
+
+    result = session.execute(_AUTH_ROW_BY_NAME_STMT, {"u": username}).first()
+    if result is None:
+        # We don't cache misses since the user might register right after.
+        return None
+
+    row = UserAuthRow(*result)
+    with _auth_row_cache_lock:
+        if generation != _auth_row_generation:
+            # A user was written while we were reading, the row might already be stale so we don't cache it.
+            return row
+        _auth_row_cache[username] = (row, time.monotonic() + _AUTH_ROW_CACHE_TTL)
+        _auth_row_cache.move_to_end(username)
+        if len(_auth_row_cache) > _AUTH_ROW_CACHE_SIZE:
+            # Evict the least recently used entry.
+            _auth_row_cache.popitem(last=False)
+    return row
+
+
+def get_user_profile_by_username(session: so.Session, username: str) -> Optional[User]:
+    # Same as get_user_by_username() but only loads the columns the profile page shows.
+    return session.execute(
+        _USER_PROFILE_BY_NAME_STMT, {"u": username}
+    ).scalar_one_or_none()
 
 
 def get_users(session: so.Session) -> List[User]:
     # We can add skip and limit later for pagination but I am choosing not to here.
-    return session.query(User).all()
+    return list(session.execute(_ALL_USERS_STMT).scalars().all())
 
 
 def create_user(
     session: so.Session, username: str, hashed_password: str, role: str = "guest"
 ) -> User:
-    db_user = User(username=username, hashed_password=hashed_password, role=role)
-    session.add(db_user)
+    # INSERT ... RETURNING gives us the id and created_at the database generated in the same round-trip,
+    # instead of a commit followed by session.refresh() which is a second SELECT just to read them back.
+    row = session.execute(
+        insert(User)
+        .values(username=username, hashed_password=hashed_password, role=role)
+        .returning(User.id, User.created_at)
+    ).one()
     session.commit()
-    session.refresh(db_user)
-    return db_user
+    _invalidate_auth_row(username)
+    # This User is not attached to the session, it just carries the new row back to the caller.
+    return User(
+        id=row.id,
+        username=username,
+        hashed_password=hashed_password,
+        role=role,
+        created_at=row.created_at,
+    )
+
 
+def create_users_bulk(
+    session: so.Session, rows: Sequence[Tuple[str, str, str]]
+) -> List[int]:
+    # Inserts many (username, hashed_password, role) rows at once and returns their new ids in order.
+    # Going through create_user() for each row means an INSERT, a COMMIT and a SELECT per user, which is
+    # painfully slow when seeding or migrating. execute_values() packs the rows into multi-row
+    # INSERT ... VALUES (...), (...) statements, so we only pay one round-trip per page of 1000 rows.
+    if not rows:
+        return []
 
-def update_user_role(session: so.Session, username: str, new_role: str) -> User:
-    user = session.query(User).filter(User.username == username).first()
-    if user:
-        # Getting an error here since role is "Column[str]" and we are assinging "str" to it.
-        # Happens when you have a static type checker, ignore it.
-        user.role = new_role  # type: ignore
-        session.commit()
-        session.refresh(user)
-    return user
+    # We drop down to the raw psycopg2 cursor of the session's connection so that the insert is still
+    # part of the session's transaction.
+    cursor = session.connection().connection.cursor()
+    try:
+        inserted = execute_values(
+            cursor,
+            "INSERT INTO users (username, hashed_password, role) VALUES %s RETURNING id",
+            rows,
+            page_size=1000,
+            fetch=True,
+        )
+    finally:
+        cursor.close()
+    session.commit()
+
+    for username, _, _ in rows:
+        _invalidate_auth_row(username)
+    return [row[0] for row in inserted]
+
+
+def update_user_role(
+    session: so.Session, username: str, new_role: str
+) -> Optional[User]:
+    # Same idea as create_user(), a single UPDATE ... RETURNING instead of SELECT, UPDATE and refresh.
+    row = session.execute(
+        update(User)
+        .where(User.username == username)
+        .values(role=new_role)
+        .returning(
+            User.id, User.username, User.hashed_password, User.role, User.created_at
+        )
+    ).first()
+    session.commit()
+    if row is None:
+        return None
+    _invalidate_auth_row(username)
+    return User(**row._asdict())
 
 
 def delete_user(session: so.Session, username: str) -> bool:
-    user = session.query(User).filter(User.username == username).first()
-    if user:
-        session.delete(user)
-        session.commit()
+    # A single DELETE ... WHERE, the rowcount tells us if the user existed so we don't need to load it first.
+    result = session.execute(delete(User).where(User.username == username))
+    session.commit()
+    if result.rowcount > 0:  # type: ignore
+        _invalidate_auth_row(username)
         return True
     return False
@@ -1,22 +1,39 @@
+import logging
 from typing import Tuple
-import json
+import orjson
 from src.decorators import protected_route
 from src.webserver import Request
 
+# Logging arguments are only formatted when the record is actually emitted, so the debug lines
+# below cost next to nothing once the level is above DEBUG (INFO by default, see server.py).
+logger = logging.getLogger(__name__)
+
+# Constant error responses, built once at import time instead of on every bad request.
+_RESP_INVALID_JSON = (
+    400,
+    "text/plain",
+    b"400 Bad Request: Invalid JSON in request body.",
+)
+_RESP_EMPTY_BODY = (
+    400,
+    "text/plain",
+    b"400 Bad Request: No data received in request body.",
+)
+_RESP_SERIALIZATION_ERROR = (500, "text/plain", b"500 Internal Server Error")
+
 
 def json_response(status_code: int, data: dict) -> Tuple[int, str, bytes]:
     # Util to create json responses for the response body.
     try:
-        # Create the JSON string and encode it to be added to the response.
-        response_body = json.dumps(data).encode("utf-8")
-        content_type = "application/json"
-        return status_code, content_type, response_body
-    except Exception as e:
-        return (
-            500,
-            "text/plain",
-            f"500 Internal Server Error: {e}.".encode("utf-8"),
-        )
+        # orjson gives us the encoded bytes directly, so there is no separate .encode() step.
+        response_body = orjson.dumps(data)
+    except orjson.JSONEncodeError:
+        # Raised for data orjson can't serialize (it is a TypeError). That is a bug on our side, so the
+        # details go to the log and the client only gets a plain 500 without our internals in it.
+        # Anything else is not ours to swallow here and goes up to the server's error handling.
+        logger.exception("Could not serialize JSON response.")
+        return _RESP_SERIALIZATION_ERROR
+    return status_code, "application/json", response_body
 
 
 @protected_route
@@ -24,14 +41,16 @@ def get_data(request: Request) -> Tuple[int, str, bytes]:
     # Handler for GET /api/data. Returns some sample JSON data.
     # This is just a mock method that shows how data will be accessed and sent back.
     try:
-        print(f"Handling GET request for /api/data. Request headers: {request.headers}")
+        logger.debug(
+            "Handling GET request for /api/data. Request headers: %s", request.headers
+        )
 
         user_info = (
             request.user
             if request.user
             else {"message": "No user info (shouldn't happen on protected route)"}
         )
-        print(f"Authenticated user for /api/data: {user_info}")
+        logger.debug("Authenticated user for /api/data: %s", user_info)
 
         sample_data = {
             "message": "Hello from Protected API!",
@@ -51,7 +70,7 @@ def post_data(request: Request):
     # Handler for POST /api/data. Processes incoming JSON data.
     # This is just a mock method that shows how data will be accessed and posted.
     # I have not implemented any database operations that will take data from here.
-    print(f"Handling POST request for /api/data. Request body: {request.body}")
+    logger.debug("Handling POST request for /api/data. Request body: %r", request.body)
     if request.body:
         try:
             user_info = (
@@ -59,9 +78,11 @@ def post_data(request: Request):
                 if request.user
                 else {"message": "No user info (shouldn't happen on protected route)"}
             )
-            print(f"Authenticated user performing POST: {user_info}")
+            logger.debug("Authenticated user performing POST: %s", user_info)
 
-            received_data = json.loads(request.body.decode("utf-8"))
+            # orjson parses the raw bytes directly, so we skip decoding the body to a str first.
+            # Invalid UTF-8 is reported as a JSONDecodeError as well.
+            received_data = orjson.loads(request.body)
             response_message = f"Received data from {user_info.get('username', 'unknown')}: {received_data}"
             return json_response(
                 200,
@@ -71,12 +92,10 @@ def post_data(request: Request):
                     "received_by_user": user_info.get("username"),
                 },
             )
-        except json.JSONDecodeError:
-            return 400, "text/plain", b"400 Bad Request: Invalid JSON in request body."
-        except UnicodeDecodeError:
-            return 400, "text/plain", b"400 Bad Request: Could not decode request body."
+        except orjson.JSONDecodeError:
+            return _RESP_INVALID_JSON
         except Exception as e:
             # Catch any unexpected errors during data processing
             return 500, "text/plain", f"500 Internal Server Error: {e}".encode("utf-8")
     else:
-        return 400, "text/plain", b"400 Bad Request: No data received in request body."
+        return _RESP_EMPTY_BODY
@@ -1,38 +1,82 @@
-import json
+import logging
 from typing import Tuple
+import orjson
 from psycopg2 import IntegrityError
 from src.database.db_config import start_db
-from src.database.user_repository import create_user, get_user_by_username
+from src.database.user_repository import (
+    create_user,
+    get_user_auth_row,
+    get_user_profile_by_username,
+    user_exists,
+)
 from src.decorators import protected_route
 from src.utils.auth_utils import check_password, create_jwt_token, hash_password
 from src.webserver import Request
 
+# Messages are passed as a format string plus arguments, so nothing is formatted unless the record is
+# actually emitted at the configured level.
+logger = logging.getLogger(__name__)
+
+# The error responses below never change, so we build (and JSON encode) them once at import time
+# instead of on every failed request. Handlers just return the shared tuple.
+_RESP_EMPTY_BODY = (400, "text/plain", b"400 Bad Requesr: Request body is empty.")
+_RESP_INVALID_JSON = (
+    400,
+    "text/plain",
+    b"400 Bad Request: Invalid JSON in request body.",
+)
+_RESP_MISSING_CREDENTIALS = (
+    400,
+    "application/json",
+    orjson.dumps({"error": "Username and password are required."}),
+)
+_RESP_INVALID_CREDENTIALS = (
+    401,
+    "application/json",
+    orjson.dumps({"error": "Invalid credentials"}),
+)
+_RESP_DUPLICATE_USER_ID = (
+    409,
+    "application/json",
+    orjson.dumps({"error": "Database error: User ID might be duplicate"}),
+)
+_RESP_REGISTER_ERROR = (
+    500,
+    "text/plain",
+    b"500 Internal Server Error: Could not register user.",
+)
+_RESP_USER_DATA_MISSING = (401, "text/plain", b"401 Unauthorized: User data missing.")
+_RESP_INVALID_TOKEN_PAYLOAD = (
+    400,
+    "application/json",
+    orjson.dumps(
+        {"error": "Bad Request: User ID missing or invalid in token payload."}
+    ),
+)
+_RESP_USER_NOT_FOUND = (
+    404,
+    "application/json",
+    orjson.dumps({"error": "User not found in database."}),
+)
+
 
 def register_user(request: Request) -> Tuple[int, str, bytes]:
 
-    # Check if the request object has all the data you need.
-    if request.method != "POST":
-        return 405, "text/plain", b"405 Method Not Allowed"
-    if not request.decoded_body:
-        return 400, "text/plain", b"400 Bad Requesr: Request body is empty."
+    # Check if the request object has all the data you need. The method is not checked here, the route is
+    # only registered for POST so the server answers any other method with a 405 before we get called.
+    if not request.body:
+        return _RESP_EMPTY_BODY
 
     try:
-        # Here you create the json object from the string so that you can get
-        # fast, safe and structured access to the body.
-        data = json.loads(request.decoded_body)
+        # Here you create the json object from the raw body bytes so that you can get
+        # fast, safe and structured access to the body. orjson takes bytes, no need to decode first.
+        data = orjson.loads(request.body)
         username = data.get("username")
         password = data.get("password")
 
         # Basic check to ensure that there is no data missing from the body.
         if not username or not password:
-            return (
-                400,
-                "application/json",
-                # Ensure you are encoding the json objects to reutrn the correct response format.
-                json.dumps({"error": "Username and password are required."}).encode(
-                    "utf-8"
-                ),
-            )
+            return _RESP_MISSING_CREDENTIALS
 
         # The 'with' statement basically lets us acquire some resource, use it, and then release it safely.
         with start_db() as session:
@@ -40,16 +84,14 @@ def register_user(request: Request) -> Tuple[int, str, bytes]:
             # In the background what start_db() does is that it sets up the session and waits for the 'with'
             # block to execute before closing the session.
 
-            if get_user_by_username(session, username):
+            if user_exists(session, username):
                 # The registration fails if the user already exists.
-                print(f"Registration failed: User '{username}' already exists.")
+                logger.info("Registration failed: User '%s' already exists.", username)
                 return (
                     409,
                     "application/json",
                     # Ensure you are encoding the json objects to reutrn the correct response format.
-                    json.dumps({"error": f"User '{username}' already exists"}).encode(
-                        "utf-8"
-                    ),
+                    orjson.dumps({"error": f"User '{username}' already exists"}),
                 )
 
             # We use the functions in the auth_utils and user_repository to get and store the data.
@@ -57,113 +99,91 @@ def register_user(request: Request) -> Tuple[int, str, bytes]:
             user = create_user(
                 session, username=username, hashed_password=hashed_password, role="user"
             )
-            print(f"User '{user.username}' registered successfully with ID: {user.id}.")
+            logger.info(
+                "User '%s' registered successfully with ID: %s.", user.username, user.id
+            )
             return (
                 201,
                 "application/json",
                 # Ensure you are encoding the json objects to reutrn the correct response format.
-                json.dumps(
+                orjson.dumps(
                     {
                         "message": "User registered successfully",
                         "username": user.username,
                     }
-                ).encode("utf-8"),
+                ),
             )
 
     # Catched any errors during decoding or encoding json objects.
-    except json.JSONDecodeError:
-        print("Registration failed: Invalid JSON in request body.")
-        return 400, "text/plain", b"400 Bad Request: Invalid JSON in request body."
+    except orjson.JSONDecodeError:
+        logger.info("Registration failed: Invalid JSON in request body.")
+        return _RESP_INVALID_JSON
     # Catch database unique constraint violations to ensure integrity.
     except IntegrityError:
-        print(
-            f"Registration failed: Database integrity error, username might be duplicate."
-        )
-        return (
-            409,
-            "application/json",
-            # Ensure you are encoding the json objects to reutrn the correct response format.
-            json.dumps({"error": "Database error: User ID might be duplicate"}).encode(
-                "utf-8"
-            ),
+        logger.warning(
+            "Registration failed: Database integrity error, username might be duplicate."
         )
+        return _RESP_DUPLICATE_USER_ID
     # Catches all other exceptions.
     except Exception as e:
-        print(f"Error during user registration: {e}")
-        return 500, "text/plain", b"500 Internal Server Error: Could not register user."
+        logger.error("Error during user registration: %s", e)
+        return _RESP_REGISTER_ERROR
 
 
 def login_user(request: Request) -> Tuple[int, str, bytes]:
 
-    # Check if the request object has all the data you need.
-    if request.method != "POST":
-        return 405, "text/plain", b"405 Method Not Allowed"
-    if not request.decoded_body:
-        return 400, "text/plain", b"400 Bad Requesr: Request body is empty."
+    # Check if the request object has all the data you need (only routed for POST, see register_user()).
+    if not request.body:
+        return _RESP_EMPTY_BODY
 
     try:
-        # Gets the json object.
-        data = json.loads(request.decoded_body)
+        # Gets the json object straight from the body bytes.
+        data = orjson.loads(request.body)
         username = data.get("username")
         password = data.get("password")
 
         # Basic check to ensure that there is no data missing from the body.
         if not username or not password:
-            return (
-                400,
-                "application/json",
-                # Ensure you are encoding the json objects to reutrn the correct response format.
-                json.dumps({"error": "Username and password are required."}).encode(
-                    "utf-8"
-                ),
-            )
+            return _RESP_MISSING_CREDENTIALS
 
         with start_db() as session:
-            user = get_user_by_username(session, username)
+            # Login only needs the auth columns, so we use the cached row instead of the full User.
+            user = get_user_auth_row(session, username)
 
-            # Gives the static type error but this is correct hence we ignore it.
-            if user and check_password(password, user.hashed_password):  # type: ignore
+            if user and check_password(password, user.hashed_password):
                 # If user is authenticated, we generate a JWT token using the auth_utils function.
                 token_payload = {"username": user.username, "role": user.role}
                 jwt_token = create_jwt_token(token_payload)
-                print(f"User '{username}' logged in sucessfully.")
+                logger.info("User '%s' logged in sucessfully.", username)
                 return (
                     200,
                     "application/json",
-                    json.dumps(
-                        {"message": "Login Sucessful", "token": jwt_token}
-                    ).encode("utf-8"),
+                    orjson.dumps({"message": "Login Sucessful", "token": jwt_token}),
                 )
             else:
-                print(f"Login failed: Invalid credentials for user '{username}'.")
-                return (
-                    401,
-                    "application/json",
-                    # Ensure you are encoding the json objects to reutrn the correct response format.
-                    json.dumps({"error": "Invalid credentials"}).encode("utf-8"),
+                logger.info(
+                    "Login failed: Invalid credentials for user '%s'.", username
                 )
+                return _RESP_INVALID_CREDENTIALS
     # Catched any errors during decoding or encoding json objects.
-    except json.JSONDecodeError:
-        print("Registration failed: Invalid JSON in request body.")
-        return 400, "text/plain", b"400 Bad Request: Invalid JSON in request body."
+    except orjson.JSONDecodeError:
+        logger.info("Registration failed: Invalid JSON in request body.")
+        return _RESP_INVALID_JSON
     # Catches all other exceptions.
     except Exception as e:
-        print(f"Error during user registration: {e}")
-        return 500, "text/plain", b"500 Internal Server Error: Could not register user."
+        logger.error("Error during user registration: %s", e)
+        return _RESP_REGISTER_ERROR
 
 
 # Marking this as protected so that access is restricted to loggen in users.
 @protected_route
 def get_user_profile(request: Request) -> Tuple[int, str, bytes]:
 
-    # Check if the request object has all the data you need.
-    if request.method != "GET":
-        return 405, "text/plain", b"405 Method Not Allowed"
-
+    # The route is only registered for GET, so there is no method check here.
     # The auth_middleware would have already populated request.user if the token is valid.
     # Adding this for type safety in the later request.user.get() calls
     if not hasattr(request, "user") or not request.user:
-        return 401, "text/plain", b"401 Unauthorized: User data missing."
+        return _RESP_USER_DATA_MISSING
 
     # We get the user and role from the jwt token.
     username_from_token = request.user.get("username")
@@ -174,34 +194,24 @@ def get_user_profile(request: Request) -> Tuple[int, str, bytes]:
     # We have s stricter check than just 'not username_from_token', since we are dealing with data
     # from sensitive payload (jwt).
     if not isinstance(username_from_token, str):
-        print(
-            f"Profile access failed: 'username' missing or invalid in token payload for user: {username_from_token}"
-        )
-        return (
-            400,
-            "application/json",
-            # Ensure you are encoding the json objects to reutrn the correct response format.
-            json.dumps(
-                {"error": "Bad Request: User ID missing or invalid in token payload."}
-            ).encode("utf-8"),
+        logger.warning(
+            "Profile access failed: 'username' missing or invalid in token payload for user: %s",
+            username_from_token,
         )
+        return _RESP_INVALID_TOKEN_PAYLOAD
 
     with start_db() as session:
         # Retrives the information about the user requesting data.
-        db_user = get_user_by_username(session, username_from_token)
+        db_user = get_user_profile_by_username(session, username_from_token)
         if db_user:
             username_from_db = db_user.username
             user_created_at = db_user.created_at.isoformat()
         else:
-            print(
-                f"Profile access failed: User '{username_from_token}' from token not found in database."
-            )
-            return (
-                404,
-                "application/json",
-                # Ensure you are encoding the json objects to reutrn the correct response format.
-                json.dumps({"error": "User not found in database."}).encode("utf-8"),
+            logger.warning(
+                "Profile access failed: User '%s' from token not found in database.",
+                username_from_token,
             )
+            return _RESP_USER_NOT_FOUND
 
     # We create a json object that we can serialize to a string when returning in the response.
     profile_data = {
@@ -212,6 +222,6 @@ def get_user_profile(request: Request) -> Tuple[int, str, bytes]:
         "created_at": user_created_at,
     }
 
-    print(f"Profile accessed for user: {username_from_token}")
+    logger.debug("Profile accessed for user: %s", username_from_token)
     # Ensure you are encoding the json objects to reutrn the correct response format.
-    return 200, "application/json", json.dumps(profile_data).encode("utf-8")
+    return 200, "application/json", orjson.dumps(profile_data)
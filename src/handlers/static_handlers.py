@@ -1,26 +1,117 @@
+from collections import OrderedDict
+import functools
+import logging
 import mimetypes
 import os
-from src.webserver import Request
+import stat
+import threading
+from typing import Optional, Tuple
+from src.webserver import FileBody, Request
+
+logger = logging.getLogger(__name__)
+
+# Content types for the web assets we actually serve, keyed by lower-cased file extension.
+# Having our own table is a proactive measure to ensure that the web server consistently provides the
+# correct Content-Type header for these specific, commonly used web assets, regardless of any change in
+# the mimetypes database on the system where your server runs. It is built once at import time, so a
+# request only costs one dict lookup instead of registering the types again with mimetypes.add_type().
+# Add more types here if the mimetypes module doesn't cover them well.
+_CONTENT_TYPES = {
+    ".html": "text/html",
+    ".htm": "text/html",
+    ".css": "text/css",
+    ".js": "application/javascript",
+    ".json": "application/json",
+    ".ico": "image/x-icon",  # For favicon.ico.
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".svg": "image/svg+xml",
+    ".txt": "text/plain",
+}
+
+# Files up to this size are read into memory and sent with the headers in one go. Anything bigger is
+# handed to the server as a FileBody and sent with sendfile(2), which skips copying the file through
+# Python but has a bit more setup cost, so it only pays off for larger files.
+_SENDFILE_MIN_SIZE = 64 * 1024
+
+# The css, js and images of the site are asked for on every page load and hardly ever change, so the small
+# ones (everything under _SENDFILE_MIN_SIZE) are kept in memory after the first read. An entry is only used
+# while the file's mtime, size and inode still match, so editing or replacing a file shows up right away.
+# It is an LRU bounded both by the number of files and by their total size, with a lock since every client
+# is served from its own thread.
+_FILE_CACHE_MAX_ENTRIES = 256
+_FILE_CACHE_MAX_BYTES = 8 * 1024 * 1024
+# full_path -> (st_mtime_ns, st_size, st_ino, content_type, content)
+_file_cache: "OrderedDict[str, Tuple[int, int, int, str, bytes]]" = OrderedDict()
+_file_cache_bytes = 0
+_file_cache_lock = threading.Lock()
 
 
 def _get_content_type(file_path: str) -> str:
-    # Add more types if the below mimetypes doesn't cover them well.
-    mimetypes.add_type("text/css", ".css")
-    mimetypes.add_type("application/javascript", ".js")
-    mimetypes.add_type("image/x-icon", ".ico")  # For favicon.ico.
-    mimetypes.add_type("image/jpeg", ".jpeg")
-    mimetypes.add_type("image/gif", ".gif")
+    return _lookup_content_type(os.path.splitext(file_path)[1].lower())
 
-    # .add_type() is a proactive measure to ensure that the web server consistently provides the correct
-    # Content-Type header for these specific, commonly used web assets, regardless of any change in the
-    # mimetypes database on the system where your server runs.
+
+# The content type only depends on the extension and a site only has a handful of them, so each one is
+# resolved once and then remembered. This mostly matters for the extensions missing from the table above,
+# where mimetypes.guess_type() has to parse the name and walk its own tables on every call.
+@functools.lru_cache(maxsize=128)
+def _lookup_content_type(extension: str) -> str:
+    content_type = _CONTENT_TYPES.get(extension)
+    if content_type:
+        return content_type
 
     # Use .guess_type() function if we can't find the format above.
     # If it can't guess, default to 'application/octet-stream' (binary file).
-    content_type, _ = mimetypes.guess_type(file_path)
+    content_type, _ = mimetypes.guess_type("file" + extension)
     return content_type if content_type else "application/octet-stream"
 
 
+def _get_cached_file(full_path: str, st: os.stat_result) -> Optional[Tuple[str, bytes]]:
+    with _file_cache_lock:
+        entry = _file_cache.get(full_path)
+        if entry is None:
+            return None
+        if entry[:3] != (st.st_mtime_ns, st.st_size, st.st_ino):
+            # The file changed on disk, the fresh copy gets cached again once it is read.
+            _drop_cached_file(full_path)
+            return None
+        _file_cache.move_to_end(full_path)
+        return entry[3], entry[4]
+
+
+def _cache_file(
+    full_path: str, st: os.stat_result, content_type: str, content: bytes
+) -> None:
+    global _file_cache_bytes
+    with _file_cache_lock:
+        _drop_cached_file(full_path)
+        _file_cache[full_path] = (
+            st.st_mtime_ns,
+            st.st_size,
+            st.st_ino,
+            content_type,
+            content,
+        )
+        _file_cache_bytes += len(content)
+        while (
+            len(_file_cache) > _FILE_CACHE_MAX_ENTRIES
+            or _file_cache_bytes > _FILE_CACHE_MAX_BYTES
+        ):
+            # Evict the least recently used entry.
+            _, evicted = _file_cache.popitem(last=False)
+            _file_cache_bytes -= len(evicted[4])
+
+
+def _drop_cached_file(full_path: str) -> None:
+    # Callers hold _file_cache_lock.
+    global _file_cache_bytes
+    entry = _file_cache.pop(full_path, None)
+    if entry is not None:
+        _file_cache_bytes -= len(entry[4])
+
+
 def serve_static_file(request: Request, filepath: str):
     # The request is passed here as an arg but never used. This is intended as the request object will be
     # used by other methods. This gives our framework a consistency in terms of args for all handlers
@@ -31,28 +122,51 @@ def serve_static_file(request: Request, filepath: str):
     # On Windows: "webroot\\index.html"
 
     try:
-        # We check if the given address exists in the webroot dir
-        if not os.path.isfile(full_path):
-            print(f"File not found: {full_path}")
+        # A stat() is all it takes to serve a file we already have in memory. For the rest we let open()
+        # tell us if the file is missing instead of checking first, so there is no window for the file to
+        # disappear between the check and the open.
+        try:
+            cached = _get_cached_file(full_path, os.stat(full_path))
+            if cached is not None:
+                return 200, cached[0], cached[1]
+            f = open(full_path, "rb")
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            logger.info("File not found: %s", full_path)
             return 404, "text/plain", b"404 Not Found: Static file not found."
+        except PermissionError:
+            logger.warning("Permission denied: %s", full_path)
+            return 403, "text/plain", b"403 Forbidden: Static file not readable."
 
-        # Always use with when using open() since it will close the file once we are done reading
-        with open(full_path, "rb") as f:
-            content = f.read()
+        try:
+            file_stat = os.fstat(f.fileno())
+            # Only regular files are served, not devices or sockets someone linked into the webroot.
+            if not stat.S_ISREG(file_stat.st_mode):
+                logger.info("File not found: %s", full_path)
+                return 404, "text/plain", b"404 Not Found: Static file not found."
+
+            # We use the mimetypes library to get the content type and not guess what the file might be
+            content_type = _get_content_type(full_path)
 
-        # We use the mimetypes library to get the content type and not guess what the file might be
-        content_type = _get_content_type(full_path)
+            size = file_stat.st_size
+            if size >= _SENDFILE_MIN_SIZE:
+                # The server sends the file straight from disk and closes it afterwards.
+                body = FileBody(f, size)
+                f = None
+                return 200, content_type, body
+            content = f.read()
+            # Keyed on the fstat() of the file we actually read, so a file that was swapped out after the
+            # stat() above can't end up cached under the old one's mtime.
+            _cache_file(full_path, file_stat, content_type, content)
+        finally:
+            # Always close the file once we are done reading, unless it was handed over above.
+            if f is not None:
+                f.close()
 
         return 200, content_type, content
 
-    # This is a common pattern in error handling in a race condition when building web servers.
-    # This is added if the file gets deleted after we process the .isfle() and we don't return is as
-    # internal server error but a file not found. Returning the correct status codes is important in HTTP.
-    except FileNotFoundError:
-        return 404, "text/plain", b"404 Not Found: Static file not found."
     except Exception as e:
         # Catch any other error we get while we are reading the file or getting the content_type
-        print(f"Error serving static file {filepath}: {e}")
+        logger.error("Error serving static file %s: %s", filepath, e)
         return (
             500,
             "text/plain",
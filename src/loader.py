@@ -1,8 +1,32 @@
+import functools
 import importlib
-import json
+import logging
 import os
+import sys
+import orjson
+from src.decorators import is_protected, protected_route
 from src.router import Router
 
+logger = logging.getLogger(__name__)
+
+# Every handler the config is allowed to name, as handler name -> (module, function name in that module).
+# Adding a new handler only means adding a line here.
+_HANDLER_SOURCES = {
+    "serve_static_file": ("src.handlers.static_handlers", "serve_static_file"),
+    "get_data": ("src.handlers.api_handlers", "get_data"),
+    "post_data": ("src.handlers.api_handlers", "post_data"),
+    "register_user": ("src.handlers.auth_handlers", "register_user"),
+    "login_user": ("src.handlers.auth_handlers", "login_user"),
+    "get_user_profile": ("src.handlers.auth_handlers", "get_user_profile"),
+}
+
+
+# Handlers only need to be looked up once per process, every later load_routes() call (e.g. when
+# reloading routes) gets the function straight from this cache without going through the import machinery.
+@functools.lru_cache(maxsize=None)
+def _cached_import(module_name: str, attr: str):
+    return getattr(importlib.import_module(module_name), attr)
+
 
 def load_routes(router: Router) -> None:
     # This loads the routes specified in the /config/routes.json file
@@ -10,72 +34,36 @@ def load_routes(router: Router) -> None:
     routes_config_path = os.path.join("config", "routes.json")
 
     try:
-        with open(routes_config_path, "r") as f:
-            config = json.load(f)
+        # orjson parses the raw bytes directly, so we read the file in binary mode.
+        with open(routes_config_path, "rb") as f:
+            config = orjson.loads(f.read())
     # Catches errors if there is no file.
     except FileNotFoundError:
-        print(f"Error: Routes configuration file not found at {routes_config_path}")
+        logger.error(
+            "Error: Routes configuration file not found at %s", routes_config_path
+        )
         return
     # Catches specific error info while decoding json file.
-    except json.JSONDecodeError:
-        print(
-            f"Error: Invalid JSON in routes configuration file at {routes_config_path}"
+    except orjson.JSONDecodeError:
+        logger.error(
+            "Error: Invalid JSON in routes configuration file at %s", routes_config_path
         )
         return
     # Catch any other unexpected errors during file reading.
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error("Error: %s", e)
         return
 
     if "routes" not in config:
-        print(
-            f"Error: Missing 'routes' key in routes configuration file at {routes_config_path}"
+        logger.error(
+            "Error: Missing 'routes' key in routes configuration file at %s",
+            routes_config_path,
         )
         return
 
     routes_list = config["routes"]
     if not isinstance(routes_list, list):
-        print(f"Error: 'routes' key in config must be list")
-        return
-
-    # Define a mapping from handler name so that we can map it to the actual function.
-    # This avoids dynamic imports by string which can be easy to go wrong with,
-    # and it explicitly declares which handlers are expected.
-    handler_map = {
-        "serve_static_file": None,
-        "get_data": None,
-        "post_data": None,
-        "register_user": None,
-        "login_user": None,
-        "get_user_profile": None,
-    }
-
-    # We will look up the handlers by importing their module.
-    # This allows us to list handler functions by name in the config.
-    try:
-        static_handlers_module = importlib.import_module("src.handlers.static_handlers")
-        handler_map["serve_static_file"] = static_handlers_module.serve_static_file
-
-        api_handlers_module = importlib.import_module("src.handlers.api_handlers")
-        handler_map["get_data"] = api_handlers_module.get_data
-        handler_map["post_data"] = api_handlers_module.post_data
-
-        auth_handlers_module = importlib.import_module("src.handlers.auth_handlers")
-        handler_map["register_user"] = auth_handlers_module.register_user
-        handler_map["login_user"] = auth_handlers_module.login_user
-        handler_map["get_user_profile"] = auth_handlers_module.get_user_profile
-
-    # Catches a specific error when importing handlers.
-    except ImportError as e:
-        print(f"Error importing handler modules: {e}")
-        return
-    # Catches if a handler function is missing in a module.
-    except AttributeError as e:
-        print(f"Error finding handler function in module: {e}")
-        return
-    # Catches any other unexpected errors during handler loading.
-    except Exception as e:
-        print(f"An unexpected error occurred during handler loading: {e}")
+        logger.error("Error: 'routes' key in config must be list")
         return
 
     # Loop through all the routes in the config file to add them to the router.
@@ -87,37 +75,102 @@ def load_routes(router: Router) -> None:
 
         # Ensures that we have the basic arguments that we need if a route is called.
         if not all([method, path, handler_name]):
-            print(f"Warning: Skipping malformed route entry: {route_entry}")
+            logger.warning("Warning: Skipping malformed route entry: %s", route_entry)
             continue
 
-        # Ensures that the handler_name is correct and is in the handler_map defined above.
-        handler = handler_map.get(handler_name)
-        if handler is None:
-            print(
-                f"Warning: Handler '{handler_name}' not found for route {method} {path}. Skipping"
+        # Ensures that the handler_name is correct and is one of the handlers in _HANDLER_SOURCES.
+        # Only the handlers declared there can be used, which avoids arbitrary dynamic imports by string
+        # which can be easy to go wrong with, and it explicitly declares which handlers are expected.
+        handler_source = _HANDLER_SOURCES.get(handler_name)
+        if handler_source is None:
+            logger.warning(
+                "Warning: Handler '%s' not found for route %s %s. Skipping",
+                handler_name,
+                method,
+                path,
             )
             continue
 
+        # We only import a handler's module once a route actually names it, so handler modules (and their
+        # dependencies like jwt or the database driver) that the config doesn't use are never loaded.
+        try:
+            handler = _cached_import(*handler_source)
+        # Catches a specific error when importing handlers.
+        except ImportError as e:
+            logger.error("Error importing handler modules: %s", e)
+            continue
+        # Catches if a handler function is missing in a module.
+        except AttributeError as e:
+            logger.error("Error finding handler function in module: %s", e)
+            continue
+        # Catches any other unexpected errors during handler loading.
+        except Exception as e:
+            logger.error("An unexpected error occurred during handler loading: %s", e)
+            continue
+
         # Here we are binding the arguments of the handler to itself by making it a Tuple
         bound_handler = bind_handler(handler, handler_args)
 
-        router.add_route(method, path, bound_handler)
+        # The method and path become the router's dict keys, interning them means every route (and any
+        # other interned copy of the same string) shares one object, so key comparisons can stop at the
+        # identity check.
+        router.add_route(sys.intern(method.upper()), sys.intern(path), bound_handler)
+
+    # The route table is final now, see Router.freeze().
+    router.freeze()
+    logger.info("Routes loaded from %s", routes_config_path)
 
-    print(f"Routes loaded from {routes_config_path}")
+
+# The binders below build the function that waits for the request object to be given in webserver and
+# passes the rest of the handler args to the handler. The args are copied, so the bound handler has its
+# own tuple/dict.
+# NOTE: functools.partial doesn't fit here since it puts the bound args before the request.
+def _bind_positional(handler, handler_args):
+    args = tuple(handler_args)
+
+    def bound_handler(request):
+        return handler(request, *args)
+
+    return bound_handler
+
+
+def _bind_keywords(handler, handler_args):
+    kwargs = dict(handler_args)
+
+    def bound_handler(request):
+        return handler(request, **kwargs)
+
+    return bound_handler
+
+
+def _bind_single(handler, handler_arg):
+    def bound_handler(request):
+        return handler(request, handler_arg)
+
+    return bound_handler
+
+
+# The JSON config only ever gives us lists, dicts or scalars, so the binder is picked with a single lookup
+# on the exact type. Anything that isn't a list or dict is passed as a single argument.
+_BINDERS = {list: _bind_positional, dict: _bind_keywords}
 
 
 # This returns a function that waits for the request object to be given in webserver and assigns the rest of
 # the handler args to the function.
 def bind_handler(handler, handler_args):
-    if handler_args is None:
+    # No args to bind (missing, or an empty list/dict in the config), so the router can call the handler
+    # directly without going through a wrapper on every request.
+    if handler_args is None or handler_args == [] or handler_args == {}:
         return handler
 
-    def bound_handler(request):
-        if isinstance(handler_args, list):
-            return handler(request, *handler_args)
-        elif isinstance(handler_args, dict):
-            return handler(request, **handler_args)
-        else:
-            return handler(request, handler_args)
+    # We work out how the args have to be passed once here at load time, instead of checking the type of
+    # handler_args on every request.
+    bound_handler = _BINDERS.get(type(handler_args), _bind_single)(
+        handler, handler_args
+    )
 
+    # The bound handler is what ends up in the router, so it has to carry the protection of the handler it
+    # wraps. Deciding this here, once per route, means the auth_middleware never sees an unprotected wrapper.
+    if is_protected(handler):
+        protected_route(bound_handler)
     return bound_handler
@@ -1,67 +1,84 @@
-import os
+import logging
 from typing import Any, Callable, Tuple
-from dotenv import load_dotenv
 import jwt
+from src.decorators import is_protected
+from src.utils.auth_utils import decode_jwt_token
 from src.webserver import Request
 
+logger = logging.getLogger(__name__)
 
-load_dotenv(dotenv_path="../.env")
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "")
-ALGORITHM = os.getenv("ALGORITHM", "HS256")
+# The failure responses never change, so they are built once here and every failed request just returns
+# the shared tuple.
+_RESP_NO_AUTH_HEADER = (
+    401,
+    "text/plain",
+    b"401 Unauthorized: Authorization header missing.",
+)
+_RESP_MALFORMED_AUTH_HEADER = (
+    401,
+    "text/plain",
+    b"401 Unauthorized: Malformed Authorization header.",
+)
+_RESP_TOKEN_EXPIRED = (401, "text/plain", b"401 Unauthorized: Token has expired.")
+_RESP_INVALID_TOKEN = (401, "text/plain", b"401 Unauthorized: Invalid token.")
+_RESP_AUTH_ERROR = (
+    500,
+    "text/plain",
+    b"500 Internal Server Error: Authentication error.",
+)
 
 
 def auth_middleware(next_handler: Callable) -> Callable:
 
     # Check if the next_handler is marked as a protected route.
     # If not, simply pass the request through without authentication.
-    if not getattr(next_handler, "_is_protected", False):
+    if not is_protected(next_handler):
         return next_handler
 
     def wrapper(request: Request, **handler_args: Any) -> Tuple[int, str, bytes]:
-        # Gets the data stored in the Authorization header
-        auth_header = request.headers.get("Authorization")
+        # Gets the data stored in the Authorization header, the server already picked it out while parsing.
+        auth_header = request.auth_header
 
         # If the request has no auth then fails instantly
         if not auth_header:
-            print("Authentication failed: No Authorization header.")
-            return 401, "text/plain", b"401 Unauthorized: Authorization header missing."
+            logger.info("Authentication failed: No Authorization header.")
+            return _RESP_NO_AUTH_HEADER
 
         # Expecting format: "Bearer <token>"
-        parts = auth_header.split(" ")
+        # We check the prefix and slice the token out instead of splitting the header, which would build a
+        # list (and a lower-cased copy of the scheme) on every request. Clients practically always send
+        # "Bearer", other spellings of the scheme are still accepted since it is case-insensitive.
+        if auth_header.startswith("Bearer ") or auth_header[:7].lower() == "bearer ":
+            # Extract the token from the header
+            token = auth_header[7:]
+        else:
+            token = None
 
         # Check if the auth headered is correctly formatted
-        if len(parts) != 2 or parts[0].lower() != "bearer":
-            print("Authentication failed: Malformed Authorization header.")
-            return (
-                401,
-                "text/plain",
-                b"401 Unauthorized: Malformed Authorization header.",
-            )
-
-        # Extract the token from the header
-        token = parts[1]
+        if token is None or " " in token:
+            logger.info("Authentication failed: Malformed Authorization header.")
+            return _RESP_MALFORMED_AUTH_HEADER
 
         try:
-            decoded_payload = jwt.decode(token, SECRET_KEY, ALGORITHM)
+            decoded_payload = decode_jwt_token(token)
 
             request.user = decoded_payload
-            print(f"Authentication successful for user: {request.user.get('username')}")
+            logger.debug(
+                "Authentication successful for user: %s",
+                decoded_payload.get("username"),
+            )
 
             return next_handler(request, **handler_args)
 
         except jwt.ExpiredSignatureError:
-            print("Authentication failed: JWT has expired.")
-            return 401, "text/plain", b"401 Unauthorized: Token has expired."
+            logger.info("Authentication failed: JWT has expired.")
+            return _RESP_TOKEN_EXPIRED
         except jwt.InvalidTokenError:
-            print("Authentication failed: Invalid JWT.")
-            return 401, "text/plain", b"401 Unauthorized: Invalid token."
+            logger.info("Authentication failed: Invalid JWT.")
+            return _RESP_INVALID_TOKEN
         except Exception as e:
             # Catch any other unexpected errors during JWT processing
-            print(f"Authentication failed: An unexpected error occurred: {e}")
-            return (
-                500,
-                "text/plain",
-                b"500 Internal Server Error: Authentication error.",
-            )
+            logger.error("Authentication failed: An unexpected error occurred: %s", e)
+            return _RESP_AUTH_ERROR
 
     return wrapper
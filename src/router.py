@@ -1,4 +1,8 @@
-from typing import Any, Callable, Dict, Optional, Tuple
+import logging
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
 
 
 class Router:
@@ -6,12 +10,19 @@ class Router:
     # the router inspects this, and then decides which specific piece of code (called a "handler") should process
     # that request.
 
+    # A server only ever has one router, but it is read on every request, so we drop the instance __dict__
+    # and keep the attributes in fixed slots.
+    __slots__ = ("routes", "_allowed_methods")
+
     def __init__(self) -> None:
-        # Routes are stored as:
+        # Routes are stored in a single flat dict keyed by the (method, path) pair:
         # self.routes = {
-        #                "METHOD": {
-        #                           "path": {"handler": handler, "handler_args": handler_args,},},}
-        self.routes = {}
+        #                ("METHOD", "path"): {"handler": handler, "handler_args": handler_args,},}
+        # Compared to a dict per method this is one hash and one lookup per request instead of two.
+        # freeze() swaps it for a read-only view once the routes are loaded.
+        self.routes: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # Filled in by freeze(), maps each path to the methods it is registered for.
+        self._allowed_methods: Optional[Dict[str, Tuple[str, ...]]] = None
 
     def add_route(
         self,
@@ -21,28 +32,29 @@ class Router:
         handler_args: Optional[Dict[str, Any]] = None,
     ) -> None:
 
+        # The table is fixed once the server has frozen it, see freeze() below.
+        if self._allowed_methods is not None:
+            raise RuntimeError(
+                f"Cannot add route {method} {path}, the router is already frozen."
+            )
+
         # Always process the HTTP methods with .upper() to ensure consistency
         method = method.upper()
 
-        if method not in self.routes:
-            # Adds a method to the route dictionary if it doesn't exist
-            self.routes[method] = {}
-
         # Finally we create the handler and its arguments for the specific path and method
-        self.routes[method][path] = {
+        self.routes[(method, path)] = {
             "handler": handler,
             "handler_args": handler_args,
         }
-        print(f"Route added: {method} {path}")
+        # One line per route, so this is DEBUG to keep startup quiet with a big routes.json.
+        logger.debug("Route added: %s %s", method, path)
 
     # This method is used by the server to get the handler and its args.
     def get_handler(
         self, method: str, path: str
     ) -> Optional[Tuple[Optional[Callable], Optional[Dict[str, Any]]]]:
 
-        method = method.upper()
-
-        route_info = self.routes.get(method, {}).get(path)
+        route_info = self.get_route_info(method, path)
 
         if route_info:
             return route_info["handler"], route_info["handler_args"]
@@ -50,5 +62,31 @@ class Router:
 
     # This method is used by the auth_middleware to check protection status
     def get_route_info(self, method: str, path: str) -> Optional[Dict[str, Any]]:
-        method = method.upper()
-        return self.routes.get(method, {}).get(path)
+        # add_route() already stored the method upper-cased, and clients practically always send it that way.
+        # So we try the method as-is first and only pay for .upper() (a new string) when that misses.
+        route_info = self.routes.get((method, path))
+        if route_info is None and not method.isupper():
+            route_info = self.routes.get((method.upper(), path))
+        return route_info
+
+    # This method is used by the server to tell a 405 apart from a 404 when get_route_info() finds nothing.
+    def get_allowed_methods(self, path: str) -> List[str]:
+        if self._allowed_methods is not None:
+            return list(self._allowed_methods.get(path, ()))
+        return [method for method, route_path in self.routes if route_path == path]
+
+    # The routes never change once load_routes() is done, so it freezes the router. From then on every lookup
+    # can rely on the table being final, which lets us precompute the path -> methods index here instead of
+    # scanning every route on each 404/405.
+    def freeze(self) -> None:
+        # The table itself becomes read-only as well, so nothing can change a route behind the index's back.
+        self.routes = MappingProxyType(  # type: ignore
+            {key: MappingProxyType(info) for key, info in self.routes.items()}
+        )
+
+        allowed_methods: Dict[str, List[str]] = {}
+        for method, path in self.routes:
+            allowed_methods.setdefault(path, []).append(method)
+        self._allowed_methods = {
+            path: tuple(methods) for path, methods in allowed_methods.items()
+        }
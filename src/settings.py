@@ -0,0 +1,27 @@
+import os
+from dotenv import load_dotenv
+
+# All the settings that come from the environment (or the .env file) live here. The .env file is parsed
+# exactly once, the first time anything imports this module, and every other module just imports the
+# values it needs from here instead of calling load_dotenv() and os.getenv() itself.
+load_dotenv()
+
+# Server
+HOST = os.getenv("HOST")
+PORT = os.getenv("PORT")
+WEB_ROOT_DIR = os.getenv("WEB_ROOT_DIR")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Number of threads handling requests. Idle keep-alive connections don't take one, see WebServer.start().
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "64"))
+# Seconds an idle keep-alive connection is kept open before the server closes it.
+KEEP_ALIVE_TIMEOUT = float(os.getenv("KEEP_ALIVE_TIMEOUT", "10"))
+
+# Database
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+
+# Auth
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "")
+ALGORITHM = os.getenv("ALGORITHM", "HS256")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# bcrypt cost factor, every +1 doubles the time a hash (and so a login) takes. 12 is bcrypt's own default.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
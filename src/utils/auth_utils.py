@@ -1,22 +1,91 @@
-from datetime import datetime, timedelta, timezone
+import base64
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hmac
+import logging
 import os
-from typing import Optional
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 import bcrypt
-from dotenv import load_dotenv
 import jwt
+import orjson
+from src.settings import (
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    ALGORITHM,
+    BCRYPT_ROUNDS,
+    JWT_SECRET_KEY as SECRET_KEY,
+)
 
-load_dotenv(dotenv_path="../.env")
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "")
-ALGORITHM = os.getenv("ALGORITHM", "HS256")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+
+def _b64url_encode(data: bytes) -> bytes:
+    # JWTs use unpadded URL-safe base64 for every segment.
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+# For HS256 (the default) we sign tokens ourselves in create_jwt_token(). The header segment is the same
+# for every token and the key never changes, so both are encoded once here instead of on every login.
+_HS256_HEADER_SEGMENT = _b64url_encode(orjson.dumps({"alg": "HS256", "typ": "JWT"}))
+_SECRET_KEY_BYTES = SECRET_KEY.encode("utf-8")
+# PyJWT would encode the str key to bytes on every decode, so the same bytes are used there too. The
+# algorithm goes in a list since that is what jwt.decode() expects for algorithms=, a bare string would be
+# treated as a collection of characters.
+_ALGORITHMS = [ALGORITHM]
+_TOKEN_LIFETIME_SECONDS = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+logger = logging.getLogger(__name__)
+
+# Claims that PyJWT validates with rules of its own (audience, subject and JWT id). Tokens carrying any
+# of them are always decoded by PyJWT, see _decode_hs256().
+_FAST_PATH_CLAIMS = frozenset(("aud", "sub", "jti"))
+
+# Clients send the same token on every request until it expires, so we keep the payloads of recently seen
+# tokens instead of checking the signature and parsing the payload again each time. Only tokens that
+# decoded successfully are cached, and an entry is dropped as soon as its "exp" has passed so that
+# jwt.decode() gets to raise ExpiredSignatureError as usual.
+# Same LRU setup as the auth row cache in user_repository, the lock is there since every client has its own thread.
+_DECODED_TOKEN_CACHE_SIZE = 4096
+_decoded_token_cache: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+_decoded_token_cache_lock = threading.Lock()
 
 
 def hash_password(password: str) -> str:
     # Function to securely hash passwords using `bcrypt` with some added salt.
-    hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    # Hashing is pure CPU work and it is meant to be slow, with the default 12 rounds it is around a quarter
+    # of a second per password, which caps how many logins and registrations a core can handle. Lower
+    # BCRYPT_ROUNDS to trade attack cost for throughput. Existing hashes keep their own cost since it is
+    # stored in the hash, so check_password() works across changes.
+    hashed_password = bcrypt.hashpw(
+        password.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    )
     return hashed_password.decode("utf-8")
 
 
+# bcrypt releases the GIL while it runs the key schedule, so hashing on plain threads uses every core.
+# hash_passwords_bulk() shares this pool. It is only created the first time it is needed, so importing
+# this module (which every request path does) doesn't set up a pool that the server never uses.
+_hash_executor: Optional[ThreadPoolExecutor] = None
+_hash_executor_lock = threading.Lock()
+
+
+def _get_hash_executor() -> ThreadPoolExecutor:
+    global _hash_executor
+    with _hash_executor_lock:
+        if _hash_executor is None:
+            _hash_executor = ThreadPoolExecutor(
+                max_workers=os.cpu_count() or 1, thread_name_prefix="bcrypt"
+            )
+        return _hash_executor
+
+
+def hash_passwords_bulk(passwords: Sequence[str]) -> List[str]:
+    # Hashes many passwords at once, in the same order. Made for seeding and imports together with
+    # create_users_bulk(), where hashing one password after the other is by far the slowest part.
+    # A single password is still best hashed with hash_password() directly, handing it to the pool would
+    # only add the hop to another thread.
+    return list(_get_hash_executor().map(hash_password, passwords))
+
+
 def check_password(password: str, hashed_password: str) -> bool:
     # Function to verify a plaintext password against a hashed one.
     return bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
@@ -25,24 +94,107 @@ def check_password(password: str, hashed_password: str) -> bool:
 def create_jwt_token(payload: dict) -> str:
     # Function to generate a JWT from a given payload (e.g., `username`, `role`, `expiration_time`).
     to_encode = payload.copy()
-    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire, "iat": datetime.now(timezone.utc)})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    # The "exp"/"iat" claims are unix timestamps, so we put the integers in right away instead of datetimes
+    # that PyJWT (or the fast path below) would have to convert back.
+    now = int(time.time())
+    to_encode["iat"] = now
+    to_encode["exp"] = now + _TOKEN_LIFETIME_SECONDS
+
+    if ALGORITHM != "HS256":
+        # Any other algorithm goes through PyJWT.
+        return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+    # Fast path for HS256: the token is just header.payload.signature, where the signature is an
+    # HMAC-SHA256 of "header.payload". hmac.digest() is the one-shot C implementation (OpenSSL), so we
+    # skip PyJWT's per-call algorithm lookup and header encoding.
+    signing_input = (
+        _HS256_HEADER_SEGMENT + b"." + _b64url_encode(orjson.dumps(to_encode))
+    )
+    signature = hmac.digest(_SECRET_KEY_BYTES, signing_input, "sha256")
+    return (signing_input + b"." + _b64url_encode(signature)).decode("ascii")
+
+
+def _decode_hs256(token: str) -> Optional[Dict[str, Any]]:
+    # The decoding half of the HS256 fast path in create_jwt_token(): check the HMAC ourselves and parse
+    # the payload with orjson instead of going through PyJWT's header parsing, algorithm lookup and
+    # options handling. It only returns a payload when PyJWT would accept the token too, which is always
+    # the case for the tokens we issue. Anything else (another header, a bad signature, claims we don't
+    # check here, an expired token...) returns None and goes through jwt.decode(), so the errors raised
+    # are still PyJWT's own.
+    header_segment, _, rest = token.encode("ascii", "replace").partition(b".")
+    payload_segment, _, signature_segment = rest.partition(b".")
+    if header_segment != _HS256_HEADER_SEGMENT:
+        return None
+
+    signing_input = header_segment + b"." + payload_segment
+    signature = hmac.digest(_SECRET_KEY_BYTES, signing_input, "sha256")
+    # Compared in encoded form with compare_digest() so the check takes the same time however much of the
+    # signature matches.
+    if not hmac.compare_digest(_b64url_encode(signature), signature_segment):
+        return None
+
+    try:
+        payload = orjson.loads(
+            base64.urlsafe_b64decode(
+                payload_segment + b"=" * (-len(payload_segment) % 4)
+            )
+        )
+    except (ValueError, orjson.JSONDecodeError):
+        return None
+    if not isinstance(payload, dict) or not _FAST_PATH_CLAIMS.isdisjoint(payload):
+        return None
+
+    now = time.time()
+    for claim in ("iat", "nbf"):
+        value = payload.get(claim, 0)
+        if type(value) is not int or value > now:
+            return None
+    exp = payload.get("exp")
+    if exp is not None and (type(exp) is not int or exp <= now):
+        return None
+    return payload
+
+
+def decode_jwt_token(token: str) -> Dict[str, Any]:
+    # Function to decode a JWT through the cache above. Raises PyJWT's errors just like jwt.decode() does,
+    # use verify_jwt_token() if you'd rather get None back.
+    with _decoded_token_cache_lock:
+        cached = _decoded_token_cache.get(token)
+        if cached is not None:
+            payload, exp = cached
+            if exp > time.time():
+                _decoded_token_cache.move_to_end(token)
+                # Callers get their own copy so nothing they do to the payload leaks into the cache.
+                return dict(payload)
+            del _decoded_token_cache[token]
+
+    payload = _decode_hs256(token) if ALGORITHM == "HS256" else None
+    if payload is None:
+        payload = jwt.decode(token, _SECRET_KEY_BYTES, algorithms=_ALGORITHMS)
+
+    # Tokens without an expiry are not cached, there would be no point at which we'd check them again.
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        with _decoded_token_cache_lock:
+            _decoded_token_cache[token] = (payload, exp)
+            _decoded_token_cache.move_to_end(token)
+            if len(_decoded_token_cache) > _DECODED_TOKEN_CACHE_SIZE:
+                # Evict the least recently used entry.
+                _decoded_token_cache.popitem(last=False)
+    return dict(payload)
 
 
 def verify_jwt_token(token: str) -> Optional[dict]:
     # Function to validate an incoming JWT and return its decoded payload if valid, or `None` otherwise.
 
     try:
-        decoded_payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return decoded_payload
+        return decode_jwt_token(token)
     except jwt.ExpiredSignatureError:
-        print("Token has expired.")
+        logger.info("Token has expired.")
         return None
     except jwt.InvalidTokenError:
-        print("Invalid token.")
+        logger.info("Invalid token.")
         return None
     except Exception as e:
-        print(f"An unexpected error occurred during token verification: {e}")
+        logger.error("An unexpected error occurred during token verification: %s", e)
         return None
@@ -1,12 +1,63 @@
-import datetime
+from email.utils import formatdate
+import logging
+import queue
+import selectors
 import socket
 import threading
-from typing import Any, Callable, Tuple, Dict, Optional
+import time
+from typing import Any, BinaryIO, Callable, Tuple, Dict, Optional, Union
 import os
 import urllib
 import urllib.parse
 from src.router import Router
 
+# Everything the server reports goes through logging. Messages for every request or connection are DEBUG,
+# so with the default INFO level they are dropped after a level check without ever being formatted, and
+# the ones that do get logged are written by the QueueListener thread set up in server.py instead of by the
+# thread serving the client.
+logger = logging.getLogger(__name__)
+
+# The header names that show up in practically every request. Header names are case-insensitive, so the
+# parser maps each of these to one canonical spelling, whether the client sent "Content-Length" or
+# "content-length". The parsed headers then always share these same str objects instead of fresh copies
+# per request, and code looking a header up only has to try the canonical spelling.
+_COMMON_HEADER_NAMES = (
+    "Accept",
+    "Accept-Encoding",
+    "Accept-Language",
+    "Authorization",
+    "Cache-Control",
+    "Connection",
+    "Content-Encoding",
+    "Content-Length",
+    "Content-Type",
+    "Cookie",
+    "Expect",
+    "Host",
+    "If-Modified-Since",
+    "If-None-Match",
+    "Origin",
+    "Pragma",
+    "Range",
+    "Referer",
+    "Sec-Fetch-Dest",
+    "Sec-Fetch-Mode",
+    "Sec-Fetch-Site",
+    "Transfer-Encoding",
+    "Upgrade",
+    "Upgrade-Insecure-Requests",
+    "User-Agent",
+    "X-Forwarded-For",
+    "X-Forwarded-Proto",
+    "X-Real-IP",
+    "X-Requested-With",
+)
+# Keyed by both the canonical and the lower-case spelling, so the common cases are one dict lookup.
+_CANONICAL_HEADER_NAMES = {
+    **{name: name for name in _COMMON_HEADER_NAMES},
+    **{name.lower(): name for name in _COMMON_HEADER_NAMES},
+}
+
 
 class Request:
     def __init__(
@@ -20,6 +71,7 @@ class Request:
         decoded_body: Optional[str] = None,
         params: Optional[Dict[str, str]] = None,
         user: Optional[Dict[str, Any]] = None,
+        auth_header: Optional[str] = None,
     ) -> None:
 
         self.method = method
@@ -28,14 +80,100 @@ class Request:
         self.headers = headers if headers is not None else {}
         self.body = body if body is not None else b""
         self.web_root_dir = web_root_dir
-        self.decoded_body = decoded_body
+        # Only set if the caller already has the decoded body, otherwise see the decoded_body property.
+        self._decoded_body = decoded_body
         self.params = params if params is not None else {}
         self.user = user
+        # The Authorization header, picked out once while parsing so the auth_middleware doesn't have to
+        # look it up in the headers itself.
+        self.auth_header = auth_header
+
+    @property
+    def decoded_body(self) -> Optional[str]:
+        # The body as text. Most handlers never look at it (the JSON ones parse the raw bytes), so instead of
+        # decoding every body while parsing the request we only decode it here, the first time it's asked for.
+        if self._decoded_body is None and self.body:
+            try:
+                self._decoded_body = self.body.decode("utf-8")
+            except UnicodeDecodeError:
+                # If body cannot be decoded as UTF-8, leave as None since it can be other form of data.
+                return None
+        return self._decoded_body
 
     def __repr__(self) -> str:
         return f"<Request method={self.method} path={self.path} headers={len(self.headers)} body_len={len(self.body)}>"
 
 
+class ClientConnection:
+    # Everything the server keeps about one client connection between two reads. Connections aren't tied
+    # to a thread, whichever worker gets the connection next picks up the buffer where the last one left it.
+    __slots__ = ("sock", "addr", "buffer", "last_active")
+
+    def __init__(self, sock: socket.socket, addr: Tuple[str, int]) -> None:
+        self.sock = sock
+        self.addr = addr
+        # The bytes received but not handled yet, see handle_client().
+        self.buffer = bytearray()
+        # time.monotonic() of the last time the connection was busy, the event loop closes the connection
+        # once it has been idle for longer than the keep-alive timeout.
+        self.last_active = time.monotonic()
+
+    def __repr__(self) -> str:
+        return f"<ClientConnection addr={self.addr} buffered={len(self.buffer)}>"
+
+
+class FileBody:
+    # A response body that is still on disk. Handlers can return this instead of the file's bytes and
+    # send_response() hands the open file to socket.sendfile(), so the kernel copies it straight from the
+    # page cache to the socket (sendfile(2)) without the contents ever passing through Python.
+    # send_response() closes the file once it is sent.
+    def __init__(self, file: BinaryIO, size: int) -> None:
+        self.file = file
+        self.size = size
+
+    def __len__(self) -> int:
+        # So that len(content) gives the Content-Length just like it does for bytes.
+        return self.size
+
+    def __repr__(self) -> str:
+        return f"<FileBody size={self.size}>"
+
+
+# The Date header only changes once a second, so the formatted value is kept together with the second it
+# belongs to and only formatted again once the clock moves on. The pair lives in one tuple that is swapped
+# in a single assignment, so the worker threads always read a matching pair without needing a lock.
+_date_header_cache = (0, b"")
+
+
+def _http_date() -> bytes:
+    # The current time in the format HTTP wants for the Date header (RFC 7231),
+    # e.g. b"Sun, 06 Nov 1994 08:49:37 GMT", already encoded so it can go straight into the response.
+    global _date_header_cache
+    now = int(time.time())
+    cached_second, cached_date = _date_header_cache
+    if now == cached_second:
+        return cached_date
+    date = formatdate(now, usegmt=True).encode("ascii")
+    _date_header_cache = (now, date)
+    return date
+
+
+def _sendmsg_all(client_sock: socket.socket, *buffers: bytes) -> None:
+    # sendall() for several buffers at once. sendmsg() hands all of them to the kernel in one writev-style
+    # call, so they never have to be concatenated into one bytes object first. Like send(), it may only
+    # send part of the data, so we keep going from wherever it stopped.
+    views = [memoryview(buffer) for buffer in buffers if buffer]
+    while views:
+        sent = client_sock.sendmsg(views)
+        while sent:
+            if sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
+
 class WebServer:
     # Class-level constant for HTTP status lines.
     STATUS_LINES = {
@@ -48,14 +186,47 @@ class WebServer:
         403: "Forbidden",
         404: "Not Found",
         405: "Method Not Allowed",
+        413: "Payload Too Large",
         500: "Internal Server Error",
         501: "Not Implemented",  # Useful for methods that are not supported yet.
         # We can add more as needed.
     }
+    # The complete status line for each of the codes above, encoded once when the class is created
+    # instead of formatted and encoded on every response.
+    STATUS_LINE_BYTES = {
+        status_code: f"HTTP/1.1 {status_code} {status_message}\r\n".encode("utf-8")
+        for status_code, status_message in STATUS_LINES.items()
+    }
+    # The header lines that are the same on every response, ready made as bytes as well.
+    KEEP_ALIVE_HEADER_BYTES = b"Connection: keep-alive\r\n"
+    CLOSE_HEADER_BYTES = b"Connection: close\r\n"
+    SERVER_HEADER_BYTES = b"Server: Pratik's HTTP Server\r\n\r\n"
 
     # Max request size in bytes.
     MAX_BUFFER_SIZE = 1024 * 1024 * 10  # 10 MB
 
+    # Bodies at least this big are sent next to the headers with sendmsg() instead of being copied into one
+    # bytes object with them, see send_response(). For smaller ones the copy is cheaper than the extra setup.
+    SENDMSG_MIN_SIZE = 16 * 1024
+
+    # Size of the chunk each worker thread receives into, see serve_connections().
+    RECV_CHUNK_SIZE = 64 * 1024
+
+    # Default number of threads handling requests, started once in start(). Idle keep-alive connections
+    # wait in the event loop and not in a worker, so this only has to cover the requests being handled at
+    # once (handlers waiting on the database or on bcrypt included), not every connected client.
+    WORKER_THREADS = 64
+
+    # Default number of seconds a connection may sit idle between requests before the event loop closes it.
+    # It's also the socket timeout for sending a response to a client that stopped reading.
+    KEEP_ALIVE_TIMEOUT = 10.0
+
+    # How often (in seconds) the event loop looks for idle connections to close.
+    IDLE_SWEEP_INTERVAL = 1.0
+
+    # Max number of connections the kernel queues up for us before we accept() them.
+    LISTEN_BACKLOG = 1024
+
     SUPPORTED_HTTP_METHODS = {
         "GET",
         "POST",
@@ -66,7 +237,15 @@ class WebServer:
         "PATCH",
     }
 
-    def __init__(self, host: str, port: str, web_root_dir: str, router: Router) -> None:
+    def __init__(
+        self,
+        host: str,
+        port: str,
+        web_root_dir: str,
+        router: Router,
+        worker_threads: Optional[int] = None,
+        keep_alive_timeout: Optional[float] = None,
+    ) -> None:
         # Initialize the server with the host, port, and web root directory.
         # The host is the IP address or hostname of the server.
         # The port is the port number on which the server will listen for incoming connections.
@@ -82,13 +261,58 @@ class WebServer:
             )
         self.router = router
         self.middleware_functions = []
+        # Handler -> the handler wrapped in every middleware, see get_handler_chain().
+        self.handler_chains: Dict[Callable, Callable] = {}
+        self.worker_threads = (
+            worker_threads if worker_threads is not None else self.WORKER_THREADS
+        )
+        self.keep_alive_timeout = (
+            keep_alive_timeout
+            if keep_alive_timeout is not None
+            else self.KEEP_ALIVE_TIMEOUT
+        )
+        # Connections with something to read, waiting for a worker thread, see poll_connections().
+        self.connection_queue: "queue.Queue[ClientConnection]" = queue.Queue()
+        # Connections a worker is done with for now, waiting to go back into the selector,
+        # see park_connection().
+        self.parked_connections: "queue.SimpleQueue[ClientConnection]" = (
+            queue.SimpleQueue()
+        )
+        # Set up by start(). The selector is only ever touched by the event loop thread, workers hand
+        # connections back through parked_connections and wake the loop up through the socket pair.
+        self.server_socket: Optional[socket.socket] = None
+        self.selector: Optional[selectors.BaseSelector] = None
+        self.wakeup_recv: Optional[socket.socket] = None
+        self.wakeup_send: Optional[socket.socket] = None
+        self.last_idle_sweep = 0.0
 
     def add_middleware(self, middleware_func: Callable) -> None:
         # Adds a middleware function to the server.
         # Middleware functions are called before the main request handler.
 
         self.middleware_functions.append(middleware_func)
-        print(f"Middleware added: {middleware_func.__name__}")
+        # Chains built so far are missing the new middleware.
+        self.handler_chains.clear()
+        logger.info("Middleware added: %s", middleware_func.__name__)
+
+    def get_handler_chain(self, handler: Callable) -> Callable:
+        # Here we create the nested function from the middleware1(middleware2(...(handler))).
+        # What it essentially does is build a chain of function inside a function inside a function...
+        # Yes, yes I know this is an inception reference!
+        # But we are applying the same logic as the movie by nesting the handler function.
+        # The handler is first resolved since it is the innermost function and we get the content
+        # that bubbles up through all the middleware functions and
+        # only then do we get the status, content_type and content that we return at the end.
+        # The middleware only decide how to wrap a handler (e.g. auth_middleware checks if it is protected),
+        # so the chain is the same for every request to a route. We build it on the first request and reuse it.
+        chain = self.handler_chains.get(handler)
+        if chain is None:
+            chain = handler
+            for middleware in reversed(self.middleware_functions):
+                chain = middleware(chain)
+            # Two threads may build the same chain at once, that's harmless since both results are identical.
+            self.handler_chains[handler] = chain
+        return chain
 
     def start(self) -> None:
         # Create the socket object that the client will connect to.
@@ -97,39 +321,152 @@ class WebServer:
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         # Binds the server socket to the host and port.
         server_socket.bind((self.host, self.port))
-        # The backlog is set to 128, which is the maximum number of queued connections.
-        server_socket.listen(128)
-        print(f"Server started at http://{self.host}:{self.port}")
+        # The backlog is the maximum number of queued connections, same as the default of nginx.
+        server_socket.listen(self.LISTEN_BACKLOG)
+        # The event loop only ever waits in select(), an accept() that finds nothing must not block it.
+        server_socket.setblocking(False)
+        self.server_socket = server_socket
+        logger.info("Server started at http://%s:%s", self.host, self.port)
+
+        # One thread (this one) runs the event loop. It watches the listening socket and every idle client
+        # connection with a selector (epoll on Linux) and only hands a connection to a worker thread once
+        # there is something to read on it. An idle keep-alive connection costs a selector entry instead of
+        # a whole thread blocked in recv(), so a few workers can serve many more connected clients.
+        self.selector = selectors.DefaultSelector()
+        # Workers wake the event loop up by writing a byte to this pair when they hand a connection back.
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.selector.register(server_socket, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        self.last_idle_sweep = time.monotonic()
+
+        # Instead of starting a new thread for every connection, which costs a thread creation and teardown
+        # each time and has no upper limit under load, a fixed number of worker threads is started here once.
+        # Each of them takes the next readable connection from the queue and handles what it sent.
+        for _ in range(self.worker_threads):
+            worker = threading.Thread(target=self.serve_connections, daemon=True)
+            worker.start()
+            # A daemon thread is a background thread that does not prevent the main program from exiting.
+            # You want the server to shut down when the main program is told to,
+            # without waiting for every single client connection to wrap up.
 
         try:
             while True:
-                # Accept incoming connections.
-                # The accept method blocks until a connection is made.
-                client_socket, client_address = server_socket.accept()
-                print(f"Accepted connection from {client_address}")
-
-                # We are using threading here to avoid blocking or synchronous behavior.
-                # Each client connection will be handled in a separate thread.
-                # This allows multiple clients to connect to the server at the same time.
-                client_handler = threading.Thread(
-                    target=self.handle_client,
-                    args=(client_socket, client_address),
-                    daemon=True,
-                )
-                client_handler.start()
-                # A daemon thread is a background thread that does not prevent the main program from exiting.
-                # You want the server to shut down when the main program is told to,
-                # without waiting for every single client connection to wrap up.
+                self.poll_connections()
         except KeyboardInterrupt:
             # Handles Ctrl+C shut down the server.
-            print("\nServer shutting down.")
+            logger.info("Server shutting down.")
         finally:
+            # Close the idle client connections, the ones a worker has are closed by the process exiting.
+            for key in list(self.selector.get_map().values()):
+                if key.data is not None:
+                    key.data.sock.close()
+            self.selector.close()
+            self.wakeup_recv.close()
+            self.wakeup_send.close()
             # Ensure the server socket is closed when the program exits.
             server_socket.close()
-            print("Server socket closed.")
+            logger.info("Server socket closed.")
+
+    def poll_connections(self, timeout: Optional[float] = None) -> None:
+        # One round of the event loop, see start(). Waits until a socket is ready, at most timeout seconds
+        # (IDLE_SWEEP_INTERVAL by default), and deals with every socket that is.
+        if timeout is None:
+            timeout = self.IDLE_SWEEP_INTERVAL
+        for key, _ in self.selector.select(timeout):
+            connection = key.data
+            if connection is not None:
+                # A client sent something. The selector stops watching the connection while a worker has it,
+                # the worker hands it back with park_connection() once it has read and answered everything.
+                self.selector.unregister(connection.sock)
+                self.connection_queue.put(connection)
+            elif key.fileobj is self.wakeup_recv:
+                self.register_parked_connections()
+            else:
+                self.accept_connection()
+
+        now = time.monotonic()
+        if now - self.last_idle_sweep >= self.IDLE_SWEEP_INTERVAL:
+            self.last_idle_sweep = now
+            self.close_idle_connections(now)
+
+    def accept_connection(self) -> None:
+        # Accepts a new client and adds it to the selector, it goes to a worker once it sent something.
+        try:
+            client_socket, client_address = self.server_socket.accept()
+        except (BlockingIOError, InterruptedError):
+            # The client was gone again before we got to it.
+            return
+        except OSError as e:
+            # E.g. out of file descriptors, the connection stays in the backlog until we can take it.
+            logger.warning("Error accepting connection: %s", e)
+            return
+        logger.debug("Accepted connection from %s", client_address)
+        # The workers read from a socket only once the selector saw it is readable, so that recv never waits.
+        # The timeout is a safeguard for sending, so a client that stops reading can't hold a worker forever.
+        client_socket.settimeout(self.keep_alive_timeout)
+        self.selector.register(
+            client_socket,
+            selectors.EVENT_READ,
+            ClientConnection(client_socket, client_address),
+        )
+
+    def register_parked_connections(self) -> None:
+        # Puts the connections the workers handed back into the selector again, see park_connection().
+        # The wakeup bytes are drained first, a connection parked after that sends a new one.
+        try:
+            while self.wakeup_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while True:
+            try:
+                connection = self.parked_connections.get_nowait()
+            except queue.Empty:
+                break
+            self.selector.register(connection.sock, selectors.EVENT_READ, connection)
+
+    def close_idle_connections(self, now: float) -> None:
+        # Closes the connections in the selector that have been idle for longer than the keep-alive timeout.
+        # This replaces the socket timeout that used to end a worker's recv() on a quiet connection.
+        deadline = now - self.keep_alive_timeout
+        for key in list(self.selector.get_map().values()):
+            connection = key.data
+            if connection is not None and connection.last_active < deadline:
+                logger.debug("Connection timeout for %s. Closing.", connection.addr)
+                self.selector.unregister(connection.sock)
+                connection.sock.close()
+
+    def park_connection(self, connection: ClientConnection) -> None:
+        # Called by a worker for a connection that stays open but has no complete request left to handle.
+        # The worker can't touch the selector itself, so the connection goes on a queue and the event loop
+        # is woken up to register it again.
+        connection.last_active = time.monotonic()
+        self.parked_connections.put(connection)
+        try:
+            self.wakeup_send.send(b"\0")
+        except BlockingIOError:
+            # The pair is already full of wakeups the loop hasn't read yet, so it is woken up anyway.
+            pass
+
+    def serve_connections(self) -> None:
+        # The loop every worker thread runs, see start().
+        # recv() would allocate a new bytes object for every chunk it reads, only for us to copy it into the
+        # connection's buffer and throw it away. Instead every worker receives into this one chunk,
+        # allocated once per thread, and we copy straight from it into the buffer.
+        recv_chunk = bytearray(self.RECV_CHUNK_SIZE)
+        while True:
+            connection = self.connection_queue.get()
+            try:
+                self.handle_client(connection, recv_chunk)
+            except Exception as e:
+                # handle_client() deals with its own errors, this only makes sure the worker survives
+                # anything that slips through (e.g. the client being gone before we close the socket).
+                logger.exception("Unhandled error for %s: %s", connection.addr, e)
 
     def parse_request_from_buffer(
-        self, buffer: bytes
+        self, buffer: Union[bytes, bytearray]
     ) -> Tuple[Optional[Dict[str, Any]], int]:
 
         # Find the end of the headers section (double CRLF)
@@ -143,30 +480,29 @@ class WebServer:
         header_section_bytes = buffer[: header_end_index + 4]
 
         try:
-            # Decode the bytes to a string.
-            header_string = header_section_bytes.decode("utf-8")
-
-            print(
-                f"--- Request received ---\n{header_string.strip()}\n--- End of Request ---"
-            )
+            logger.debug("Request received:\n%r", header_section_bytes)
 
             # Split by CRLF (\r\n) to get individual lines of the request.
-            request_lines = header_string.split("\r\n")
+            # We stay on bytes here instead of decoding the whole header block first, the HTTP syntax is
+            # plain ASCII so only the small pieces we actually keep get decoded below.
+            request_lines = header_section_bytes.split(b"\r\n")
 
             if not request_lines or not request_lines[0]:
                 # If the first line is empty, we have a malformed request.
                 raise ValueError("Empty request line")
 
             # The first line of the request contains the method, path, and HTTP version.
-            first_line_parts = request_lines[0].strip().split(" ")
+            first_line_parts = request_lines[0].strip().split(b" ")
 
             if len(first_line_parts) != 3:
                 # If there are not enough parts, we have a malformed request.
                 raise ValueError("Malformed request line")
             # Extract all the components of the first line.
-            method = first_line_parts[0].upper()
-            path_with_query = first_line_parts[1]
-            version = first_line_parts[2]
+            # A bad byte in them raises UnicodeDecodeError, which is a ValueError so it ends up as a 400.
+            method = first_line_parts[0].decode("ascii").upper()
+            # The path is decoded as UTF-8 so clients that send it unescaped still work.
+            path_with_query = first_line_parts[1].decode("utf-8")
+            version = first_line_parts[2].decode("ascii")
 
             path, params = self.parse_url_path_and_query(path_with_query)
 
@@ -188,30 +524,40 @@ class WebServer:
                     # This checks for an empty line which signals the end of the headers.
                     break
 
-                if ":" in line:
-                    # Identifies the header lines by ":" and splits the string from the 1st ":".
-                    header_name, header_val = line.split(":", 1)
-                    headers[header_name.strip()] = header_val.strip()
+                # Identifies the header lines by ":" and splits the line from the 1st ":".
+                # partition() does both in one pass over the line, sep is empty if there is no ":".
+                header_name, sep, header_val = line.partition(b":")
+                if sep:
+                    header_name = header_name.strip().decode("ascii")
+                    # Common headers are stored under their canonical name, see _COMMON_HEADER_NAMES.
+                    canonical_name = _CANONICAL_HEADER_NAMES.get(header_name)
+                    if canonical_name is None:
+                        canonical_name = _CANONICAL_HEADER_NAMES.get(
+                            header_name.lower(), header_name
+                        )
+                    # Header values are latin-1 in HTTP, which also maps every byte so this can't fail.
+                    headers[canonical_name] = header_val.strip().decode("latin-1")
                 else:
                     # Malformed header line, could indicate a bad request
-                    raise ValueError(f"Malformed header line: '{line.strip()}'")
+                    raise ValueError(
+                        f"Malformed header line: '{line.strip().decode('latin-1')}'"
+                    )
 
             # Parsing the request body for POST, PUT, PATCH methods.
             body = b""
-            # Get Content-Length header value, case-insensitive and safe.
-            content_length_str = headers.get("Content-Length") or headers.get(
-                "content-length"
-            )
+            # Get Content-Length header value. The parser stored it under its canonical name whatever case
+            # the client sent, so one lookup covers them all.
+            content_length_str = headers.get("Content-Length")
             content_length = 0
 
             if content_length_str:
-                try:
-                    # Converting str to int.
-                    content_length = int(content_length_str)
-                    if content_length < 0:
-                        raise ValueError("Negative Content-Length not allowed.")
-                except ValueError:
+                # Content-Length may only be ASCII digits, so checking that first covers negative numbers,
+                # signs and garbage alike and int() can't fail afterwards. isdigit() alone would also let
+                # through characters like "²" that int() doesn't accept.
+                if not (content_length_str.isascii() and content_length_str.isdigit()):
                     raise ValueError("Invalid Content-Length header.")
+                # Converting str to int.
+                content_length = int(content_length_str)
 
             # We check if the entire body has been received
             body_start_offset = header_end_index + 4
@@ -220,28 +566,27 @@ class WebServer:
                 return None, 0
 
             # We read the request body only if the header+body length < buffer.
-            body = buffer[body_start_offset : body_start_offset + content_length]
+            # The body is copied out as bytes through a memoryview, slicing a bytearray would make a
+            # bytearray copy first. The view is released right away since handle_client() resizes the buffer.
+            with memoryview(buffer) as buffer_view:
+                body = buffer_view[
+                    body_start_offset : body_start_offset + content_length
+                ].tobytes()
             # Gives a ending point that we can use in the buffer to seperate requests
             bytes_consumed = body_start_offset + content_length
 
-            # We define "decoded_request_body" outside since there might be requests without any body.
-            decoded_body = None
-            if body:
-                try:
-                    decoded_body = body.decode("utf-8")
-                    print(f"Request Body: {decoded_body}")
-                except UnicodeDecodeError:
-                    # If body cannot be decoded as UTF-8, leave as None since it can be other form of data.
-                    decoded_body = None
+            # Same single lookup as Content-Length, done here once for the auth_middleware.
+            auth_header = headers.get("Authorization")
 
+            # The body is decoded by Request.decoded_body, only if a handler asks for it.
             return {
                 "method": method,
                 "path": path,
                 "version": version,
                 "headers": headers,
                 "body": body,
-                "decoded_body": decoded_body,
                 "params": params,
+                "auth_header": auth_header,
             }, bytes_consumed
 
         except ValueError as e:
@@ -262,19 +607,28 @@ class WebServer:
         # We extract the path from the parsed_url
         decoded_path = urllib.parse.unquote(parsed_url.path)
 
-        # Parse the query string into a dictionary
-        query_params_raw = urllib.parse.parse_qs(
-            parsed_url.query, keep_blank_values=True, encoding="utf-8"
-        )
+        # Most requests have no query string at all.
+        if not parsed_url.query:
+            return decoded_path, {}
 
-        # The values in query_params_raw are lists (e.g., {'q': ['search_term']}).
-        # Often, if you expect single values, you might want to extract them.
-        query_params = {}
-        for key, values in query_params_raw.items():
-            if len(values) == 1:
-                query_params[key] = values[0]  # Take the single value
+        # Parse the query string into a dictionary.
+        # parse_qsl() gives us the (key, value) pairs in order. parse_qs() would put every value in a list
+        # (e.g., {'q': ['search_term']}) that we'd then have to unwrap again, since usually a key only comes
+        # once. So we build the dict in one pass and only make a list for keys that repeat.
+        query_params: Dict[str, Any] = {}
+        for key, value in urllib.parse.parse_qsl(
+            parsed_url.query, keep_blank_values=True, encoding="utf-8"
+        ):
+            previous = query_params.get(key)
+            if previous is None:
+                query_params[key] = value  # Take the single value
+            elif isinstance(previous, list):
+                previous.append(value)
             else:
-                query_params[key] = values  # Keep as list for multiple values
+                query_params[key] = [
+                    previous,
+                    value,
+                ]  # Keep as list for multiple values
 
         return decoded_path, query_params
 
@@ -283,62 +637,119 @@ class WebServer:
         client_sock: socket.socket,
         status_code: int,
         content_type: str,
-        content: bytes,
-    ) -> None:
+        content: Union[bytes, FileBody],
+        keep_alive: bool = True,
+    ) -> bool:
         # Logic to build and send the HTTP response.
-
-        # We look up the status code message in the STATUS_LINE dict in the class.
-        status_message = self.STATUS_LINES.get(status_code, "Unknown Status")
-
-        # Here we create the first line of response
-        response_line = f"HTTP/1.1 {status_code} {status_message}\r\n"
-
-        # Next we make the headers in form of a dict so that it is easy to handle.
-        # The connection is set to keep-alive for success, close for errors
-        headers = {
-            "Content-Type": content_type,
-            "Content-Length": len(content),
-            "Connection": "keep-alive" if status_code == 200 else "close",
-            "Date": datetime.datetime.today().date(),
-            "Server": "Pratik's HTTP Server",
-        }
-        # Combine the headers and make it into a str.
-        header_lines = ""
-        for name, value in headers.items():
-            header_lines += f"{name}: {value}\r\n"
-
-        # Add an empty line to signal the end of the header.
-        header_lines += "\r\n"
-
-        # Combine the first line, headers and content, while we encode it.
-        full_response_bytes = (
-            response_line.encode("utf-8") + header_lines.encode("utf-8") + content
+        # Returns True if the connection can stay open for the next request, False if it has to be closed.
+
+        # HTTP/1.1 connections are persistent by default, so we only close them when the caller asks for it
+        # (the client sent "Connection: close" or the connection is in a bad state) or on a server error.
+        # A 404 or a 401 is a normal answer and the client is free to send the next request right away.
+        keep_alive = keep_alive and status_code < 500
+
+        # We look up the ready made first line of the response in the STATUS_LINE_BYTES dict in the class.
+        response_line = self.STATUS_LINE_BYTES.get(status_code)
+        if response_line is None:
+            response_line = f"HTTP/1.1 {status_code} Unknown Status\r\n".encode("utf-8")
+
+        # Next we collect the pieces of the head as bytes in a list and join them once at the end, instead of
+        # growing a str header by header and encoding it afterwards.
+        header_bytes = b"".join(
+            (
+                response_line,
+                b"Content-Type: ",
+                content_type.encode("utf-8"),
+                b"\r\nContent-Length: ",
+                str(len(content)).encode("ascii"),
+                b"\r\n",
+                (
+                    self.KEEP_ALIVE_HEADER_BYTES
+                    if keep_alive
+                    else self.CLOSE_HEADER_BYTES
+                ),
+                b"Date: ",
+                _http_date(),
+                b"\r\n",
+                # The Server header never changes, so it is ready made in the class too.
+                # It also carries the empty line that signals the end of the head.
+                self.SERVER_HEADER_BYTES,
+            )
         )
 
         try:
-            # Sending the response to the client.
-            client_sock.sendall(full_response_bytes)
-            print(
-                f"Sent response with status {status_code} and {len(content)} bytes of content to {client_sock.getpeername()}"
+            if isinstance(content, FileBody):
+                # The headers go out first and then the kernel sends the file itself.
+                try:
+                    client_sock.sendall(header_bytes)
+                    client_sock.sendfile(content.file, 0, content.size)
+                finally:
+                    content.file.close()
+            elif len(content) >= self.SENDMSG_MIN_SIZE and hasattr(
+                client_sock, "sendmsg"
+            ):
+                # Big bodies are sent as they are, right behind the headers (sendmsg() is not on Windows).
+                _sendmsg_all(client_sock, header_bytes, content)
+            else:
+                # Sending the head and the content together to the client.
+                client_sock.sendall(header_bytes + content)
+            logger.debug(
+                "Sent response with status %s and %s bytes of content",
+                status_code,
+                len(content),
             )
+            return keep_alive
         except Exception as e:
             # Catches any unknown errors.
-            print(f"Error sending response to {client_sock.getpeername()}: {e}")
+            # No getpeername() here, it raises too once the client has gone away.
+            logger.warning("Error sending response: %s", e)
+            # We don't know how much of the response made it out, so the connection can't be reused.
+            return False
 
     def handle_client(
-        self, client_sock: socket.socket, client_addr: Tuple[str, int]
+        self, connection: ClientConnection, recv_chunk: Optional[bytearray] = None
     ) -> None:
 
-        # Handles a single client connection by receiving request, processing it, and sends a response.
-
-        # Buffer specific to this client connection.
-        client_buffer = b""
-        # The timeout is a safeguard. It protects your server from waiting indefinitely
-        # on misbehaving or slow clients.
-        client_sock.settimeout(10.0)
+        # Handles a client connection whose socket is readable: receives what the client sent, handles every
+        # complete request in the buffer and sends the responses. If the connection stays open it goes back
+        # to the event loop until the client sends more, otherwise it is closed here.
+        client_sock = connection.sock
+        client_addr = connection.addr
+        # Buffer specific to this client connection. It is a bytearray so that appending what we receive and
+        # dropping the requests we handled both work in place. With bytes every += and every slice copied the
+        # whole rest of the buffer, which adds up quickly with pipelined requests.
+        client_buffer = connection.buffer
+        if recv_chunk is None:
+            recv_chunk = bytearray(self.RECV_CHUNK_SIZE)
+        # Whether the connection goes back to the event loop instead of being closed.
+        keep_open = False
 
         try:
-            # Loop to handle multiple requests on a persistent connection.
+            # The selector saw the socket readable, so this returns right away. We read only once, whatever
+            # the client sends next is for the event loop to notice and not for this worker to wait on.
+            received = client_sock.recv_into(recv_chunk)
+            if not received:
+                # Client might have disconnected, so we close the connection.
+                logger.debug("Client %s disconnected.", client_addr)
+                return
+
+            client_buffer += memoryview(recv_chunk)[:received]
+
+            # Check for maximum buffer size to prevent memory exhaustion from malicious/bad clients
+            if len(client_buffer) > self.MAX_BUFFER_SIZE:
+                logger.warning(
+                    "Buffer overflow for %s. Closing connection.", client_addr
+                )
+                self.send_response(
+                    client_sock,
+                    413,
+                    "text/plain",
+                    b"413 Payload Too Large: Request or buffered data exceeds limit.",
+                    keep_alive=False,
+                )
+                return
+
+            # Loop to handle every request in the buffer, a client can pipeline several at once.
             while True:
                 # This receives the client's complete request.
                 parsed_components, consumed_bytes = self.parse_request_from_buffer(
@@ -347,8 +758,9 @@ class WebServer:
 
                 if parsed_components:
                     # If we enter here, we have a request that was successfully parsed.
-                    # Hence we remove consumed bytes from buffer.
-                    client_buffer = client_buffer[consumed_bytes:]
+                    # Hence we remove consumed bytes from buffer. Deleting from the front of a bytearray
+                    # only moves its start, the bytes of the next requests are not copied.
+                    del client_buffer[:consumed_bytes]
 
                     request = Request(
                         method=parsed_components["method"],
@@ -357,8 +769,14 @@ class WebServer:
                         headers=parsed_components["headers"],
                         body=parsed_components["body"],
                         web_root_dir=self.web_root_dir,
-                        decoded_body=parsed_components["decoded_body"],
                         params=parsed_components.get("params"),
+                        auth_header=parsed_components.get("auth_header"),
+                    )
+
+                    # The client can ask us to close the connection after this request.
+                    connection_header = request.headers.get("Connection")
+                    keep_alive = connection_header is None or "close" not in (
+                        token.strip() for token in connection_header.lower().split(",")
                     )
 
                     # We use get_route_info to get all route information.
@@ -369,26 +787,32 @@ class WebServer:
                     if route_info:
                         # Since .get_route_info() will return a dict with handler_function, handler_args
                         final_handler = route_info["handler"]
+                    elif self.router.get_allowed_methods(request.path):
+                        # The path exists but not for this method. Handlers are registered per method,
+                        # so this is the only place that has to answer with a 405.
+                        if not self.send_response(
+                            client_sock,
+                            405,
+                            "text/plain",
+                            b"405 Method Not Allowed",
+                            keep_alive=keep_alive,
+                        ):
+                            break
+                        continue
                     else:
                         # Returns if the a route is not found for the specific method and path.
-                        self.send_response(
+                        if not self.send_response(
                             client_sock,
                             404,
                             "text/plain",
                             b"404 Not Found: Path not found.",
-                        )
-                        break
+                            keep_alive=keep_alive,
+                        ):
+                            break
+                        continue
 
-                    # Here we create the nested function from the middleware1(middleware2(...(handler))).
-                    # What it essentially does is build a chain of function inside a function inside a function...
-                    # Yes, yes I know this is an inception reference!
-                    # But we are applying the same logic as the movie by nesting the handler function.
-                    # The handler is first resolved since it is the innermost function and we get the content
-                    # that bubbles up through all the middleware functions and
-                    # only then do we get the status, content_type and content that we return at the end
-                    wrapper_handler = final_handler
-                    for middleware in reversed(self.middleware_functions):
-                        wrapper_handler = middleware(wrapper_handler)
+                    # Wraps the handler in all the middleware, see get_handler_chain().
+                    wrapper_handler = self.get_handler_chain(final_handler)
 
                     try:
                         # We call all the nested functions and pass the handler_args as arbitrary keyword args
@@ -396,69 +820,78 @@ class WebServer:
                             wrapper_handler(request)
                         )
                         # Sends the response depending on what the nested function returns.
-                        self.send_response(
+                        if not self.send_response(
                             client_sock,
                             response_status,
                             response_content_type,
                             response_content,
-                        )
+                            keep_alive=keep_alive,
+                        ):
+                            break
                     except TypeError as te:
                         # Catches cases where handler args don't match.
-                        print(f"Handler argument mismatch for {request.path}: {te}")
+                        logger.error(
+                            "Handler argument mismatch for %s: %s", request.path, te
+                        )
                         self.send_response(
                             client_sock,
                             500,
                             "text/plain",
                             b"500 Internal Server Error: Handler signature mismatch.",
+                            keep_alive=False,
                         )
                         break
                     except Exception as e:
                         # Catches all other exceptions.
-                        print(f"Error executing handler for {request.path}: {e}")
+                        logger.error(
+                            "Error executing handler for %s: %s", request.path, e
+                        )
                         self.send_response(
                             client_sock,
                             500,
                             "text/plain",
                             b"500 Internal Server Error: Handler error.",
+                            keep_alive=False,
                         )
                         break
                     # To ensure that we have the persistent connection open
                     continue
                 else:
-                    # There might be a case where there is an incomplete request in buffer.
-                    # Hence we need to read more from the socket.
-                    data = client_sock.recv(4096)
-                    if not data:
-                        # Client might have disconnected, so we break loop
-                        print(f"Client {client_addr} disconnected.")
-                        break
-
-                    client_buffer += data
-
-                    # Check for maximum buffer size to prevent memory exhaustion from malicious/bad clients
-                    if len(client_buffer) > self.MAX_BUFFER_SIZE:
-                        print(f"Buffer overflow for {client_addr}. Closing connection.")
-                        self.send_response(
-                            client_sock,
-                            413,
-                            "text/plain",
-                            b"413 Payload Too Large: Request or buffered data exceeds limit.",
-                        )
-                        break
+                    # The buffer is empty or only holds the start of a request, the rest of it (or the next
+                    # request) comes when the client sends more. Until then the connection waits in the
+                    # event loop instead of in this worker.
+                    keep_open = True
+                    break
 
         except socket.timeout:
-            print(f"Connection timeout for {client_addr}. Closing.")
+            logger.debug("Send timeout for %s. Closing.", client_addr)
         except ValueError as e:
             # Catch parsing errors or invalid request formats.
-            print(f"Bad Request Error for {client_addr}: {e}")
-            self.send_response(client_sock, 400, "text/plain", str(e).encode("utf-8"))
+            logger.info("Bad Request Error for %s: %s", client_addr, e)
+            # We can't tell where the next request would start in the buffer, so the connection is closed.
+            self.send_response(
+                client_sock,
+                400,
+                "text/plain",
+                str(e).encode("utf-8"),
+                keep_alive=False,
+            )
         except Exception as e:
             # Catch any other unexpected errors during request processing.
-            print(f"Internal Server Error for {client_addr}: {e}")
+            logger.error("Internal Server Error for %s: %s", client_addr, e)
             self.send_response(
-                client_sock, 500, "text/plain", b"500 Internal Server Error."
+                client_sock,
+                500,
+                "text/plain",
+                b"500 Internal Server Error.",
+                keep_alive=False,
             )
         finally:
-            # Ensure the client socket is closed.
-            print(f"Connection closed for {client_sock.getpeername()}")
-            client_sock.close()
+            if keep_open:
+                self.park_connection(connection)
+            else:
+                # Ensure the client socket is closed.
+                # We log the address we got from accept() since getpeername() fails once the client is gone,
+                # which would skip closing the socket.
+                logger.debug("Connection closed for %s", client_addr)
+                client_sock.close()
@@ -2,6 +2,7 @@ import pytest
 import json
 import logging
 from src.webserver import Request
+from src.handlers import api_handlers
 from src.handlers.api_handlers import json_response, get_data, post_data
 
 
@@ -25,8 +26,8 @@ class TestApiHandlers:
         def no_op_decorator(func):
             return func
 
-        mocker.patch(
-            "src.handlers.api_handlers.protected_route", side_effect=no_op_decorator
+        mocker.patch.object(
+            api_handlers, "protected_route", side_effect=no_op_decorator
         )
 
     #### JSON_RESPONSE() TESTS ####
@@ -38,7 +39,7 @@ class TestApiHandlers:
         assert json.loads(body.decode("utf-8")) == {"key": "value"}
 
     # Test json_response's error handling while encoding.
-    def test_json_response_encoding_failure(self):
+    def test_json_response_encoding_failure(self, caplog):
 
         # Create an object that cannot be JSON serialized
         class NonSerializable:
@@ -47,19 +48,16 @@ class TestApiHandlers:
         status, content_type, body = json_response(200, {"bad_data": NonSerializable()})
         assert status == 500
         assert content_type == "text/plain"
-        assert (
-            b"500 Internal Server Error: Object of type NonSerializable is not JSON serializable."
-            in body
-        )
+        # The error details are logged but never sent to the client.
+        assert body == b"500 Internal Server Error"
+        assert "Type is not JSON serializable: NonSerializable" in caplog.text
 
-    # Test json_response's error handling for a general exception during encoding.
+    # Test that json_response doesn't swallow errors that have nothing to do with serializing.
     def test_json_response_general_exception(self, mocker):
 
-        mocker.patch("json.dumps", side_effect=Exception("Test Error"))
-        status, content_type, body = json_response(200, {"key": "value"})
-        assert status == 500
-        assert content_type == "text/plain"
-        assert b"500 Internal Server Error: Test Error." in body
+        mocker.patch("orjson.dumps", side_effect=Exception("Test Error"))
+        with pytest.raises(Exception, match="Test Error"):
+            json_response(200, {"key": "value"})
 
     #### GET_DATA TESTS ####
     # Test get_data with an authenticated user.
@@ -116,7 +114,7 @@ class TestApiHandlers:
 
         assert status == 500
         assert content_type == "text/plain"
-        assert body.startswith(b"500 Internal Server Error: ")
+        assert body.startswith(b"500 Internal Server Error")
 
     #### POST_DATA() TESTS ####
     # Test post_data with valid JSON data and an authenticated user.
@@ -176,17 +174,18 @@ class TestApiHandlers:
         assert content_type == "text/plain"
         assert body == b"400 Bad Request: Invalid JSON in request body."
 
-    # Test post_data with a request body that causes UnicodeDecodeError.
-    def test_post_data_unicode_decode_error(self, mock_request):
+    # Test post_data with a request body that is not valid UTF-8.
+    def test_post_data_invalid_utf8(self, mock_request):
         mock_request.method = "POST"
         mock_request.path = "/api/data"
         # Simulate a body that cannot be decoded as utf-8
         mock_request.body = b"\xed\xad\xbe"  # Invalid UTF-8 sequence
 
+        # orjson validates UTF-8 while parsing, so this is reported as invalid JSON.
         status, content_type, body = post_data(mock_request)
         assert status == 400
         assert content_type == "text/plain"
-        assert body == b"400 Bad Request: Could not decode request body."
+        assert body == b"400 Bad Request: Invalid JSON in request body."
 
     # Test post_data's error handling for a general exception during processing.
     def test_post_data_general_exception(self, mock_request, mocker):
@@ -194,7 +193,7 @@ class TestApiHandlers:
         mock_request.path = "/api/data"
         mock_request.body = b'{"valid": "json"}'
 
-        mocker.patch("json.loads", side_effect=Exception("Processing Error"))
+        mocker.patch("orjson.loads", side_effect=Exception("Processing Error"))
         status, content_type, body = post_data(mock_request)
 
         assert status == 500
@@ -2,18 +2,66 @@ import datetime
 import json
 from types import SimpleNamespace
 import pytest
+from src.handlers import auth_handlers
 from src.handlers.auth_handlers import register_user, login_user, get_user_profile
-from src.webserver import Request
+
+# The request bodies the tests send, built once here instead of spelled out again in every test.
+VALID_CREDENTIALS_BODY = b'{"username": "testuser", "password": "password123"}'
+EXISTING_USER_BODY = b'{"username": "existinguser", "password": "password123"}'
+WRONG_PASSWORD_BODY = b'{"username": "testuser", "password": "wrongpassword"}'
+UNKNOWN_USER_BODY = b'{"username": "nonexistentuser", "password": "password123"}'
+MISSING_PASSWORD_BODY = b'{"username": "testuser"}'
+MISSING_USERNAME_BODY = b'{"password": "password123"}'
+INVALID_JSON_BODY = b"invalid json"
+
+# Bodies that register_user() and login_user() both reject up front, with the (status, content type, body)
+# they answer with. JSON bodies are compared after decoding them.
+ERROR_PATH_CASES = [
+    pytest.param(
+        MISSING_PASSWORD_BODY,
+        (400, "application/json", {"error": "Username and password are required."}),
+        id="missing_password",
+    ),
+    pytest.param(
+        MISSING_USERNAME_BODY,
+        (400, "application/json", {"error": "Username and password are required."}),
+        id="missing_username",
+    ),
+    pytest.param(
+        INVALID_JSON_BODY,
+        (400, "text/plain", b"400 Bad Request: Invalid JSON in request body."),
+        id="invalid_json",
+    ),
+    pytest.param(
+        b"",
+        (400, "text/plain", b"400 Bad Requesr: Request body is empty."),
+        id="empty_body",
+    ),
+]
+
+
+def assert_error_response(response, expected):
+    status, content_type, body = response
+    expected_status, expected_content_type, expected_body = expected
+
+    assert status == expected_status
+    assert content_type == expected_content_type
+    if content_type == "application/json":
+        body = json.loads(body)
+    assert body == expected_body
 
 
 class TestAuthHandlers:
-    # Remember all the .patch() need to refer to the place where it is used, in this case
-    # "src.handlers.auth_handlers", and not their original place like "src.database.db_config.start_db"
+    # Remember all the patches need to refer to the place where it is used, in this case
+    # the auth_handlers module, and not their original place like "src.database.db_config.start_db".
+    # The module is imported once above and patched with .patch.object(), so the fixtures don't have to
+    # resolve a dotted string path again for every patch of every test.
     @pytest.fixture
     def mock_db_session(self, mocker):
         mock_session = mocker.MagicMock()
-        mocker.patch(
-            "src.handlers.auth_handlers.start_db",
+        mocker.patch.object(
+            auth_handlers,
+            "start_db",
             return_value=mocker.MagicMock(
                 __enter__=lambda self: mock_session,
                 __exit__=lambda self, exc_type, exc_val, exc_tb: None,
@@ -23,22 +71,25 @@ class TestAuthHandlers:
 
     @pytest.fixture
     def mock_user_repository(self, mocker):
-        mock_create_user = mocker.patch("src.handlers.auth_handlers.create_user")
-        mock_get_user_by_username = mocker.patch(
-            "src.handlers.auth_handlers.get_user_by_username"
+        mock_create_user = mocker.patch.object(auth_handlers, "create_user")
+        mock_user_exists = mocker.patch.object(auth_handlers, "user_exists")
+        mock_get_user_auth_row = mocker.patch.object(auth_handlers, "get_user_auth_row")
+        mock_get_user_profile_by_username = mocker.patch.object(
+            auth_handlers, "get_user_profile_by_username"
         )
 
         return SimpleNamespace(
-            create_user=mock_create_user, get_user_by_username=mock_get_user_by_username
+            create_user=mock_create_user,
+            user_exists=mock_user_exists,
+            get_user_auth_row=mock_get_user_auth_row,
+            get_user_profile_by_username=mock_get_user_profile_by_username,
         )
 
     @pytest.fixture
     def mock_auth_utils(self, mocker):
-        mock_hash_password = mocker.patch("src.handlers.auth_handlers.hash_password")
-        mock_check_password = mocker.patch("src.handlers.auth_handlers.check_password")
-        mock_create_jwt_token = mocker.patch(
-            "src.handlers.auth_handlers.create_jwt_token"
-        )
+        mock_hash_password = mocker.patch.object(auth_handlers, "hash_password")
+        mock_check_password = mocker.patch.object(auth_handlers, "check_password")
+        mock_create_jwt_token = mocker.patch.object(auth_handlers, "create_jwt_token")
 
         return SimpleNamespace(
             hash_password=mock_hash_password,
@@ -46,33 +97,41 @@ class TestAuthHandlers:
             create_jwt_token=mock_create_jwt_token,
         )
 
+    # The handlers only read a few plain attributes of the request, so the tests pass a SimpleNamespace with
+    # just those set instead of a Mock(spec=Request). Nothing here relies on the spec rejecting unknown
+    # attributes, and the handlers treat a missing user the same as the None a real Request starts with.
+    # A POST request for the tests that only differ in the body they send.
+    @pytest.fixture
+    def mock_request(self):
+        return SimpleNamespace(method="POST", headers={})
+
     #### REGISTER_USER() ####
     # Test successful user registration.
     def test_register_user_success(
-        self, mock_db_session, mock_user_repository, mock_auth_utils, mocker
+        self,
+        mock_db_session,
+        mock_user_repository,
+        mock_auth_utils,
+        mocker,
     ):
-        mock_user_repository.get_user_by_username.return_value = None
+        mock_user_repository.user_exists.return_value = False
         mock_auth_utils.hash_password.return_value = "hashed_password"
         mock_user_repository.create_user.return_value = mocker.MagicMock(
             id=1, username="testuser", role="user"
         )
 
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "POST"
-        mock_request.path = "/api/register"
-        mock_request.headers = {}
-        mock_request.body = b""
-        mock_request.decoded_body = (
-            '{"username": "testuser", "password": "password123"}'
+        mock_request = SimpleNamespace(
+            method="POST", path="/api/register", headers={}, body=VALID_CREDENTIALS_BODY
         )
 
         status, content_type, body = register_user(mock_request)
 
         assert status == 201
         assert content_type == "application/json"
-        assert json.loads(body)["message"] == "User registered successfully"
-        assert json.loads(body)["username"] == "testuser"
-        mock_user_repository.get_user_by_username.assert_called_once_with(
+        response_data = json.loads(body)
+        assert response_data["message"] == "User registered successfully"
+        assert response_data["username"] == "testuser"
+        mock_user_repository.user_exists.assert_called_once_with(
             mock_db_session, "testuser"
         )
         mock_auth_utils.hash_password.assert_called_once_with("password123")
@@ -85,17 +144,12 @@ class TestAuthHandlers:
 
     # Test registration with an existing username.
     def test_register_user_existing_username(
-        self, mock_db_session, mock_user_repository, mock_auth_utils, mocker
+        self, mock_db_session, mock_user_repository, mock_auth_utils
     ):
-        mock_user_repository.get_user_by_username.return_value = mocker.MagicMock()
+        mock_user_repository.user_exists.return_value = True
 
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "POST"
-        mock_request.path = "/api/register"
-        mock_request.headers = {}
-        mock_request.body = b""
-        mock_request.decoded_body = (
-            '{"username": "existinguser", "password": "password123"}'
+        mock_request = SimpleNamespace(
+            method="POST", path="/api/register", headers={}, body=EXISTING_USER_BODY
         )
 
         status, content_type, body = register_user(mock_request)
@@ -103,112 +157,49 @@ class TestAuthHandlers:
         assert status == 409
         assert content_type == "application/json"
         assert json.loads(body)["error"] == "User 'existinguser' already exists"
-        mock_user_repository.get_user_by_username.assert_called_once_with(
+        mock_user_repository.user_exists.assert_called_once_with(
             mock_db_session, "existinguser"
         )
         mock_auth_utils.hash_password.assert_not_called()
         mock_user_repository.create_user.assert_not_called()
 
-    # Test registration with missing username or password.
-    def test_register_user_missing_credentials(self, mocker):
-
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "POST"
+    # Test the requests that register_user() rejects before touching the database.
+    @pytest.mark.parametrize("request_body, expected", ERROR_PATH_CASES)
+    def test_register_user_error_paths(self, mock_request, request_body, expected):
         mock_request.path = "/api/register"
-        mock_request.headers = {}
-        mock_request.body = b""
-        mock_request.decoded_body = '{"username": "testuser"}'
-
-        status, content_type, body = register_user(mock_request)
+        mock_request.body = request_body
 
-        assert status == 400
-        assert content_type == "application/json"
-        assert json.loads(body)["error"] == "Username and password are required."
-
-        mock_request.decoded_body = '{"password": "password123"}'
-        status, content_type, body = register_user(mock_request)
-
-        assert status == 400
-        assert content_type == "application/json"
-        assert json.loads(body)["error"] == "Username and password are required."
-
-    # Test registration with invalid JSON in the request body.
-    def test_register_user_invalid_json(self, mocker):
-
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "POST"
-        mock_request.path = "/api/register"
-        mock_request.headers = {}
-        mock_request.body = b"invalid json"
-        mock_request.decoded_body = "invalid json"
-
-        status, content_type, body = register_user(mock_request)
-
-        assert status == 400
-        assert content_type == "text/plain"
-        assert body == b"400 Bad Request: Invalid JSON in request body."
-
-    # Test registration with a non-POST method.
-    def test_register_user_method_not_allowed(self, mocker):
-
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "GET"
-        mock_request.path = "/api/register"
-        mock_request.headers = {}
-        mock_request.body = b""
-        mock_request.decoded_body = ""
-
-        status, content_type, body = register_user(mock_request)
-
-        assert status == 405
-        assert content_type == "text/plain"
-        assert body == b"405 Method Not Allowed"
-
-    # Test registration with an empty request body.
-    def test_register_user_empty_body(self, mocker):
-
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "POST"
-        mock_request.path = "/api/register"
-        mock_request.headers = {}
-        mock_request.body = b""
-        mock_request.decoded_body = ""
-
-        status, content_type, body = register_user(mock_request)
-
-        assert status == 400
-        assert content_type == "text/plain"
-        assert body == b"400 Bad Requesr: Request body is empty."
+        assert_error_response(register_user(mock_request), expected)
 
     #### LOGIN_USER() TESTS ####
     # Test successful user login with correct credentials.
     def test_login_user_success(
-        self, mock_db_session, mock_user_repository, mock_auth_utils, mocker
+        self,
+        mock_db_session,
+        mock_user_repository,
+        mock_auth_utils,
+        mocker,
     ):
 
         mock_user = mocker.MagicMock(
             username="testuser", hashed_password="hashed_password", role="user"
         )
-        mock_user_repository.get_user_by_username.return_value = mock_user
+        mock_user_repository.get_user_auth_row.return_value = mock_user
         mock_auth_utils.check_password.return_value = True
         mock_auth_utils.create_jwt_token.return_value = "mock_jwt_token"
 
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "POST"
-        mock_request.path = "/api/login"
-        mock_request.headers = {}
-        mock_request.body = b'{"username": "testuser", "password": "password123"}'
-        mock_request.decoded_body = (
-            '{"username": "testuser", "password": "password123"}'
+        mock_request = SimpleNamespace(
+            method="POST", path="/api/login", headers={}, body=VALID_CREDENTIALS_BODY
         )
 
         status, content_type, body = login_user(mock_request)
 
         assert status == 200
         assert content_type == "application/json"
-        assert json.loads(body)["message"] == "Login Sucessful"
-        assert json.loads(body)["token"] == "mock_jwt_token"
-        mock_user_repository.get_user_by_username.assert_called_once_with(
+        response_data = json.loads(body)
+        assert response_data["message"] == "Login Sucessful"
+        assert response_data["token"] == "mock_jwt_token"
+        mock_user_repository.get_user_auth_row.assert_called_once_with(
             mock_db_session, "testuser"
         )
         mock_auth_utils.check_password.assert_called_once_with(
@@ -220,22 +211,21 @@ class TestAuthHandlers:
 
     # Test failed login with incorrect credentials.
     def test_login_user_incorrect_credentials(
-        self, mock_db_session, mock_user_repository, mock_auth_utils, mocker
+        self,
+        mock_db_session,
+        mock_user_repository,
+        mock_auth_utils,
+        mocker,
     ):
 
         mock_user = mocker.MagicMock(
             username="testuser", hashed_password="hashed_password", role="user"
         )
-        mock_user_repository.get_user_by_username.return_value = mock_user
+        mock_user_repository.get_user_auth_row.return_value = mock_user
         mock_auth_utils.check_password.return_value = False
 
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "POST"
-        mock_request.path = "/api/login"
-        mock_request.headers = {}
-        mock_request.body = b'{"username": "testuser", "password": "wrongpassword"}'
-        mock_request.decoded_body = (
-            '{"username": "testuser", "password": "wrongpassword"}'
+        mock_request = SimpleNamespace(
+            method="POST", path="/api/login", headers={}, body=WRONG_PASSWORD_BODY
         )
 
         status, content_type, body = login_user(mock_request)
@@ -243,7 +233,7 @@ class TestAuthHandlers:
         assert status == 401
         assert content_type == "application/json"
         assert json.loads(body)["error"] == "Invalid credentials"
-        mock_user_repository.get_user_by_username.assert_called_once_with(
+        mock_user_repository.get_user_auth_row.assert_called_once_with(
             mock_db_session, "testuser"
         )
         mock_auth_utils.check_password.assert_called_once_with(
@@ -253,20 +243,13 @@ class TestAuthHandlers:
 
     # Test login when the user does not exist in the database.
     def test_login_user_missing_user(
-        self, mock_db_session, mock_user_repository, mock_auth_utils, mocker
+        self, mock_db_session, mock_user_repository, mock_auth_utils
     ):
 
-        mock_user_repository.get_user_by_username.return_value = None
+        mock_user_repository.get_user_auth_row.return_value = None
 
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "POST"
-        mock_request.path = "/api/login"
-        mock_request.headers = {}
-        mock_request.body = (
-            b'{"username": "nonexistentuser", "password": "password123"}'
-        )
-        mock_request.decoded_body = (
-            '{"username": "nonexistentuser", "password": "password123"}'
+        mock_request = SimpleNamespace(
+            method="POST", path="/api/login", headers={}, body=UNKNOWN_USER_BODY
         )
 
         status, content_type, body = login_user(mock_request)
@@ -274,83 +257,19 @@ class TestAuthHandlers:
         assert status == 401
         assert content_type == "application/json"
         assert json.loads(body)["error"] == "Invalid credentials"
-        mock_user_repository.get_user_by_username.assert_called_once_with(
+        mock_user_repository.get_user_auth_row.assert_called_once_with(
             mock_db_session, "nonexistentuser"
         )
         mock_auth_utils.check_password.assert_not_called()
         mock_auth_utils.create_jwt_token.assert_not_called()
 
-    # Test login with missing username or password.
-    def test_login_user_missing_credentials(self, mocker):
-
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "POST"
+    # Test the requests that login_user() rejects before touching the database.
+    @pytest.mark.parametrize("request_body, expected", ERROR_PATH_CASES)
+    def test_login_user_error_paths(self, mock_request, request_body, expected):
         mock_request.path = "/api/login"
-        mock_request.headers = {}
-        mock_request.body = b'{"username": "testuser"}'
-        mock_request.decoded_body = '{"username": "testuser"}'
-
-        status, content_type, body = login_user(mock_request)
-
-        assert status == 400
-        assert content_type == "application/json"
-        assert json.loads(body)["error"] == "Username and password are required."
-
-        mock_request.body = b'{"password": "password123"}'
-        mock_request.decoded_body = '{"password": "password123"}'
-        status, content_type, body = login_user(mock_request)
-
-        assert status == 400
-        assert content_type == "application/json"
-        assert json.loads(body)["error"] == "Username and password are required."
-
-    # Test login with invalid JSON in the request body.
-    def test_login_user_invalid_json(self, mocker):
+        mock_request.body = request_body
 
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "POST"
-        mock_request.path = "/api/login"
-        mock_request.headers = {}
-        mock_request.body = b"invalid json"
-        mock_request.decoded_body = "invalid json"
-
-        status, content_type, body = login_user(mock_request)
-
-        assert status == 400
-        assert content_type == "text/plain"
-        assert body == b"400 Bad Request: Invalid JSON in request body."
-
-    # Test login with a non-POST method.
-    def test_login_user_method_not_allowed(self, mocker):
-
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "GET"
-        mock_request.path = "/api/login"
-        mock_request.headers = {}
-        mock_request.body = b""
-        mock_request.decoded_body = ""
-
-        status, content_type, body = login_user(mock_request)
-
-        assert status == 405
-        assert content_type == "text/plain"
-        assert body == b"405 Method Not Allowed"
-
-    # Test login with an empty request body.
-    def test_login_user_empty_body(self, mocker):
-
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "POST"
-        mock_request.path = "/api/login"
-        mock_request.headers = {}
-        mock_request.body = b""
-        mock_request.decoded_body = ""
-
-        status, content_type, body = login_user(mock_request)
-
-        assert status == 400
-        assert content_type == "text/plain"
-        assert body == b"400 Bad Requesr: Request body is empty."
+        assert_error_response(login_user(mock_request), expected)
 
     #### GET_USER_PROFILE() TESTS ####
     # Test successful retrieval of user profile.
@@ -363,18 +282,18 @@ class TestAuthHandlers:
             role="user",
             created_at=datetime.datetime(2025, 1, 1, 12, 30, 0),
         )
-        mock_user_repository.get_user_by_username.return_value = mock_user
-
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "GET"
-        mock_request.path = "/api/profile"
-        mock_request.headers = {}
-        mock_request.body = b""
-        mock_request.decoded_body = ""
-        mock_request.user = {
-            "username": "testuser",
-            "role": "user",
-        }
+        mock_user_repository.get_user_profile_by_username.return_value = mock_user
+
+        mock_request = SimpleNamespace(
+            method="GET",
+            path="/api/profile",
+            headers={},
+            body=b"",
+            user={
+                "username": "testuser",
+                "role": "user",
+            },
+        )
 
         status, content_type, body = get_user_profile(mock_request)
 
@@ -386,20 +305,17 @@ class TestAuthHandlers:
         assert response_data["role_from_token"] == "user"
         assert response_data["username_from_db"] == "testuser"
         assert response_data["created_at"] == "2025-01-01T12:30:00"
-        mock_user_repository.get_user_by_username.assert_called_once_with(
+        mock_user_repository.get_user_profile_by_username.assert_called_once_with(
             mock_db_session, "testuser"
         )
 
     # Test get_user_profile when request.user is not set.
-    def test_get_user_profile_unauthorized_no_user_in_request(self, mocker):
+    def test_get_user_profile_unauthorized_no_user_in_request(self):
 
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "GET"
-        mock_request.path = "/api/profile"
-        mock_request.headers = {}
-        mock_request.body = b""
-        mock_request.decoded_body = ""
-        # mock_request.user is intentionally not set
+        # No user on the request, as if the auth middleware never ran.
+        mock_request = SimpleNamespace(
+            method="GET", path="/api/profile", headers={}, body=b""
+        )
 
         status, content_type, body = get_user_profile(mock_request)
 
@@ -409,36 +325,37 @@ class TestAuthHandlers:
 
     # Test get_user_profile when the user from the token is not found in the database.
     def test_get_user_profile_user_not_found_in_db(
-        self, mock_db_session, mock_user_repository, mocker
+        self, mock_db_session, mock_user_repository
     ):
 
-        mock_user_repository.get_user_by_username.return_value = None
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "GET"
-        mock_request.path = "/api/profile"
-        mock_request.headers = {}
-        mock_request.body = b""
-        mock_request.user = {"username": "nonexistent", "role": "user"}
+        mock_user_repository.get_user_profile_by_username.return_value = None
+        mock_request = SimpleNamespace(
+            method="GET",
+            path="/api/profile",
+            headers={},
+            body=b"",
+            user={"username": "nonexistent", "role": "user"},
+        )
 
         status, content_type, body = get_user_profile(mock_request)
 
         assert status == 404
         assert content_type == "application/json"
         assert json.loads(body)["error"] == "User not found in database."
-        mock_user_repository.get_user_by_username.assert_called_once_with(
+        mock_user_repository.get_user_profile_by_username.assert_called_once_with(
             mock_db_session, "nonexistent"
         )
 
     # Test get_user_profile with an invalid username type in the token payload.
-    def test_get_user_profile_invalid_username_in_token(self, mocker):
-
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "GET"
-        mock_request.path = "/api/profile"
-        mock_request.headers = {}
-        mock_request.body = b""
-        mock_request.decoded_body = ""
-        mock_request.user = {"username": 123, "role": "user"}
+    def test_get_user_profile_invalid_username_in_token(self):
+
+        mock_request = SimpleNamespace(
+            method="GET",
+            path="/api/profile",
+            headers={},
+            body=b"",
+            user={"username": 123, "role": "user"},
+        )
 
         status, content_type, body = get_user_profile(mock_request)
 
@@ -448,20 +365,3 @@ class TestAuthHandlers:
             json.loads(body)["error"]
             == "Bad Request: User ID missing or invalid in token payload."
         )
-
-    # Test get_user_profile with a non-GET method.
-    def test_get_user_profile_method_not_allowed(self, mocker):
-
-        mock_request = mocker.Mock(spec=Request)
-        mock_request.method = "POST"
-        mock_request.path = "/api/profile"
-        mock_request.headers = {}
-        mock_request.body = b""
-        mock_request.decoded_body = ""
-        mock_request.user = {"username": "testuser", "role": "user"}
-
-        status, content_type, body = get_user_profile(mock_request)
-
-        assert status == 405
-        assert content_type == "text/plain"
-        assert body == b"405 Method Not Allowed"
@@ -0,0 +1,383 @@
+from collections import OrderedDict
+import hmac
+import time
+from types import SimpleNamespace
+import jwt
+import pytest
+from src.decorators import protected_route
+from src.middleware.auth_middleware import auth_middleware
+from src.utils import auth_utils
+from src.utils.auth_utils import (
+    check_password,
+    create_jwt_token,
+    decode_jwt_token,
+    hash_passwords_bulk,
+    verify_jwt_token,
+)
+
+# The secret used for every token in these tests, patched in by the fixture below so the tests don't
+# depend on what JWT_SECRET_KEY is set to in the environment.
+TEST_SECRET_KEY = "test-secret-key-for-the-unit-tests-0123456789"
+
+
+class TestAuthUtils:
+
+    # Patches the key the module derived from the settings at import time.
+    @pytest.fixture(autouse=True)
+    def secret_key(self, mocker):
+        mocker.patch.object(auth_utils, "SECRET_KEY", TEST_SECRET_KEY)
+        mocker.patch.object(
+            auth_utils, "_SECRET_KEY_BYTES", TEST_SECRET_KEY.encode("utf-8")
+        )
+        mocker.patch.object(auth_utils, "ALGORITHM", "HS256")
+        mocker.patch.object(auth_utils, "_ALGORITHMS", ["HS256"])
+
+    # Every test starts with an empty decoded token cache.
+    @pytest.fixture(autouse=True)
+    def empty_token_cache(self, mocker):
+        mocker.patch.object(auth_utils, "_decoded_token_cache", OrderedDict())
+
+    #### HASH_PASSWORDS_BULK() ####
+    # Test that the hashes come back in the same order as the passwords and the pool is made on first use.
+    def test_hash_passwords_bulk(self, mocker):
+        # The lowest cost bcrypt allows, the test is about ordering and not about the hash strength.
+        mocker.patch.object(auth_utils, "BCRYPT_ROUNDS", 4)
+        mocker.patch.object(auth_utils, "_hash_executor", None)
+        passwords = [f"password{i}" for i in range(8)]
+
+        hashes = hash_passwords_bulk(passwords)
+
+        try:
+            assert len(hashes) == len(passwords)
+            for password, hashed_password in zip(passwords, hashes):
+                assert check_password(password, hashed_password)
+            # Every hash only matches its own password.
+            assert not check_password(passwords[1], hashes[0])
+
+            executor = auth_utils._hash_executor
+            assert executor is not None
+            hash_passwords_bulk(["again"])
+            assert auth_utils._hash_executor is executor
+        finally:
+            auth_utils._hash_executor.shutdown()
+
+    #### CREATE_JWT_TOKEN() ####
+    # Test that PyJWT accepts the tokens signed by the HS256 fast path and gets the payload plus iat/exp.
+    def test_create_jwt_token_hs256_round_trip(self, mocker):
+        mocker.patch("time.time", return_value=1700000000.7)
+        mock_encode = mocker.spy(jwt, "encode")
+        payload = {"username": "testuser", "role": "user"}
+
+        token = create_jwt_token(payload)
+
+        mock_encode.assert_not_called()
+        decoded = jwt.decode(
+            token,
+            TEST_SECRET_KEY,
+            algorithms=["HS256"],
+            options={"verify_exp": False, "verify_iat": False},
+        )
+        assert decoded == {
+            "username": "testuser",
+            "role": "user",
+            "iat": 1700000000,
+            "exp": 1700000000 + auth_utils._TOKEN_LIFETIME_SECONDS,
+        }
+        assert jwt.get_unverified_header(token) == {"alg": "HS256", "typ": "JWT"}
+        # The payload passed in is left alone.
+        assert payload == {"username": "testuser", "role": "user"}
+
+    # Test that a fresh token decodes with PyJWT's default checks on.
+    def test_create_jwt_token_decodes_with_pyjwt(self):
+        decoded = jwt.decode(
+            create_jwt_token({"username": "testuser"}),
+            TEST_SECRET_KEY,
+            algorithms=["HS256"],
+        )
+
+        assert decoded["username"] == "testuser"
+        assert decoded["exp"] - decoded["iat"] == auth_utils._TOKEN_LIFETIME_SECONDS
+
+    # Test that any other algorithm goes through jwt.encode().
+    def test_create_jwt_token_other_algorithm_uses_pyjwt(self, mocker):
+        mocker.patch.object(auth_utils, "ALGORITHM", "HS512")
+        mock_encode = mocker.spy(jwt, "encode")
+
+        token = create_jwt_token({"username": "testuser"})
+
+        mock_encode.assert_called_once()
+        assert mock_encode.call_args.kwargs["algorithm"] == "HS512"
+        assert jwt.get_unverified_header(token)["alg"] == "HS512"
+        decoded = jwt.decode(token, TEST_SECRET_KEY, algorithms=["HS512"])
+        assert decoded["username"] == "testuser"
+
+    #### DECODE_JWT_TOKEN() CACHE ####
+    # Test that a token seen before is served from the cache without being decoded again.
+    def test_decode_jwt_token_cache_hit_skips_decoding(self, mocker):
+        token = create_jwt_token({"username": "testuser"})
+        first = decode_jwt_token(token)
+
+        mock_decode_hs256 = mocker.spy(auth_utils, "_decode_hs256")
+        mock_jwt_decode = mocker.spy(jwt, "decode")
+        assert decode_jwt_token(token) == first
+
+        mock_decode_hs256.assert_not_called()
+        mock_jwt_decode.assert_not_called()
+
+    # Test that a cached token past its "exp" raises ExpiredSignatureError and is dropped from the cache.
+    def test_decode_jwt_token_cache_entry_expires(self, mocker):
+        now = time.time()
+        # A token that expired twenty seconds ago, issued and decoded back when it was still valid.
+        mock_time = mocker.patch(
+            "time.time", return_value=now - auth_utils._TOKEN_LIFETIME_SECONDS - 20
+        )
+        token = create_jwt_token({"username": "testuser"})
+        decode_jwt_token(token)
+        assert token in auth_utils._decoded_token_cache
+
+        # Back to the present, PyJWT checks "exp" against the real clock.
+        mock_time.return_value = now
+        with pytest.raises(jwt.ExpiredSignatureError):
+            decode_jwt_token(token)
+        assert token not in auth_utils._decoded_token_cache
+
+    # Test that the cache is bounded and evicts the least recently used token first.
+    def test_decode_jwt_token_cache_evicts_least_recently_used(self, mocker):
+        assert auth_utils._DECODED_TOKEN_CACHE_SIZE == 4096
+        mocker.patch.object(auth_utils, "_DECODED_TOKEN_CACHE_SIZE", 2)
+        first, second, third = (
+            create_jwt_token({"username": name}) for name in ("a", "b", "c")
+        )
+
+        decode_jwt_token(first)
+        decode_jwt_token(second)
+        # Using the first token again makes the second one the least recently used.
+        decode_jwt_token(first)
+        decode_jwt_token(third)
+
+        assert list(auth_utils._decoded_token_cache) == [first, third]
+
+    # Test that callers get their own copy of the payload, so changing it doesn't change the cache.
+    def test_decode_jwt_token_returns_copies(self):
+        token = create_jwt_token({"username": "testuser", "role": "user"})
+
+        first = decode_jwt_token(token)
+        first["role"] = "admin"
+        second = decode_jwt_token(token)
+        second["username"] = "someone_else"
+
+        third = decode_jwt_token(token)
+        assert third["username"] == "testuser"
+        assert third["role"] == "user"
+        assert third is not second
+
+    #### SHARED CACHE: AUTH_MIDDLEWARE AND VERIFY_JWT_TOKEN() ####
+    # A protected handler behind the auth middleware that returns the user the middleware put on the request.
+    @pytest.fixture
+    def protected_handler(self):
+        @protected_route
+        def handler(request):
+            return 200, "application/json", request.user
+
+        return auth_middleware(handler)
+
+    # Test that a token the middleware decoded is served from the cache by verify_jwt_token().
+    def test_middleware_then_verify_jwt_token_share_cache(
+        self, protected_handler, mocker
+    ):
+        token = create_jwt_token({"username": "testuser"})
+        status, _, user = protected_handler(
+            SimpleNamespace(auth_header=f"Bearer {token}")
+        )
+        assert status == 200
+
+        mock_decode_hs256 = mocker.spy(auth_utils, "_decode_hs256")
+        assert verify_jwt_token(token) == user
+        mock_decode_hs256.assert_not_called()
+
+    # Test that a token verify_jwt_token() decoded is served from the cache by the middleware.
+    def test_verify_jwt_token_then_middleware_share_cache(
+        self, protected_handler, mocker
+    ):
+        token = create_jwt_token({"username": "testuser"})
+        payload = verify_jwt_token(token)
+
+        mock_decode_hs256 = mocker.spy(auth_utils, "_decode_hs256")
+        status, _, user = protected_handler(
+            SimpleNamespace(auth_header=f"Bearer {token}")
+        )
+        assert status == 200
+        assert user == payload
+        mock_decode_hs256.assert_not_called()
+
+    # Test that an invalid token gives None from verify_jwt_token() and a 401 from the middleware.
+    def test_invalid_token_rejected_by_both(self, protected_handler):
+        token = create_jwt_token({"username": "testuser"})
+        tampered = token[:-2] + ("A" if token[-2] != "A" else "B") + token[-1]
+
+        for _ in range(2):
+            # Twice, so the second round would hit the cache if a bad token ever ended up in it.
+            assert verify_jwt_token(tampered) is None
+            assert protected_handler(
+                SimpleNamespace(auth_header=f"Bearer {tampered}")
+            ) == (401, "text/plain", b"401 Unauthorized: Invalid token.")
+        assert tampered not in auth_utils._decoded_token_cache
+
+    #### _DECODE_HS256() ####
+    # The HS256 fast path has to agree with PyJWT on every token: it may only return a payload that
+    # jwt.decode() would return too, and for anything else it returns None so decode_jwt_token() falls back
+    # to jwt.decode() and raises PyJWT's own errors.
+
+    # Returns what calling decode(token) ends in, the payload or the type of the exception it raised.
+    def outcome(self, decode, token):
+        try:
+            return decode(token)
+        except Exception as e:
+            return type(e)
+
+    def pyjwt_decode(self, token):
+        return jwt.decode(token, TEST_SECRET_KEY, algorithms=["HS256"])
+
+    def encode(self, claims, algorithm="HS256", headers=None):
+        return jwt.encode(claims, TEST_SECRET_KEY, algorithm=algorithm, headers=headers)
+
+    # Test that a token we issued goes through the fast path and gives the same payload as PyJWT.
+    def test_decode_hs256_round_trip(self, mocker):
+        token = create_jwt_token({"username": "testuser", "role": "user"})
+        mock_jwt_decode = mocker.spy(jwt, "decode")
+
+        payload = auth_utils._decode_hs256(token)
+
+        assert payload is not None
+        assert decode_jwt_token(token) == payload
+        mock_jwt_decode.assert_not_called()
+        assert payload == self.pyjwt_decode(token)
+
+    # Test that a changed payload or signature is rejected with InvalidSignatureError.
+    @pytest.mark.parametrize("segment", [1, 2], ids=["payload", "signature"])
+    def test_decode_hs256_tampered(self, segment):
+        segments = create_jwt_token({"username": "testuser", "role": "user"}).split(".")
+        if segment == 1:
+            # A valid payload, just not the one that was signed.
+            segments[1] = create_jwt_token({"username": "admin"}).split(".")[1]
+        else:
+            segments[2] = create_jwt_token({"username": "other"}).split(".")[2]
+        token = ".".join(segments)
+
+        assert auth_utils._decode_hs256(token) is None
+        with pytest.raises(jwt.InvalidSignatureError):
+            decode_jwt_token(token)
+        assert self.outcome(self.pyjwt_decode, token) is jwt.InvalidSignatureError
+
+    # Test that tokens with a different header or algorithm are left to PyJWT.
+    @pytest.mark.parametrize(
+        "encode_kwargs",
+        [
+            {"headers": {"kid": "1"}},
+            {"algorithm": "HS512"},
+            {"algorithm": "HS384"},
+        ],
+        ids=["extra_header", "hs512", "hs384"],
+    )
+    def test_decode_hs256_other_header_falls_back(self, encode_kwargs, mocker):
+        token = self.encode({"username": "testuser"}, **encode_kwargs)
+        mock_jwt_decode = mocker.spy(jwt, "decode")
+
+        assert auth_utils._decode_hs256(token) is None
+        result = self.outcome(decode_jwt_token, token)
+
+        mock_jwt_decode.assert_called_once()
+        assert result == self.outcome(self.pyjwt_decode, token)
+
+    # Test the time claims: anything PyJWT rejects or checks differently is left to PyJWT.
+    @pytest.mark.parametrize(
+        "claims_from_now, fast_path",
+        [
+            (lambda now: {"exp": now + 60, "iat": now, "nbf": now}, True),
+            (lambda now: {"exp": now - 10}, False),
+            (lambda now: {"nbf": now + 60}, False),
+            (lambda now: {"iat": now + 60}, False),
+            (lambda now: {"exp": now + 60.5}, False),
+            (lambda now: {"iat": float(now)}, False),
+            (lambda now: {"iat": str(now)}, False),
+            (lambda now: {"nbf": True}, False),
+        ],
+        ids=[
+            "valid",
+            "expired",
+            "nbf_in_future",
+            "iat_in_future",
+            "float_exp",
+            "float_iat",
+            "str_iat",
+            "bool_nbf",
+        ],
+    )
+    def test_decode_hs256_time_claims(self, claims_from_now, fast_path, mocker):
+        token = self.encode(claims_from_now(int(time.time())))
+        mock_jwt_decode = mocker.spy(jwt, "decode")
+
+        fast_payload = auth_utils._decode_hs256(token)
+        result = self.outcome(decode_jwt_token, token)
+
+        assert (fast_payload is not None) == fast_path
+        assert mock_jwt_decode.called != fast_path
+        assert result == self.outcome(self.pyjwt_decode, token)
+
+    # Test that tokens with claims PyJWT has extra rules for (aud, sub, jti) always go through PyJWT.
+    @pytest.mark.parametrize(
+        "claims",
+        [{"aud": "someone"}, {"sub": "testuser"}, {"sub": 123}, {"jti": "abc"}],
+        ids=["aud", "sub", "non_str_sub", "jti"],
+    )
+    def test_decode_hs256_claims_checked_by_pyjwt(self, claims, mocker):
+        token = self.encode({"username": "testuser", **claims})
+        mock_jwt_decode = mocker.spy(jwt, "decode")
+
+        assert auth_utils._decode_hs256(token) is None
+        result = self.outcome(decode_jwt_token, token)
+
+        mock_jwt_decode.assert_called_once()
+        assert result == self.outcome(self.pyjwt_decode, token)
+
+    # Test that malformed tokens raise DecodeError.
+    @pytest.mark.parametrize(
+        "make_token",
+        [
+            lambda token: "",
+            lambda token: "not-a-token",
+            lambda token: token.rsplit(".", 1)[0],
+            lambda token: token + ".extra",
+            lambda token: token.split(".")[0] + ".!!!." + token.split(".")[2],
+            lambda token: "é" + token,
+        ],
+        ids=[
+            "empty",
+            "one_segment",
+            "two_segments",
+            "four_segments",
+            "bad_base64",
+            "non_ascii",
+        ],
+    )
+    def test_decode_hs256_malformed(self, make_token):
+        token = make_token(create_jwt_token({"username": "testuser"}))
+
+        assert auth_utils._decode_hs256(token) is None
+        with pytest.raises(jwt.DecodeError):
+            decode_jwt_token(token)
+
+    # Test that a payload that is correctly signed but not JSON (or not an object) raises DecodeError.
+    @pytest.mark.parametrize("payload", [b"not json", b"[1, 2]"])
+    def test_decode_hs256_signed_non_object_payload(self, payload):
+        signing_input = (
+            auth_utils._HS256_HEADER_SEGMENT + b"." + auth_utils._b64url_encode(payload)
+        )
+        signature = auth_utils._b64url_encode(
+            hmac.digest(TEST_SECRET_KEY.encode("utf-8"), signing_input, "sha256")
+        )
+        token = (signing_input + b"." + signature).decode("ascii")
+
+        assert auth_utils._decode_hs256(token) is None
+        with pytest.raises(jwt.DecodeError):
+            decode_jwt_token(token)
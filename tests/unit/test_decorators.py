@@ -1,17 +1,15 @@
-from src.decorators import protected_route
+from src.decorators import is_protected, protected_route
 
 
 class TestDecorators:
-    # Test that the protected_route decorator correctly adds the _is_protected
-    # attribute and sets it to True on the decorated function.
+    # Test that the protected_route decorator registers the decorated function as protected.
     def test_protected_route_marks_handler(self):
 
         @protected_route
         def mock_handler():
             pass
 
-        assert hasattr(mock_handler, "_is_protected")
-        assert mock_handler._is_protected is True
+        assert is_protected(mock_handler) is True
 
     # Test that the protected_route decorator returns the original handler function.
     def test_protected_route_returns_original_handler(self):
@@ -24,4 +22,12 @@ class TestDecorators:
         # Ensure the returned handler is the same object as the original,
         # or at least behaves identically if a wrapper was created (though in this case, it's the same).
         assert decorated_handler is original_handler
-        assert AttributeError(hasattr(original_handler, "_is_protected"))
+        assert is_protected(original_handler) is True
+
+    # Test that functions which were never decorated are not reported as protected.
+    def test_is_protected_false_for_undecorated_handler(self):
+
+        def public_handler():
+            pass
+
+        assert is_protected(public_handler) is False
@@ -1,149 +1,120 @@
+from types import SimpleNamespace
 import pytest
+from sqlalchemy import create_engine, delete, select
+from sqlalchemy import orm as so
+from sqlalchemy.pool import StaticPool
+from src.database import init_db as init_db_module
+from src.database.db_config import Base
 from src.database.init_db import init_db
+from src.database.models import User
 
 
 class TestInitDb:
 
-    # Fixture to mock common database-related dependencies for init_db tests.
-    @pytest.fixture
-    def mock_db_dependencies(self, mocker):
-
-        mock_base = mocker.patch("src.database.init_db.Base")
-        mock_session_local = mocker.patch("src.database.init_db.SessionLocal")
-        mock_get_user_by_username = mocker.patch(
-            "src.database.init_db.get_user_by_username"
+    # A real database for init_db() to talk to instead of mocking every call it makes. SQLite in memory
+    # needs no server, and StaticPool hands out the same single connection every time so all the sessions
+    # see the same database. The tables are created once for the whole test session.
+    @pytest.fixture(scope="session")
+    def sqlite_engine(self):
+        engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
         )
-        mock_hash_password = mocker.patch("src.database.init_db.hash_password")
-        mock_create_user = mocker.patch("src.database.init_db.create_user")
-
-        # Mock the session object and its common methods.
-        mock_session = mocker.MagicMock()
-        mock_session_local.return_value = mock_session
-
-        return {
-            "Base": mock_base,
-            "SessionLocal": mock_session_local,
-            "get_user_by_username": mock_get_user_by_username,
-            "hash_password": mock_hash_password,
-            "create_user": mock_create_user,
-            "session": mock_session,
-        }
-
-    # Test that init_db creates tables and seeds the admin user when it doesn't exist.
-    def test_init_db_creates_tables_and_seeds_admin_user(
-        self, mock_db_dependencies, mocker
-    ):
-        # Unpack mocks from the imported fixture.
-        mock_base = mock_db_dependencies["Base"]
-        mock_session_local = mock_db_dependencies["SessionLocal"]
-        mock_get_user_by_username = mock_db_dependencies["get_user_by_username"]
-        mock_hash_password = mock_db_dependencies["hash_password"]
-        mock_create_user = mock_db_dependencies["create_user"]
-        mock_session = mock_db_dependencies["session"]
-
-        # Simulate admin user not existing.
-        mock_get_user_by_username.return_value = None
-
-        # Simulate password hashing.
-        mock_hash_password.return_value = "hashed_admin_password"
-
-        init_db()
-
-        # Assert Base.metadata.create_all was called.
-        mock_base.metadata.create_all.assert_called_once_with(bind=mocker.ANY)
+        Base.metadata.create_all(bind=engine)
+        yield engine
+        engine.dispose()
 
-        # Assert get_user_by_username was called.
-        mock_get_user_by_username.assert_called_once_with(mock_session, "admin")
-
-        # Assert hash_password was called.
-        mock_hash_password.assert_called_once_with("admin_password")
-
-        # Assert create_user was called with correct arguments.
-        mock_create_user.assert_called_once_with(
-            mock_session, "admin", "hashed_admin_password", "admin"
+    # Points init_db() at the SQLite database and empties the users table again after each test.
+    @pytest.fixture
+    def sqlite_session_local(self, sqlite_engine, mocker):
+        session_local = so.sessionmaker(autoflush=False, bind=sqlite_engine)
+        mocker.patch.object(init_db_module, "db", sqlite_engine)
+        mocker.patch.object(init_db_module, "SessionLocal", session_local)
+        # bcrypt is slow on purpose, and these tests are about init_db() and not about hashing.
+        mocker.patch.object(
+            init_db_module, "hash_password", return_value="hashed_admin_password"
         )
 
-        # Assert session.close was called.
-        mock_session.close.assert_called_once()
-
-    # Test that init_db does not recreate the admin user if it already exists.
-    def test_init_db_handles_existing_admin_user(self, mock_db_dependencies, mocker):
-        # Unpack mocks from the imported fixture.
-        mock_base = mock_db_dependencies["Base"]
-        mock_session_local = mock_db_dependencies["SessionLocal"]
-        mock_get_user_by_username = mock_db_dependencies["get_user_by_username"]
-        mock_hash_password = mock_db_dependencies["hash_password"]
-        mock_create_user = mock_db_dependencies["create_user"]
-        mock_session = mock_db_dependencies["session"]
-
-        # Simulate admin user already existing.
-        mock_get_user_by_username.return_value = mocker.MagicMock(username="admin")
-
-        init_db()
-
-        # Assert Base.metadata.create_all was called.
-        mock_base.metadata.create_all.assert_called_once_with(bind=mocker.ANY)
-
-        # Assert get_user_by_username was called.
-        mock_get_user_by_username.assert_called_once_with(mock_session, "admin")
+        yield session_local
 
-        # Assert hash_password was NOT called.
-        mock_hash_password.assert_not_called()
+        with session_local() as session:
+            session.execute(delete(User))
+            session.commit()
 
-        # Assert create_user was NOT called.
-        mock_create_user.assert_not_called()
-
-        # Assert session.close was called.
-        mock_session.close.assert_called_once()
-
-    # Test that init_db handles errors during admin user creation by rolling back the session.
-    def test_init_db_error_handling_during_admin_creation_rollbacks(
-        self, mock_db_dependencies, mocker
-    ):
-        # Unpack mocks from the imported fixture.
-        mock_base = mock_db_dependencies["Base"]
-        mock_session_local = mock_db_dependencies["SessionLocal"]
-        mock_get_user_by_username = mock_db_dependencies["get_user_by_username"]
-        mock_hash_password = mock_db_dependencies["hash_password"]
-        mock_create_user = mock_db_dependencies["create_user"]
-        mock_session = mock_db_dependencies["session"]
-
-        # Simulate admin user not existing.
-        mock_get_user_by_username.return_value = None
-
-        # Simulate an exception during create_user.
-        mock_create_user.side_effect = Exception("Database write error")
+    # Sets the database up for one of the init_db() scenarios below and returns what the test should see.
+    # The scenario name comes in through indirect parametrization, so every case runs the same test body.
+    @pytest.fixture
+    def init_db_scenario(self, request, sqlite_session_local, mocker):
+        scenario = SimpleNamespace(
+            error=None,
+            users=[("admin", "hashed_admin_password", "admin")],
+            hash_calls=1,
+            rollbacks=0,
+        )
 
-        with pytest.raises(Exception, match="Database write error"):
+        if request.param == "existing_admin":
+            # The admin is already there, so it is left alone and no second one is created.
+            with sqlite_session_local() as session:
+                session.add(
+                    User(
+                        username="admin", hashed_password="existing_hash", role="admin"
+                    )
+                )
+                session.commit()
+            scenario.users = [("admin", "existing_hash", "admin")]
+            scenario.hash_calls = 0
+        elif request.param == "create_error":
+            # create_user fails after the user has been inserted but before the commit, the rollback
+            # has to throw the half written admin away.
+            def failing_create_user(session, username, hashed_password, role):
+                session.add(
+                    User(username=username, hashed_password=hashed_password, role=role)
+                )
+                session.flush()
+                raise Exception("Database write error")
+
+            mocker.patch.object(
+                init_db_module, "create_user", side_effect=failing_create_user
+            )
+            scenario.error = "Database write error"
+            scenario.users = []
+            scenario.rollbacks = 1
+
+        scenario.rollback_spy = mocker.spy(so.Session, "rollback")
+        return scenario
+
+    # Test that init_db seeds the admin user when it doesn't exist, leaves an existing one alone and
+    # rolls the session back when creating it fails.
+    @pytest.mark.parametrize(
+        "init_db_scenario",
+        ["new_admin", "existing_admin", "create_error"],
+        indirect=True,
+    )
+    def test_init_db_scenarios(self, init_db_scenario, sqlite_session_local):
+        if init_db_scenario.error:
+            with pytest.raises(Exception, match=init_db_scenario.error):
+                init_db()
+        else:
             init_db()
 
-        # Assert Base.metadata.create_all was called.
-        mock_base.metadata.create_all.assert_called_once_with(bind=mocker.ANY)
-
-        # Assert get_user_by_username was called.
-        mock_get_user_by_username.assert_called_once_with(mock_session, "admin")
-
-        # Assert hash_password was called.
-        mock_hash_password.assert_called_once_with("admin_password")
-
-        # Assert create_user was called.
-        mock_create_user.assert_called_once_with(
-            mock_session, "admin", mock_hash_password.return_value, "admin"
-        )
-
-        # Assert session.rollback was called.
-        mock_session.rollback.assert_called_once()
+        with sqlite_session_local() as session:
+            users = session.execute(
+                select(User.username, User.hashed_password, User.role)
+            ).all()
 
-        # Assert session.close was called.
-        mock_session.close.assert_called_once()
+        assert [tuple(user) for user in users] == init_db_scenario.users
+        assert init_db_module.hash_password.call_count == init_db_scenario.hash_calls
+        assert init_db_scenario.rollback_spy.call_count == init_db_scenario.rollbacks
 
     # Test that init_db handles errors during Base.metadata.create_all.
     def test_init_db_error_handling_during_create_all(self, mocker):
 
-        # This test does not use the full mock_db_dependencies fixture because
-        # it specifically focuses on an error before the session is typically used.
-        mock_base = mocker.patch("src.database.init_db.Base")
-        mock_session_local = mocker.patch("src.database.init_db.SessionLocal")
+        # This test does not use the sqlite_session_local fixture, since create_all fails before init_db()
+        # ever opens a session. Base and SessionLocal are mocked instead, so we can make create_all raise
+        # and check that no session was created.
+        mock_base = mocker.patch.object(init_db_module, "Base")
+        mock_session_local = mocker.patch.object(init_db_module, "SessionLocal")
 
         # Simulate an exception during create_all
         mock_base.metadata.create_all.side_effect = Exception(
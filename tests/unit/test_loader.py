@@ -3,7 +3,8 @@ import pytest
 import json
 import os
 from src.router import Router
-from src.loader import load_routes, bind_handler
+from src.decorators import is_protected, protected_route
+from src.loader import _cached_import, load_routes, bind_handler
 
 
 # Mock handler functions for testing purposes
@@ -38,6 +39,13 @@ class TestLoader:
     def router_instance(self):
         return Router()
 
+    # The loader caches imported handler modules, clear it so every test sees its own mocked modules.
+    @pytest.fixture(autouse=True)
+    def clear_import_cache(self):
+        _cached_import.cache_clear()
+        yield
+        _cached_import.cache_clear()
+
     # Mocks the handler modules and their functions using mocker.
     @pytest.fixture
     def mock_handlers_modules(self, mocker):
@@ -136,9 +144,6 @@ class TestLoader:
         mock_open.assert_called_once_with("dummy_path.json", "r")
         assert content == json.dumps(mock_routes_config)
 
-        # Mock builtins.print to suppress output during tests.
-        mocker.patch("builtins.print")
-
         load_routes(router_instance)
 
         # Verify that routes are added to the router.
@@ -169,67 +174,66 @@ class TestLoader:
         assert router_instance.get_handler("GET", "/profile/<username>")[0] is not None
 
     # Test handling of a missing routes.json file.
-    def test_load_routes_missing_file(self, mocker, router_instance):
+    def test_load_routes_missing_file(self, mocker, router_instance, caplog):
         # Simulating the absence of a file by giving the open() an error directly.
         mocker.patch("builtins.open", side_effect=FileNotFoundError)
-        mock_print = mocker.patch("builtins.print")
 
         load_routes(router_instance)
-        mock_print.assert_called_once_with(
+        assert caplog.messages == [
             f"Error: Routes configuration file not found at {os.path.join('config', 'routes.json')}"
-        )
+        ]
         # Ensure no routes were added since we did not find the file.
         assert not router_instance.routes
 
     # Test handling of malformed JSON in routes.json.
-    def test_load_routes_malformed_json(self, mocker, router_instance):
+    def test_load_routes_malformed_json(self, mocker, router_instance, caplog):
         # Simulate open() getting a file and reading the data as a malformed json obj.
         mocker.patch(
             "builtins.open", mocker.mock_open(read_data='{"routes": [not valid json}')
         )
-        mock_print = mocker.patch("builtins.print")
 
         # Since the opened data above will be accessed by json.load() we will get an JSONDecodeError.
         load_routes(router_instance)
-        mock_print.assert_called_once_with(
+        assert caplog.messages == [
             f"Error: Invalid JSON in routes configuration file at {os.path.join('config', 'routes.json')}"
-        )
+        ]
         assert not router_instance.routes
 
     # Test handling of config without 'routes' key.
     def test_load_routes_invalid_config_structure_no_routes_key(
-        self, mocker, router_instance, mock_handlers_modules
+        self, mocker, router_instance, mock_handlers_modules, caplog
     ):
         mock_routes_config = {"other_key": []}
         mocker.patch(
             "builtins.open", mocker.mock_open(read_data=json.dumps(mock_routes_config))
         )
-        mock_print = mocker.patch("builtins.print")
 
         load_routes(router_instance)
 
         # Assert that the error was caught and no routes were added.
-        mock_print.assert_any_call(
+        assert (
             f"Error: Missing 'routes' key in routes configuration file at {os.path.join('config', 'routes.json')}"
+            in caplog.messages
         )
         assert not router_instance.routes
 
     # Test handling of config where 'routes' is not a list.
     def test_load_routes_invalid_config_structure_routes_not_list(
-        self, mocker, router_instance, mock_handlers_modules
+        self, mocker, router_instance, mock_handlers_modules, caplog
     ):
         mock_routes_config = {"routes": "not_a_list"}
         mocker.patch(
             "builtins.open", mocker.mock_open(read_data=json.dumps(mock_routes_config))
         )
-        mock_print = mocker.patch("builtins.print")
 
         load_routes(router_instance)
-        mock_print.assert_called_once_with("Error: 'routes' key in config must be list")
+        assert caplog.messages == ["Error: 'routes' key in config must be list"]
         assert not router_instance.routes
 
     # Test handling of a route entry with a handler that doesn't exist in modules.
-    def test_load_routes_missing_handler_function(self, mocker, router_instance):
+    def test_load_routes_missing_handler_function(
+        self, mocker, router_instance, caplog
+    ):
         mock_routes_config = {
             "routes": [
                 {"method": "GET", "path": "/missing", "handler": "non_existent_handler"}
@@ -238,7 +242,6 @@ class TestLoader:
         mocker.patch(
             "builtins.open", mocker.mock_open(read_data=json.dumps(mock_routes_config))
         )
-        mock_print = mocker.patch("builtins.print")
 
         # We mock importlib.import_module again instead of using mock_handlers_modules.
         # This is to ensure 'non_existent_handler' isn't available
@@ -255,14 +258,15 @@ class TestLoader:
 
         load_routes(router_instance)
         # Since the handler will not exist it will never be added and loader will skip it.
-        mock_print.assert_any_call(
+        assert (
             "Warning: Handler 'non_existent_handler' not found for route GET /missing. Skipping"
+            in caplog.messages
         )
         assert not router_instance.get_handler("GET", "/missing")[0]
 
     # Test handling of malformed route entries (missing method, path, or handler).
     def test_load_routes_missing_required_fields(
-        self, mocker, router_instance, mock_handlers_modules
+        self, mocker, router_instance, mock_handlers_modules, caplog
     ):
         mock_routes_config = {
             "routes": [
@@ -274,22 +278,46 @@ class TestLoader:
         mocker.patch(
             "builtins.open", mocker.mock_open(read_data=json.dumps(mock_routes_config))
         )
-        mock_print = mocker.patch("builtins.print")
 
         load_routes(router_instance)
         # Adding these routes should be skipped since they are not in the correct format.
-        mock_print.assert_any_call(
+        assert (
             "Warning: Skipping malformed route entry: {'path': '/no-method', 'handler': 'serve_static_file'}"
+            in caplog.messages
         )
-        mock_print.assert_any_call(
+        assert (
             "Warning: Skipping malformed route entry: {'method': 'GET', 'handler': 'serve_static_file'}"
+            in caplog.messages
         )
-        mock_print.assert_any_call(
+        assert (
             "Warning: Skipping malformed route entry: {'method': 'POST', 'path': '/no-handler'}"
+            in caplog.messages
         )
         # Checking that no routes should be added.
         assert not router_instance.routes
 
+    # Test that only the handler modules named by the config get imported.
+    def test_load_routes_imports_only_used_modules(
+        self, mocker, router_instance, mock_handlers_modules
+    ):
+        mock_routes_config = {
+            "routes": [{"method": "GET", "path": "/", "handler": "serve_static_file"}]
+        }
+        mocker.patch(
+            "builtins.open", mocker.mock_open(read_data=json.dumps(mock_routes_config))
+        )
+
+        load_routes(router_instance)
+
+        # mocker.patch() itself goes through import_module, so only look at our handler modules.
+        imported = [
+            call.args[0]
+            for call in importlib.import_module.call_args_list
+            if call.args[0].startswith("src.handlers.")
+        ]
+        assert imported == ["src.handlers.static_handlers"]
+        assert router_instance.get_handler("GET", "/")[0] is mock_serve_static_file
+
     #### BIND_HANDLER() TESTS ####
     # Test bind_handler when no handler_args are provided.
     def test_bind_handler_no_args(self, mocker):
@@ -301,6 +329,10 @@ class TestLoader:
         assert bound is original_handler
         assert bound(mocker.Mock()) == "no_args"
 
+        # Empty args in the config don't need a wrapper either.
+        assert bind_handler(original_handler, []) is original_handler
+        assert bind_handler(original_handler, {}) is original_handler
+
     # Test bind_handler with dictionary handler_args.
     def test_bind_handler_dict_args(self, mocker):
 
@@ -336,3 +368,18 @@ class TestLoader:
         bound = bind_handler(original_handler, arg)
         assert callable(bound)
         assert bound(mocker.Mock()) == "single_arg_single_value"
+
+    # Test that binding args to a protected handler keeps the route protected.
+    def test_bind_handler_keeps_protection(self, mocker):
+
+        @protected_route
+        def original_handler(req, param1):
+            return f"protected_{param1}"
+
+        bound = bind_handler(original_handler, {"param1": "value1"})
+        assert bound is not original_handler
+        assert is_protected(bound)
+        assert bound(mocker.Mock()) == "protected_value1"
+
+        # Unprotected handlers stay unprotected once bound.
+        assert not is_protected(bind_handler(mock_get_data, {"user_id": 1}))
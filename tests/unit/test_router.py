@@ -107,3 +107,28 @@ class TestRouter:
             "handler": handler_one,
             "handler_args": None,
         }
+
+    #### GET_ALLOWED_METHODS() TESTS ####
+    # Test that get_allowed_methods lists every method registered for a path.
+    def test_get_allowed_methods(self, router):
+        router.add_route("GET", "/api/data", handler_one)
+        router.add_route("POST", "/api/data", handler_one)
+        router.add_route("GET", "/other", handler_one)
+        assert sorted(router.get_allowed_methods("/api/data")) == ["GET", "POST"]
+        assert router.get_allowed_methods("/nonexistent") == []
+
+    #### FREEZE() TESTS ####
+    # Test that a frozen router still resolves routes and methods but rejects new routes.
+    def test_freeze(self, router):
+        router.add_route("GET", "/api/data", handler_one)
+        router.add_route("POST", "/api/data", handler_two)
+        router.freeze()
+
+        assert router.get_handler("POST", "/api/data") == (handler_two, None)
+        assert sorted(router.get_allowed_methods("/api/data")) == ["GET", "POST"]
+        assert router.get_allowed_methods("/nonexistent") == []
+        with pytest.raises(RuntimeError):
+            router.add_route("PUT", "/api/data", handler_three)
+        # The table itself is read-only too.
+        with pytest.raises(TypeError):
+            router.routes[("PUT", "/api/data")] = {"handler": handler_three}
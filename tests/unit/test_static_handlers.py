@@ -1,6 +1,8 @@
+from collections import OrderedDict
 import pytest
 import os
-from src.webserver import Request
+import stat
+from src.webserver import FileBody, Request
 from src.handlers import static_handlers
 import mimetypes
 
@@ -18,14 +20,28 @@ class TestStaticHandler:
     @pytest.fixture(autouse=True)
     def setup_mocker_for_class(self, mocker):
         self._mocker = mocker
-        self.mock_os_path_isfile = mocker.patch("os.path.isfile")
         self.mock_open = mocker.patch("builtins.open")
         self.mock_mimetypes_guess_type = mocker.patch("mimetypes.guess_type")
+        # Small files by default, so they are read into memory.
+        self.mock_os_fstat = mocker.patch("os.fstat")
+        self.mock_os_fstat.return_value.st_size = 100
+        self.mock_os_fstat.return_value.st_mode = stat.S_IFREG | 0o644
+        self.mock_os_fstat.return_value.st_mtime_ns = 1_000_000_000
+        self.mock_os_fstat.return_value.st_ino = 42
+        # The path lookup sees the same file as the open one unless a test says otherwise.
+        self.mock_os_stat = mocker.patch(
+            "os.stat", return_value=self.mock_os_fstat.return_value
+        )
+        # Every test starts with an empty file cache.
+        mocker.patch.object(static_handlers, "_file_cache", OrderedDict())
+        mocker.patch.object(static_handlers, "_file_cache_bytes", 0)
         # We use the original os.path.join as side_effect to ensure correct path construction
         # while still being able to assert calls to it.
         self.mock_os_path_join = mocker.patch("os.path.join", side_effect=os.path.join)
-        # Mock mimetypes.add_type to prevent global state modification
-        self.mock_mimetypes_add_type = mocker.patch("mimetypes.add_type")
+        # Content types are cached per extension, don't let one test see another one's mocked results.
+        static_handlers._lookup_content_type.cache_clear()
+        yield
+        static_handlers._lookup_content_type.cache_clear()
 
     #### SERVER_STATIC_FILE() TESTS ####
     # Test successfully serving an HTML file.
@@ -33,11 +49,7 @@ class TestStaticHandler:
 
         filepath = "index.html"
         file_content = b"<h1>Hello, world!</h1>"
-        self.mock_os_path_isfile.return_value = True
-        self.mock_open.return_value.__enter__.return_value.read.return_value = (
-            file_content
-        )
-        self.mock_mimetypes_guess_type.return_value = ("text/html", None)
+        self.mock_open.return_value.read.return_value = file_content
 
         status, content_type, content = static_handlers.serve_static_file(
             mock_request, filepath
@@ -47,26 +59,17 @@ class TestStaticHandler:
         assert content_type == "text/html"
         assert content == file_content
         self.mock_os_path_join.assert_called_with(mock_request.web_root_dir, filepath)
-        self.mock_os_path_isfile.assert_called_with(
-            os.path.join(mock_request.web_root_dir, filepath)
-        )
         self.mock_open.assert_called_with(
             os.path.join(mock_request.web_root_dir, filepath), "rb"
         )
-        self.mock_mimetypes_guess_type.assert_called_with(
-            os.path.join(mock_request.web_root_dir, filepath)
-        )
+        self.mock_mimetypes_guess_type.assert_not_called()
 
     # Test successfully serving a JavaScript file with correct content type.
     def test_serve_existing_js_file(self, mock_request):
 
         filepath = "script.js"
         file_content = b"console.log('Hello from JS!');"
-        self.mock_os_path_isfile.return_value = True
-        self.mock_open.return_value.__enter__.return_value.read.return_value = (
-            file_content
-        )
-        self.mock_mimetypes_guess_type.return_value = ("application/javascript", None)
+        self.mock_open.return_value.read.return_value = file_content
 
         status, content_type, content = static_handlers.serve_static_file(
             mock_request, filepath
@@ -76,26 +79,17 @@ class TestStaticHandler:
         assert content_type == "application/javascript"
         assert content == file_content
         self.mock_os_path_join.assert_called_with(mock_request.web_root_dir, filepath)
-        self.mock_os_path_isfile.assert_called_with(
-            os.path.join(mock_request.web_root_dir, filepath)
-        )
         self.mock_open.assert_called_with(
             os.path.join(mock_request.web_root_dir, filepath), "rb"
         )
-        self.mock_mimetypes_guess_type.assert_called_with(
-            os.path.join(mock_request.web_root_dir, filepath)
-        )
+        self.mock_mimetypes_guess_type.assert_not_called()
 
     # Test successfully serving a CSS file with correct content type.
     def test_serve_existing_css_file(self, mock_request):
 
         filepath = "style.css"
         file_content = b"body { color: red; }"
-        self.mock_os_path_isfile.return_value = True
-        self.mock_open.return_value.__enter__.return_value.read.return_value = (
-            file_content
-        )
-        self.mock_mimetypes_guess_type.return_value = ("text/css", None)
+        self.mock_open.return_value.read.return_value = file_content
 
         status, content_type, content = static_handlers.serve_static_file(
             mock_request, filepath
@@ -105,21 +99,70 @@ class TestStaticHandler:
         assert content_type == "text/css"
         assert content == file_content
         self.mock_os_path_join.assert_called_with(mock_request.web_root_dir, filepath)
-        self.mock_os_path_isfile.assert_called_with(
-            os.path.join(mock_request.web_root_dir, filepath)
-        )
         self.mock_open.assert_called_with(
             os.path.join(mock_request.web_root_dir, filepath), "rb"
         )
-        self.mock_mimetypes_guess_type.assert_called_with(
-            os.path.join(mock_request.web_root_dir, filepath)
+        self.mock_mimetypes_guess_type.assert_not_called()
+
+    # Test that big files are handed to the server as a FileBody instead of being read.
+    def test_serve_large_file_as_file_body(self, mock_request):
+
+        filepath = "images/large.png"
+        self.mock_os_fstat.return_value.st_size = 10 * 1024 * 1024
+        mock_file = self.mock_open.return_value
+
+        status, content_type, content = static_handlers.serve_static_file(
+            mock_request, filepath
+        )
+
+        assert status == 200
+        assert isinstance(content, FileBody)
+        assert content.file is mock_file
+        assert len(content) == 10 * 1024 * 1024
+        mock_file.read.assert_not_called()
+        # The server closes the file after sending it.
+        mock_file.close.assert_not_called()
+
+    # Test that extensions missing from our own table fall back to mimetypes.guess_type().
+    def test_serve_file_unknown_extension_uses_mimetypes(self, mock_request):
+
+        filepath = "archive.tar"
+        self.mock_open.return_value.read.return_value = b"data"
+        self.mock_mimetypes_guess_type.return_value = ("application/x-tar", None)
+
+        status, content_type, content = static_handlers.serve_static_file(
+            mock_request, filepath
+        )
+
+        assert status == 200
+        assert content_type == "application/x-tar"
+        self.mock_mimetypes_guess_type.assert_called_once_with("file.tar")
+
+    # Test that mimetypes is only asked once per extension.
+    def test_content_type_cached_per_extension(self):
+
+        self.mock_mimetypes_guess_type.return_value = ("application/x-tar", None)
+
+        assert static_handlers._get_content_type("webroot/a.tar") == "application/x-tar"
+        assert static_handlers._get_content_type("webroot/B.TAR") == "application/x-tar"
+
+        self.mock_mimetypes_guess_type.assert_called_once_with("file.tar")
+
+    # Test that files mimetypes knows nothing about are sent as plain binary data.
+    def test_content_type_unknown_defaults_to_octet_stream(self):
+
+        self.mock_mimetypes_guess_type.return_value = (None, None)
+
+        assert (
+            static_handlers._get_content_type("webroot/LICENSE")
+            == "application/octet-stream"
         )
 
     # Test handling requests for non-existent static files (should return 404).
     def test_serve_non_existent_file(self, mock_request):
 
         filepath = "non_existent.html"
-        self.mock_os_path_isfile.return_value = False
+        self.mock_open.side_effect = FileNotFoundError
 
         status, content_type, content = static_handlers.serve_static_file(
             mock_request, filepath
@@ -129,22 +172,95 @@ class TestStaticHandler:
         assert content_type == "text/plain"
         assert b"404 Not Found: Static file not found." in content
         self.mock_os_path_join.assert_called_with(mock_request.web_root_dir, filepath)
-        self.mock_os_path_isfile.assert_called_with(
-            os.path.join(mock_request.web_root_dir, filepath)
+        self.mock_open.assert_called_once_with(
+            os.path.join(mock_request.web_root_dir, filepath), "rb"
         )
-        self.mock_open.assert_not_called()
 
-    # Test handling a general exception during file serving.
-    def test_serve_static_file_general_exception(self, mock_request):
+    # Test that asking for a directory is a 404, not a 500.
+    def test_serve_directory_returns_404(self, mock_request):
 
-        filepath = "error_file.txt"
-        self.mock_os_path_isfile.return_value = True
-        self.mock_open.return_value.__enter__.return_value.read.side_effect = IOError(
-            "Disk full"
+        self.mock_open.side_effect = IsADirectoryError
+
+        status, content_type, content = static_handlers.serve_static_file(
+            mock_request, "images"
+        )
+
+        assert status == 404
+        assert b"404 Not Found: Static file not found." in content
+
+    # Test that a file we are not allowed to read is a 403.
+    def test_serve_unreadable_file_returns_403(self, mock_request):
+
+        self.mock_open.side_effect = PermissionError
+
+        status, content_type, content = static_handlers.serve_static_file(
+            mock_request, "secret.txt"
+        )
+
+        assert status == 403
+        assert content_type == "text/plain"
+        assert b"403 Forbidden" in content
+
+    # Test that anything other than a regular file is a 404 and gets closed again.
+    def test_serve_non_regular_file_returns_404(self, mock_request):
+
+        self.mock_os_fstat.return_value.st_mode = stat.S_IFCHR | 0o666
+
+        status, content_type, content = static_handlers.serve_static_file(
+            mock_request, "zero.txt"
+        )
+
+        assert status == 404
+        self.mock_open.return_value.read.assert_not_called()
+        self.mock_open.return_value.close.assert_called_once()
+
+    # Test that a small file is only read from disk once while it stays the same.
+    def test_serve_small_file_from_cache(self, mock_request):
+
+        self.mock_open.return_value.read.return_value = b"body { margin: 0; }"
+
+        first = static_handlers.serve_static_file(mock_request, "style.css")
+        second = static_handlers.serve_static_file(mock_request, "style.css")
+
+        assert first == second == (200, "text/css", b"body { margin: 0; }")
+        self.mock_open.assert_called_once()
+        assert self.mock_os_stat.call_count == 2
+
+    # Test that a file that changed on disk is read again instead of served from the cache.
+    def test_serve_modified_file_skips_cache(self, mock_request):
+
+        self.mock_open.return_value.read.return_value = b"old"
+        static_handlers.serve_static_file(mock_request, "style.css")
+
+        self.mock_os_fstat.return_value.st_mtime_ns += 1
+        self.mock_open.return_value.read.return_value = b"new"
+        status, _, content = static_handlers.serve_static_file(
+            mock_request, "style.css"
         )
 
-        # Mock the print function to prevent actual output during the test
-        self._mocker.patch("builtins.print")
+        assert status == 200
+        assert content == b"new"
+        assert self.mock_open.call_count == 2
+
+    # Test that the cache evicts the least recently used files once it is over its size budget.
+    def test_file_cache_evicts_by_total_size(self, mock_request, mocker):
+
+        mocker.patch.object(static_handlers, "_FILE_CACHE_MAX_BYTES", 10)
+        self.mock_open.return_value.read.return_value = b"123456"
+
+        static_handlers.serve_static_file(mock_request, "a.txt")
+        static_handlers.serve_static_file(mock_request, "b.txt")
+
+        assert list(static_handlers._file_cache) == [
+            os.path.join(mock_request.web_root_dir, "b.txt")
+        ]
+        assert static_handlers._file_cache_bytes == 6
+
+    # Test handling a general exception during file serving.
+    def test_serve_static_file_general_exception(self, mock_request, caplog):
+
+        filepath = "error_file.txt"
+        self.mock_open.return_value.read.side_effect = IOError("Disk full")
 
         status, content_type, content = static_handlers.serve_static_file(
             mock_request, filepath
@@ -156,12 +272,11 @@ class TestStaticHandler:
             b"500 Internal Server Error: Could not serve file (Disk full)." in content
         )
         self.mock_os_path_join.assert_called_with(mock_request.web_root_dir, filepath)
-        self.mock_os_path_isfile.assert_called_with(
-            os.path.join(mock_request.web_root_dir, filepath)
-        )
         self.mock_open.assert_called_with(
             os.path.join(mock_request.web_root_dir, filepath), "rb"
         )
+        # The error is logged, not printed.
+        assert "Error serving static file error_file.txt: Disk full" in caplog.text
 
     # Test handling directory traversal attempts (e.g., /../etc/passwd).
     def test_directory_traversal_attempt(self, mock_request):
@@ -169,7 +284,7 @@ class TestStaticHandler:
         filepath = "../etc/passwd"
         expected_full_path = os.path.join(mock_request.web_root_dir, filepath)
 
-        self.mock_os_path_isfile.return_value = False
+        self.mock_open.side_effect = FileNotFoundError
 
         status, content_type, content = static_handlers.serve_static_file(
             mock_request, filepath
@@ -179,5 +294,4 @@ class TestStaticHandler:
         assert content_type == "text/plain"
         assert b"404 Not Found: Static file not found." in content
         self.mock_os_path_join.assert_called_with(mock_request.web_root_dir, filepath)
-        self.mock_os_path_isfile.assert_called_with(expected_full_path)
-        self.mock_open.assert_not_called()
+        self.mock_open.assert_called_once_with(expected_full_path, "rb")
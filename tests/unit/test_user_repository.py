@@ -0,0 +1,256 @@
+from collections import OrderedDict
+import pytest
+from sqlalchemy import create_engine, delete, select
+from sqlalchemy import orm as so
+from sqlalchemy.pool import StaticPool
+from src.database import user_repository
+from src.database.db_config import Base
+from src.database.models import User
+from src.database.user_repository import UserAuthRow, get_user_auth_row
+
+
+class TestUserRepository:
+
+    # Same setup as the init_db tests, an in memory SQLite database shared through a StaticPool so every
+    # session sees the same data. The tables are created once for the whole test session.
+    @pytest.fixture(scope="session")
+    def sqlite_engine(self):
+        engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        Base.metadata.create_all(bind=engine)
+        yield engine
+        engine.dispose()
+
+    # A session on the SQLite database with an empty auth row cache, the users table is emptied again
+    # after each test.
+    @pytest.fixture
+    def db_session(self, sqlite_engine, mocker):
+        mocker.patch.object(user_repository, "_auth_row_cache", OrderedDict())
+        session = so.sessionmaker(autoflush=False, bind=sqlite_engine)()
+
+        yield session
+
+        session.rollback()
+        session.execute(delete(User))
+        session.commit()
+        session.close()
+
+    # Adds users straight through the session, without going through the functions under test.
+    def add_users(self, session, *usernames, role="user"):
+        for username in usernames:
+            session.add(
+                User(username=username, hashed_password=f"hash_{username}", role=role)
+            )
+        session.commit()
+
+    #### USER_EXISTS() ####
+    # Test that user_exists() finds a user that is there.
+    def test_user_exists_true(self, db_session):
+        self.add_users(db_session, "admin")
+
+        assert user_repository.user_exists(db_session, "admin") is True
+
+    # Test that user_exists() returns False for a user that isn't.
+    def test_user_exists_false(self, db_session):
+        self.add_users(db_session, "alice")
+
+        assert user_repository.user_exists(db_session, "admin") is False
+
+    #### GET_USER_AUTH_ROW() ####
+    # Test that an unknown username returns None and is not cached.
+    def test_get_user_auth_row_miss(self, db_session):
+        assert get_user_auth_row(db_session, "ghost") is None
+        assert "ghost" not in user_repository._auth_row_cache
+
+    # Test that the second lookup of a username is served from the cache without a query.
+    def test_get_user_auth_row_hit(self, db_session, mocker):
+        self.add_users(db_session, "alice")
+
+        row = get_user_auth_row(db_session, "alice")
+        assert isinstance(row, UserAuthRow)
+        assert row.username == "alice"
+        assert row.hashed_password == "hash_alice"
+        assert row.role == "user"
+
+        execute_spy = mocker.spy(db_session, "execute")
+        assert get_user_auth_row(db_session, "alice") is row
+        execute_spy.assert_not_called()
+
+    # Test that a cached row expires after _AUTH_ROW_CACHE_TTL seconds and is read again.
+    def test_get_user_auth_row_expires(self, db_session, mocker):
+        self.add_users(db_session, "alice")
+        mock_monotonic = mocker.patch("time.monotonic", return_value=1000.0)
+        get_user_auth_row(db_session, "alice")
+
+        execute_spy = mocker.spy(db_session, "execute")
+        mock_monotonic.return_value = 1000.0 + user_repository._AUTH_ROW_CACHE_TTL
+        assert get_user_auth_row(db_session, "alice").username == "alice"
+        execute_spy.assert_called_once()
+
+    # Test that the least recently used row is evicted once the cache is full.
+    def test_get_user_auth_row_evicts_least_recently_used(self, db_session, mocker):
+        mocker.patch.object(user_repository, "_AUTH_ROW_CACHE_SIZE", 2)
+        self.add_users(db_session, "alice", "bob", "carol")
+
+        get_user_auth_row(db_session, "alice")
+        get_user_auth_row(db_session, "bob")
+        # Using alice again makes bob the least recently used one.
+        get_user_auth_row(db_session, "alice")
+        get_user_auth_row(db_session, "carol")
+
+        assert list(user_repository._auth_row_cache) == ["alice", "carol"]
+
+    # Test that a row read before a concurrent write is not put in the cache after the write evicted it.
+    def test_get_user_auth_row_skips_cache_fill_after_invalidation(
+        self, db_session, mocker
+    ):
+        self.add_users(db_session, "alice")
+        execute = db_session.execute
+
+        # Another thread changes alice right after our SELECT ran, before we get to fill the cache.
+        def execute_then_invalidate(*args, **kwargs):
+            result = execute(*args, **kwargs)
+            user_repository._invalidate_auth_row("alice")
+            return result
+
+        mocker.patch.object(db_session, "execute", side_effect=execute_then_invalidate)
+
+        assert get_user_auth_row(db_session, "alice").username == "alice"
+        assert "alice" not in user_repository._auth_row_cache
+
+    # Test that creating a user evicts whatever was cached under its username.
+    def test_create_user_invalidates_auth_row(self, db_session):
+        user_repository._auth_row_cache["alice"] = (
+            UserAuthRow(99, "alice", "guest", "stale_hash"),
+            float("inf"),
+        )
+
+        user_repository.create_user(db_session, "alice", "hash_alice", "user")
+
+        assert "alice" not in user_repository._auth_row_cache
+        assert get_user_auth_row(db_session, "alice").hashed_password == "hash_alice"
+
+    # Test that changing a user's role evicts the cached row.
+    def test_update_user_role_invalidates_auth_row(self, db_session):
+        self.add_users(db_session, "alice")
+        assert get_user_auth_row(db_session, "alice").role == "user"
+
+        user_repository.update_user_role(db_session, "alice", "admin")
+
+        assert get_user_auth_row(db_session, "alice").role == "admin"
+
+    # Test that deleting a user evicts the cached row.
+    def test_delete_user_invalidates_auth_row(self, db_session):
+        self.add_users(db_session, "alice")
+        assert get_user_auth_row(db_session, "alice") is not None
+
+        user_repository.delete_user(db_session, "alice")
+
+        assert get_user_auth_row(db_session, "alice") is None
+
+    #### CREATE_USER() / UPDATE_USER_ROLE() ####
+    # Test that create_user() returns the new user with the id and created_at the database generated.
+    def test_create_user(self, db_session):
+        user = user_repository.create_user(db_session, "alice", "hash_alice", "admin")
+
+        assert isinstance(user.id, int)
+        assert user.username == "alice"
+        assert user.hashed_password == "hash_alice"
+        assert user.role == "admin"
+        assert user.created_at is not None
+        # The returned User only carries the row back, it isn't attached to the session.
+        assert user not in db_session
+
+        stored = db_session.get(User, user.id)
+        assert stored.username == "alice"
+        assert stored.role == "admin"
+        assert stored.created_at == user.created_at
+
+    # Test that update_user_role() returns a detached copy of the whole updated row.
+    def test_update_user_role(self, db_session):
+        self.add_users(db_session, "alice")
+        original = db_session.execute(
+            select(User).where(User.username == "alice")
+        ).scalar_one()
+        original_id, original_created_at = original.id, original.created_at
+        db_session.expunge_all()
+
+        user = user_repository.update_user_role(db_session, "alice", "admin")
+
+        assert user.id == original_id
+        assert user.username == "alice"
+        assert user.hashed_password == "hash_alice"
+        assert user.role == "admin"
+        assert user.created_at == original_created_at
+        assert user not in db_session
+        assert db_session.get(User, original_id).role == "admin"
+
+    # Test that updating a user that doesn't exist returns None.
+    def test_update_user_role_missing_user(self, db_session):
+        assert user_repository.update_user_role(db_session, "ghost", "admin") is None
+
+    #### DELETE_USER() ####
+    # Test that deleting an existing user removes the row and returns True.
+    def test_delete_user_existing(self, db_session):
+        self.add_users(db_session, "alice", "bob")
+
+        assert user_repository.delete_user(db_session, "alice") is True
+        assert db_session.execute(select(User.username)).scalars().all() == ["bob"]
+
+    # Test that deleting a user that doesn't exist returns False.
+    def test_delete_user_missing(self, db_session):
+        self.add_users(db_session, "bob")
+
+        assert user_repository.delete_user(db_session, "ghost") is False
+        assert db_session.execute(select(User.username)).scalars().all() == ["bob"]
+
+    #### CREATE_USERS_BULK() ####
+    # create_users_bulk() goes through psycopg2's execute_values() on the raw cursor, which SQLite can't
+    # run, so these tests use a mock session and patch execute_values().
+
+    # Test that the new ids come back in order and the cached rows of the new usernames are evicted.
+    def test_create_users_bulk(self, mocker):
+        mocker.patch.object(
+            user_repository,
+            "_auth_row_cache",
+            OrderedDict(
+                alice=(UserAuthRow(9, "alice", "guest", "stale"), float("inf")),
+                carol=(UserAuthRow(3, "carol", "user", "hash_carol"), float("inf")),
+            ),
+        )
+        mock_execute_values = mocker.patch.object(
+            user_repository, "execute_values", return_value=[(1,), (2,)]
+        )
+        mock_session = mocker.MagicMock()
+        mock_cursor = (
+            mock_session.connection.return_value.connection.cursor.return_value
+        )
+        rows = [("alice", "hash_alice", "user"), ("bob", "hash_bob", "admin")]
+
+        ids = user_repository.create_users_bulk(mock_session, rows)
+
+        assert ids == [1, 2]
+        mock_execute_values.assert_called_once_with(
+            mock_cursor,
+            "INSERT INTO users (username, hashed_password, role) VALUES %s RETURNING id",
+            rows,
+            page_size=1000,
+            fetch=True,
+        )
+        mock_cursor.close.assert_called_once()
+        mock_session.commit.assert_called_once()
+        # Only the inserted usernames are evicted.
+        assert list(user_repository._auth_row_cache) == ["carol"]
+
+    # Test that an empty list returns no ids without touching the database.
+    def test_create_users_bulk_empty(self, mocker):
+        mock_execute_values = mocker.patch.object(user_repository, "execute_values")
+        mock_session = mocker.MagicMock()
+
+        assert user_repository.create_users_bulk(mock_session, []) == []
+        mock_execute_values.assert_not_called()
+        mock_session.connection.assert_not_called()
+        mock_session.commit.assert_not_called()
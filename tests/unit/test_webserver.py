@@ -1,9 +1,17 @@
-import datetime
+import re
+import selectors
 import socket
+import time
 import threading
 import pytest
 from src.router import Router
-from src.webserver import Request, WebServer
+from src import webserver
+from src.webserver import ClientConnection, FileBody, Request, WebServer
+
+# An RFC 7231 Date header line, e.g. "Date: Sun, 06 Nov 1994 08:49:37 GMT".
+HTTP_DATE_HEADER = (
+    r"\r\nDate: [A-Z][a-z]{2}, \d{2} [A-Z][a-z]{2} \d{4} \d{2}:\d{2}:\d{2} GMT\r\n"
+)
 
 
 class TestWebServer:
@@ -38,6 +46,41 @@ class TestWebServer:
         # yield will clean up the instance created here to avoid any issues.
         yield mock_socket
 
+    # A server with what start() sets up for the event loop, on real sockets: a listening socket on a free
+    # port, the selector and the wakeup socket pair. Nothing runs the loop, the tests call poll_connections().
+    @pytest.fixture
+    def event_loop_server(self, web_server_instance):
+        server = web_server_instance
+        server.server_socket = socket.create_server(("127.0.0.1", 0))
+        server.server_socket.setblocking(False)
+        server.selector = selectors.DefaultSelector()
+        server.wakeup_recv, server.wakeup_send = socket.socketpair()
+        server.wakeup_recv.setblocking(False)
+        server.wakeup_send.setblocking(False)
+        server.selector.register(server.server_socket, selectors.EVENT_READ)
+        server.selector.register(server.wakeup_recv, selectors.EVENT_READ)
+
+        yield server
+
+        for key in list(server.selector.get_map().values()):
+            key.fileobj.close()
+        server.selector.close()
+        server.wakeup_send.close()
+
+    # Connects a client to the event_loop_server and lets the event loop accept it.
+    def connect_client(self, server):
+        client = socket.create_connection(server.server_socket.getsockname())
+        server.poll_connections(timeout=1.0)
+        return client
+
+    # The connections the event loop is watching, the listening socket and the wakeup socket left out.
+    def watched_connections(self, server):
+        return [
+            key.data
+            for key in server.selector.get_map().values()
+            if key.data is not None
+        ]
+
     #### REQUEST OBJECT TESTS. ####
     # Test basic initialization with all required arguments.
     def test_request_initialization(self):
@@ -91,6 +134,34 @@ class TestWebServer:
         assert request.params == params
         assert request.user == user_data
 
+    # Test that the body is only decoded when decoded_body is used.
+    def test_request_decoded_body_is_lazy(self):
+        request = Request(
+            method="POST",
+            path="/submit",
+            version="HTTP/1.1",
+            headers={},
+            body="héllo".encode("utf-8"),
+            web_root_dir="/var/www",
+        )
+
+        assert request.decoded_body == "héllo"
+        # Decoded once, then reused.
+        assert request.decoded_body is request.decoded_body
+
+    # Test that a body that isn't UTF-8 has no decoded form.
+    def test_request_decoded_body_invalid_utf8(self):
+        request = Request(
+            method="POST",
+            path="/upload",
+            version="HTTP/1.1",
+            headers={},
+            body=b"\xff\xfe\x00",
+            web_root_dir="/var/www",
+        )
+
+        assert request.decoded_body is None
+
     # Test handling of None for headers, body, params and user.
     def test_request_initialization_none(self):
         # Ensure headers, body, params and user is None and see if they get assigned default values.
@@ -173,17 +244,20 @@ class TestWebServer:
         mock_socket_instance = mocker.Mock()
         mocker.patch("socket.socket", return_value=mock_socket_instance)
 
-        # Prepare the mock client socket and address that accept() will return.
-        mock_client_socket = mocker.Mock(name="mock_client_socket")
-        mock_client_address = ("127.0.0.1", 12345)
+        # Mock the wakeup socket pair and the selector, start() only sets them up for the event loop.
+        mock_wakeup_recv = mocker.Mock(name="mock_wakeup_recv")
+        mock_wakeup_send = mocker.Mock(name="mock_wakeup_send")
+        mocker.patch(
+            "socket.socketpair", return_value=(mock_wakeup_recv, mock_wakeup_send)
+        )
+        mock_selector = mocker.Mock(name="mock_selector")
+        mock_selector.get_map.return_value = {}
+        mocker.patch("selectors.DefaultSelector", return_value=mock_selector)
 
-        # Configure the mocked accept() to raise a KeyboardInterrupt after one 'connection'.
-        mock_socket_instance.accept.side_effect = [
-            # First call to accept returns our specific mock client_socket and address.
-            (mock_client_socket, mock_client_address),
-            # Subsequent call raises KeyboardInterrupt to stop the loop.
-            KeyboardInterrupt,
-        ]
+        # Configure the event loop to raise a KeyboardInterrupt in its second round.
+        mocker.patch.object(
+            WebServer, "poll_connections", side_effect=[None, KeyboardInterrupt]
+        )
 
         # Mock threading.Thread to prevent actual threads from spawning.
         mock_thread_instance = mocker.Mock()
@@ -195,6 +269,7 @@ class TestWebServer:
             port="8080",
             web_root_dir="/dummy/path",
             router=router,
+            worker_threads=3,
         )
 
         # Call the start method, which should now exit due to KeyboardInterrupt
@@ -207,21 +282,125 @@ class TestWebServer:
             socket.SOL_SOCKET, socket.SO_REUSEADDR, 1
         )
         mock_socket_instance.bind.assert_called_once_with(("127.0.0.1", 8080))
-        mock_socket_instance.listen.assert_called_once_with(128)
+        mock_socket_instance.listen.assert_called_once_with(WebServer.LISTEN_BACKLOG)
+        mock_socket_instance.setblocking.assert_called_once_with(False)
 
-        # Assert that accept was called twice.
-        assert mock_socket_instance.accept.call_count == 2
+        # Assert that the event loop watches the listening socket and the wakeup socket.
+        mock_selector.register.assert_has_calls(
+            [
+                mocker.call(mock_socket_instance, selectors.EVENT_READ),
+                mocker.call(mock_wakeup_recv, selectors.EVENT_READ),
+            ]
+        )
+        assert WebServer.poll_connections.call_count == 2
 
-        # Assert that a client handling thread was started.
-        threading.Thread.assert_called_once_with(
-            target=server.handle_client,
-            args=(mock_client_socket, mock_client_address),
-            daemon=True,
+        # Assert that the configured number of worker threads was started once, up front.
+        assert threading.Thread.call_count == 3
+        threading.Thread.assert_called_with(
+            target=server.serve_connections, daemon=True
         )
-        mock_thread_instance.start.assert_called_once()
+        assert mock_thread_instance.start.call_count == 3
 
-        # Assert that the server socket was closed.
+        # Assert that the server socket, the selector and the wakeup sockets were closed.
         mock_socket_instance.close.assert_called_once()
+        mock_selector.close.assert_called_once()
+        mock_wakeup_recv.close.assert_called_once()
+        mock_wakeup_send.close.assert_called_once()
+
+    # Test that the pool size and keep-alive timeout default to the class constants.
+    def test_webserver_worker_defaults(self, web_server_instance):
+        assert web_server_instance.worker_threads == WebServer.WORKER_THREADS
+        assert web_server_instance.keep_alive_timeout == WebServer.KEEP_ALIVE_TIMEOUT
+
+    #### POLL_CONNECTIONS() TESTS. ####
+    # Test that a new connection is watched by the event loop and only goes to a worker once it sent something.
+    def test_poll_connections_hands_readable_connection_to_worker(
+        self, event_loop_server
+    ):
+        server = event_loop_server
+        client = self.connect_client(server)
+        try:
+            [connection] = self.watched_connections(server)
+            assert isinstance(connection, ClientConnection)
+            assert connection.sock.gettimeout() == server.keep_alive_timeout
+            assert server.connection_queue.empty()
+
+            client.sendall(b"GET / HTTP/1.1\r\n\r\n")
+            server.poll_connections(timeout=1.0)
+
+            assert server.connection_queue.get_nowait() is connection
+            assert self.watched_connections(server) == []
+            connection.sock.close()
+        finally:
+            client.close()
+
+    # Test that a connection handed back by a worker is watched again, with its buffer.
+    def test_park_connection_registers_connection_again(self, event_loop_server):
+        server = event_loop_server
+        client = self.connect_client(server)
+        try:
+            client.sendall(b"GET / HTTP/1.1\r\n")
+            server.poll_connections(timeout=1.0)
+            connection = server.connection_queue.get_nowait()
+            connection.buffer += b"GET / HTTP/1.1\r\n"
+
+            server.park_connection(connection)
+            server.poll_connections(timeout=1.0)
+
+            assert self.watched_connections(server) == [connection]
+            assert connection.buffer == b"GET / HTTP/1.1\r\n"
+        finally:
+            client.close()
+
+    # Test that connections idle for longer than the keep-alive timeout are closed.
+    def test_close_idle_connections(self, event_loop_server):
+        server = event_loop_server
+        idle_client = self.connect_client(server)
+        busy_client = self.connect_client(server)
+        try:
+            idle_connection, busy_connection = sorted(
+                self.watched_connections(server),
+                key=lambda connection: connection.last_active,
+            )
+            idle_connection.last_active -= server.keep_alive_timeout + 1
+            now = busy_connection.last_active + 0.5
+
+            server.close_idle_connections(now)
+
+            assert self.watched_connections(server) == [busy_connection]
+            idle_client.settimeout(1.0)
+            assert idle_client.recv(1) == b""
+        finally:
+            idle_client.close()
+            busy_client.close()
+
+    #### SERVE_CONNECTIONS() TESTS. ####
+    # Test that a worker serves queued connections and survives errors escaping handle_client.
+    def test_serve_connections_survives_handler_errors(
+        self, web_server_instance, mocker
+    ):
+        server = web_server_instance
+        first = ClientConnection(mocker.Mock(name="first"), ("127.0.0.1", 1))
+        second = ClientConnection(mocker.Mock(name="second"), ("127.0.0.1", 2))
+        server.connection_queue.put(first)
+        server.connection_queue.put(second)
+
+        # The second call stops the otherwise endless worker loop.
+        mocker.patch.object(
+            server,
+            "handle_client",
+            side_effect=[OSError("Transport endpoint is not connected"), SystemExit],
+        )
+
+        with pytest.raises(SystemExit):
+            server.serve_connections()
+
+        [(first_args, _), (second_args, _)] = server.handle_client.call_args_list
+        assert first_args[0] is first
+        assert second_args[0] is second
+        # The worker receives into the same chunk for every connection.
+        assert len(first_args[1]) == WebServer.RECV_CHUNK_SIZE
+        assert second_args[1] is first_args[1]
 
     #### ADD_MIDDLEWARE() TESTS. ####
     # Test adding middleware functions.
@@ -250,6 +429,34 @@ class TestWebServer:
         assert server.middleware_functions[1] is dummy_middleware_2
         assert server.middleware_functions[2] is dummy_middleware_3
 
+    #### GET_HANDLER_CHAIN() TESTS. ####
+    # Test that the middleware chain is built once per handler and rebuilt after adding middleware.
+    def test_get_handler_chain_cached(self, web_server_instance):
+
+        server = web_server_instance
+        wrapped = []
+
+        # Each middleware records what it wrapped and tags the result with its name.
+        def middleware_1(handler):
+            wrapped.append(("middleware_1", handler))
+            return f"middleware_1({handler})"
+
+        def middleware_2(handler):
+            wrapped.append(("middleware_2", handler))
+            return f"middleware_2({handler})"
+
+        server.add_middleware(middleware_1)
+        assert server.get_handler_chain("handler") == "middleware_1(handler)"
+        assert server.get_handler_chain("handler") == "middleware_1(handler)"
+        assert wrapped == [("middleware_1", "handler")]
+
+        # Adding a middleware rebuilds the chain, the first middleware added is the outermost one.
+        server.add_middleware(middleware_2)
+        assert (
+            server.get_handler_chain("handler") == "middleware_1(middleware_2(handler))"
+        )
+        assert len(wrapped) == 3
+
     #### HANDLE_CLIENT() TESTS. ####
     # Test successful handling of a GET request.
     def test_handle_client_success(self, mocker):
@@ -261,9 +468,14 @@ class TestWebServer:
         mock_client_sock = mocker.Mock(name="mock_client_sock")
         mock_client_address = ("127.0.0.1", 54321)
 
-        # Configure recv to return sample request data, then empty bytes to signal EOF.
+        # Configure recv_into to fill the buffer with sample request data.
         sample_raw_request = b"GET /test HTTP/1.1\r\nHost: example.com\r\n\r\n"
-        mock_client_sock.recv.side_effect = [sample_raw_request, b""]
+
+        def fake_recv_into(buffer):
+            buffer[: len(sample_raw_request)] = sample_raw_request
+            return len(sample_raw_request)
+
+        mock_client_sock.recv_into.side_effect = fake_recv_into
 
         # Mock parse_request_from_buffer method of WebServer.
         mock_parsed_components = {
@@ -280,10 +492,17 @@ class TestWebServer:
 
         # mocker.patch.object() patches an attribute (which can be a method) on a specific object or class.
         # Since parse_request_from_buffer is an instance method, we patch it like this.
+        # handle_client() keeps reusing (and emptying) the same bytearray, so the mock would only remember
+        # the final state of it. We record a copy of the buffer on every call instead.
+        parse_results = iter([(mock_parsed_components, mock_consumed_bytes), (None, 0)])
+        seen_buffers = []
+
+        def fake_parse(buffer):
+            seen_buffers.append(bytes(buffer))
+            return next(parse_results)
+
         mocker.patch.object(
-            WebServer,
-            "parse_request_from_buffer",
-            side_effect=[(None, 0), (mock_parsed_components, mock_consumed_bytes)],
+            WebServer, "parse_request_from_buffer", side_effect=fake_parse
         )
 
         # Mock the router and its get_route_info method.
@@ -308,30 +527,27 @@ class TestWebServer:
             "handler_args": {"param1": "value1"},
         }
 
-        # Mock the send_response method of WebServer, no return value is expected.
-        mocker.patch.object(WebServer, "send_response")
+        # Mock the send_response method of WebServer, it reports the connection can be kept open.
+        mocker.patch.object(WebServer, "send_response", return_value=True)
+        # Mock park_connection, there is no event loop to hand the connection back to.
+        mocker.patch.object(WebServer, "park_connection")
 
         # Call the method to test it.
-        server.handle_client(mock_client_sock, mock_client_address)
+        connection = ClientConnection(mock_client_sock, mock_client_address)
+        server.handle_client(connection)
 
         # Here we will check the assertions.
-        # Verify recv was called at least once to get the data.
-        # It's called once in the 'else' block, after parse_request_from_buffer initially returns (None, 0).
-        mock_client_sock.recv.assert_called_with(4096)
-
-        # Verify parse_request_from_buffer was called 2 times once with empty buffer and one with populated buffer.
-        assert WebServer.parse_request_from_buffer.call_count == 3
-
-        # Check what those 2 calls were to ensure that there are no surprises when calling parse_request_from_buffer.
-        WebServer.parse_request_from_buffer.assert_has_calls(
-            [
-                mocker.call(b""),  # First call with empty buffer.
-                mocker.call(
-                    sample_raw_request
-                ),  # Second call with populated buffer after recv.
-            ]
+        # Verify recv_into was called exactly once, the socket is only read once per readable event.
+        mock_client_sock.recv_into.assert_called_once()
+        assert (
+            len(mock_client_sock.recv_into.call_args[0][0]) == WebServer.RECV_CHUNK_SIZE
         )
 
+        # Verify parse_request_from_buffer was called 2 times, once with the received request and once more
+        # with the (now empty) buffer after the request was handled.
+        assert WebServer.parse_request_from_buffer.call_count == 2
+        assert seen_buffers == [sample_raw_request, b""]
+
         # Verify router.get_route_info was called with correct method and path.
         mock_router.get_route_info.assert_called_once_with(
             mock_parsed_components["method"], mock_parsed_components["path"]
@@ -353,12 +569,166 @@ class TestWebServer:
         assert called_request.decoded_body == mock_parsed_components["decoded_body"]
         assert called_request.params == mock_parsed_components["params"]
 
-        # Verify send_response was called 2 times, once to mock and another by the handler.
-        assert WebServer.send_response.call_count == 2
+        # Verify send_response was called once with what the handler returned.
+        WebServer.send_response.assert_called_once_with(
+            mock_client_sock,
+            200,
+            "text/plain",
+            b"Hello, World!",
+            keep_alive=True,
+        )
+
+        # Verify the connection went back to the event loop instead of being closed.
+        WebServer.park_connection.assert_called_once_with(connection)
+        mock_client_sock.close.assert_not_called()
+
+    # Test that a connection is closed when the client disconnected, without parsing anything.
+    def test_handle_client_disconnected(self, web_server_instance, mocker):
+        server = web_server_instance
+        mock_client_sock = mocker.Mock(name="mock_client_sock")
+        mock_client_sock.recv_into.return_value = 0
+        mocker.patch.object(WebServer, "parse_request_from_buffer")
+        mocker.patch.object(WebServer, "park_connection")
+
+        server.handle_client(ClientConnection(mock_client_sock, ("127.0.0.1", 54321)))
 
-        # Verify the client socket was closed
+        WebServer.parse_request_from_buffer.assert_not_called()
+        WebServer.park_connection.assert_not_called()
         mock_client_sock.close.assert_called_once()
 
+    # Test that an incomplete request stays in the connection's buffer while it waits for the rest.
+    def test_handle_client_keeps_incomplete_request(self, web_server_instance, mocker):
+        server = web_server_instance
+        mock_client_sock = mocker.Mock(name="mock_client_sock")
+        partial_request = b"GET /test HTTP/1.1\r\nHost: exa"
+
+        def fake_recv_into(buffer):
+            buffer[: len(partial_request)] = partial_request
+            return len(partial_request)
+
+        mock_client_sock.recv_into.side_effect = fake_recv_into
+        mocker.patch.object(WebServer, "park_connection")
+
+        connection = ClientConnection(mock_client_sock, ("127.0.0.1", 54321))
+        connection.buffer += b"\r\n"
+        server.handle_client(connection)
+
+        assert connection.buffer == b"\r\n" + partial_request
+        WebServer.park_connection.assert_called_once_with(connection)
+        mock_client_sock.sendall.assert_not_called()
+        mock_client_sock.close.assert_not_called()
+
+    # Test that a known path requested with the wrong method gets a 405 instead of a 404.
+    def test_handle_client_method_not_allowed(self, mocker):
+        mocker.patch("os.path.isdir", return_value=True)
+        mocker.patch("os.path.exists", return_value=True)
+
+        mock_client_sock = mocker.Mock(name="mock_client_sock")
+        mock_client_sock.recv_into.return_value = 10
+
+        mock_parsed_components = {
+            "method": "GET",
+            "path": "/api/login",
+            "version": "HTTP/1.1",
+            "headers": {},
+            "body": b"",
+            "decoded_body": None,
+            "params": {},
+        }
+        mocker.patch.object(
+            WebServer,
+            "parse_request_from_buffer",
+            side_effect=[(mock_parsed_components, 10), (None, 0)],
+        )
+
+        # A real router with /api/login only registered for POST.
+        router = Router()
+        mock_handler = mocker.Mock(name="mock_handler")
+        router.add_route("POST", "/api/login", mock_handler)
+
+        server = WebServer(
+            host="127.0.0.1",
+            port="8080",
+            web_root_dir="/valid/web/root",
+            router=router,
+        )
+        mocker.patch.object(WebServer, "send_response", return_value=True)
+        mocker.patch.object(WebServer, "park_connection")
+
+        server.handle_client(ClientConnection(mock_client_sock, ("127.0.0.1", 54321)))
+
+        mock_handler.assert_not_called()
+        WebServer.send_response.assert_called_once_with(
+            mock_client_sock,
+            405,
+            "text/plain",
+            b"405 Method Not Allowed",
+            keep_alive=True,
+        )
+
+    # Test that a 404 keeps the connection open unless the client sent "Connection: close".
+    @pytest.mark.parametrize(
+        "headers, expected_keep_alive, expected_sends",
+        [({}, True, 2), ({"Connection": "Close"}, False, 1)],
+    )
+    def test_handle_client_keep_alive_after_404(
+        self, mocker, headers, expected_keep_alive, expected_sends
+    ):
+        mocker.patch("os.path.isdir", return_value=True)
+        mocker.patch("os.path.exists", return_value=True)
+
+        mock_client_sock = mocker.Mock(name="mock_client_sock")
+        mock_client_sock.recv_into.return_value = 10
+
+        mock_parsed_components = {
+            "method": "GET",
+            "path": "/missing",
+            "version": "HTTP/1.1",
+            "headers": headers,
+            "body": b"",
+            "params": {},
+        }
+        # Two pipelined requests in the buffer, then nothing more until the client sends again.
+        mocker.patch.object(
+            WebServer,
+            "parse_request_from_buffer",
+            side_effect=[
+                (mock_parsed_components, 10),
+                (mock_parsed_components, 10),
+                (None, 0),
+            ],
+        )
+
+        server = WebServer(
+            host="127.0.0.1",
+            port="8080",
+            web_root_dir="/valid/web/root",
+            router=Router(),
+        )
+        mock_send_response = mocker.patch.object(
+            WebServer, "send_response", return_value=expected_keep_alive
+        )
+        mock_park_connection = mocker.patch.object(WebServer, "park_connection")
+
+        connection = ClientConnection(mock_client_sock, ("127.0.0.1", 54321))
+        server.handle_client(connection)
+
+        assert mock_send_response.call_count == expected_sends
+        mock_send_response.assert_called_with(
+            mock_client_sock,
+            404,
+            "text/plain",
+            b"404 Not Found: Path not found.",
+            keep_alive=expected_keep_alive,
+        )
+        # A kept alive connection goes back to the event loop, the other one is closed.
+        if expected_keep_alive:
+            mock_park_connection.assert_called_once_with(connection)
+            mock_client_sock.close.assert_not_called()
+        else:
+            mock_park_connection.assert_not_called()
+            mock_client_sock.close.assert_called_once()
+
     #### PARSE_REQUETS_FROM_BUFFER() TESTS. ####
     # Test a valid GET request.
     def test_parse_request_from_buffer_valid_get(self, web_server_instance):
@@ -374,10 +744,24 @@ class TestWebServer:
         assert parsed_components["version"] == "HTTP/1.1"
         assert parsed_components["headers"] == {"Host": "example.com"}
         assert parsed_components["body"] == b""
-        assert parsed_components["decoded_body"] is None
         assert parsed_components["params"] == {}
+        assert parsed_components["auth_header"] is None
         assert consumed_bytes == len(raw_request)
 
+    # Test that the Authorization header is picked out regardless of its case.
+    def test_parse_request_from_buffer_auth_header(self, web_server_instance):
+        for header_name in (b"Authorization", b"authorization", b"AUTHORIZATION"):
+            raw_request = (
+                b"GET /api/data HTTP/1.1\r\n"
+                b"Host: example.com\r\n" + header_name + b": Bearer abc.def.ghi\r\n\r\n"
+            )
+
+            parsed_components, _ = web_server_instance.parse_request_from_buffer(
+                raw_request
+            )
+
+            assert parsed_components["auth_header"] == "Bearer abc.def.ghi"
+
     # Test a valid POST request with body.
     def test_parse_request_from_buffer_valid_post_with_body(self, web_server_instance):
         body = b"name=test&value=123"
@@ -403,9 +787,24 @@ class TestWebServer:
             "Content-Type": "application/x-www-form-urlencoded",
         }
         assert parsed_components["body"] == body
-        assert parsed_components["decoded_body"] == body.decode("utf-8")
         assert consumed_bytes == len(raw_request)
 
+    # Test that the body length is found whatever case the Content-Length header is sent in.
+    def test_parse_request_from_buffer_content_length_any_case(
+        self, web_server_instance
+    ):
+        for header_name in (b"Content-Length", b"content-length", b"CONTENT-LENGTH"):
+            raw_request = (
+                b"POST /submit HTTP/1.1\r\n" + header_name + b": 4\r\n\r\nbody"
+            )
+
+            parsed_components, consumed_bytes = (
+                web_server_instance.parse_request_from_buffer(raw_request)
+            )
+
+            assert parsed_components["body"] == b"body"
+            assert consumed_bytes == len(raw_request)
+
     # Test an incomplete request (needs more data).
     def test_parse_request_from_buffer_incomplete_request(self, web_server_instance):
         # In the string below we don't have the body separator \r\n\r\n.
@@ -469,6 +868,33 @@ class TestWebServer:
         ):
             web_server_instance.parse_request_from_buffer(raw_request)
 
+    # Test that header values are decoded as latin-1 and the method must be ASCII.
+    def test_parse_request_from_buffer_non_ascii_bytes(self, web_server_instance):
+        raw_request = b"GET / HTTP/1.1\r\nX-Name: caf\xe9\r\n\r\n"
+
+        parsed_components, _ = web_server_instance.parse_request_from_buffer(
+            raw_request
+        )
+
+        assert parsed_components["headers"]["X-Name"] == "caf\xe9"
+
+        with pytest.raises(ValueError, match="400 Bad Request"):
+            web_server_instance.parse_request_from_buffer(
+                b"G\xc9T / HTTP/1.1\r\nHost: example.com\r\n\r\n"
+            )
+
+    # Test that a Content-Length that isn't a plain number is rejected.
+    @pytest.mark.parametrize("value", [b"-1", b"abc", b"+5", b"1.5", b"\xb2"])
+    def test_parse_request_from_buffer_invalid_content_length(
+        self, web_server_instance, value
+    ):
+        raw_request = b"POST / HTTP/1.1\r\nContent-Length: " + value + b"\r\n\r\n"
+
+        with pytest.raises(
+            ValueError, match="400 Bad Request: Invalid Content-Length header."
+        ):
+            web_server_instance.parse_request_from_buffer(raw_request)
+
     # Test a request with `Content-Length` and exact body length.
     def test_parse_request_from_buffer_exact_body_length(self, web_server_instance):
         body = b"exact_body_data"
@@ -511,6 +937,22 @@ class TestWebServer:
         # Here we check consumed_bytes should only account for the first complete request.
         assert consumed_bytes == consumed_bytes_expected
 
+    # Test that a bytearray buffer (what handle_client uses) gives back the body as bytes.
+    def test_parse_request_from_buffer_bytearray(self, web_server_instance):
+        buffer = bytearray(
+            b"POST /action HTTP/1.1\r\nContent-Length: 4\r\n\r\ndataGET / HTTP/1.1\r\n\r\n"
+        )
+
+        parsed_components, consumed_bytes = (
+            web_server_instance.parse_request_from_buffer(buffer)
+        )
+
+        assert type(parsed_components["body"]) is bytes
+        assert parsed_components["body"] == b"data"
+        # handle_client drops the handled request from the buffer in place.
+        del buffer[:consumed_bytes]
+        assert buffer == b"GET / HTTP/1.1\r\n\r\n"
+
     # Test if multiple headers are properly encoded.
     def test_parse_request_from_buffer_multiple_headers(self, web_server_instance):
         raw_request = (
@@ -533,6 +975,28 @@ class TestWebServer:
         }
         assert consumed_bytes == len(raw_request)
 
+    # Test that common headers get their canonical name whatever case the client used.
+    def test_parse_request_from_buffer_canonical_header_names(
+        self, web_server_instance
+    ):
+        raw_request = (
+            b"GET /page HTTP/1.1\r\n"
+            b"host: test.com\r\n"
+            b"USER-AGENT: MyBrowser\r\n"
+            b"X-Custom-Header: kept as sent\r\n"
+            b"\r\n"
+        )
+
+        parsed_components, _ = web_server_instance.parse_request_from_buffer(
+            raw_request
+        )
+
+        assert parsed_components["headers"] == {
+            "Host": "test.com",
+            "User-Agent": "MyBrowser",
+            "X-Custom-Header": "kept as sent",
+        }
+
     # Test a request with no headers.
     def test_parse_request_from_buffer_no_headers(self, web_server_instance):
         raw_request = b"GET / HTTP/1.1\r\n\r\n"
@@ -747,7 +1211,7 @@ class TestWebServer:
         assert (
             "Connection: keep-alive\r\n" in sent_string
         )  # 200 OK should be keep-alive
-        assert f"Date: {datetime.datetime.today().date()}" in sent_string
+        assert re.search(HTTP_DATE_HEADER, sent_string)
         assert "Server: Pratik's HTTP Server" in sent_string
         assert "\r\n\r\n" in sent_string  # End of headers
 
@@ -760,7 +1224,7 @@ class TestWebServer:
         content_type = "text/html"
         content = b"<h1>404 Not Found</h1>"
 
-        web_server_instance.send_response(
+        keep_alive = web_server_instance.send_response(
             mock_client_socket, status_code, content_type, content
         )
 
@@ -773,12 +1237,32 @@ class TestWebServer:
 
         assert "Content-Type: text/html\r\n" in sent_string
         assert f"Content-Length: {len(content)}\r\n" in sent_string
-        # Since we encountered an error the connection should be closed.
-        assert "Connection: close\r\n" in sent_string
-        assert f"Date: {datetime.datetime.today().date()}" in sent_string
+        # A 404 is a normal answer, the connection stays open for the next request.
+        assert "Connection: keep-alive\r\n" in sent_string
+        assert keep_alive is True
+        assert re.search(HTTP_DATE_HEADER, sent_string)
         assert "Server: Pratik's HTTP Server" in sent_string
         assert sent_bytes.endswith(content)
 
+    # Test that server errors and keep_alive=False close the connection.
+    @pytest.mark.parametrize(
+        "status_code, keep_alive_arg", [(500, True), (200, False), (400, False)]
+    )
+    def test_send_response_connection_close(
+        self, web_server_instance, mock_client_socket, status_code, keep_alive_arg
+    ):
+        keep_alive = web_server_instance.send_response(
+            mock_client_socket,
+            status_code,
+            "text/plain",
+            b"body",
+            keep_alive=keep_alive_arg,
+        )
+
+        sent_string = mock_client_socket.sendall.call_args[0][0].decode("utf-8")
+        assert "Connection: close\r\n" in sent_string
+        assert keep_alive is False
+
     # Test sending a 204 No Content response with an empty body.
     def test_send_response_204_no_content(
         self, web_server_instance, mock_client_socket
@@ -803,7 +1287,7 @@ class TestWebServer:
         assert "Content-Type: text/plain\r\n" in sent_string
         assert "Content-Length: 0\r\n" in sent_string
         assert "Connection: keep-alive\r\n" in sent_string
-        assert f"Date: {datetime.datetime.today().date()}" in sent_string
+        assert re.search(HTTP_DATE_HEADER, sent_string)
         assert "Server: Pratik's HTTP Server" in sent_string
         assert sent_bytes.endswith(b"\r\n\r\n")
 
@@ -826,14 +1310,84 @@ class TestWebServer:
         assert "Content-Type: application/json\r\n" in sent_string
         assert f"Content-Length: {len(content)}\r\n" in sent_string
         assert "Connection: keep-alive\r\n" in sent_string
-        assert f"Date: {datetime.datetime.today().date()}" in sent_string
+        assert re.search(HTTP_DATE_HEADER, sent_string)
         assert "Server: Pratik's HTTP Server" in sent_string
         assert "\r\n\r\n" in sent_string
         assert sent_bytes.endswith(content)
 
+    # Test the precomputed status lines, including a code that isn't in the table.
+    def test_send_response_status_lines(self, web_server_instance, mock_client_socket):
+        assert WebServer.STATUS_LINE_BYTES[413] == b"HTTP/1.1 413 Payload Too Large\r\n"
+
+        web_server_instance.send_response(mock_client_socket, 418, "text/plain", b"")
+
+        sent_bytes = mock_client_socket.sendall.call_args[0][0]
+        assert sent_bytes.startswith(b"HTTP/1.1 418 Unknown Status\r\n")
+
+    # Test that big bodies are sent with sendmsg next to the headers, picking up after partial sends.
+    def test_send_response_large_body_uses_sendmsg(
+        self, web_server_instance, mock_client_socket
+    ):
+        content = b"x" * WebServer.SENDMSG_MIN_SIZE
+        sent_chunks = []
+
+        def fake_sendmsg(buffers):
+            # Only ever accept 1000 bytes at a time, like a busy socket would.
+            data = b"".join(bytes(buffer) for buffer in buffers)[:1000]
+            sent_chunks.append(data)
+            return len(data)
+
+        mock_client_socket.sendmsg.side_effect = fake_sendmsg
+
+        web_server_instance.send_response(
+            mock_client_socket, 200, "application/octet-stream", content
+        )
+
+        mock_client_socket.sendall.assert_not_called()
+        sent_bytes = b"".join(sent_chunks)
+        assert sent_bytes.startswith(b"HTTP/1.1 200 OK\r\n")
+        assert f"Content-Length: {len(content)}\r\n".encode() in sent_bytes
+        assert sent_bytes.endswith(b"\r\n\r\n" + content)
+
+    # Test that a FileBody sends the headers with sendall and then the file with sendfile.
+    def test_send_response_file_body(
+        self, web_server_instance, mock_client_socket, mocker
+    ):
+        mock_file = mocker.Mock()
+        body = FileBody(mock_file, 123456)
+
+        web_server_instance.send_response(mock_client_socket, 200, "image/png", body)
+
+        # Only the status line and headers go through sendall.
+        mock_client_socket.sendall.assert_called_once()
+        sent_string = mock_client_socket.sendall.call_args[0][0].decode("utf-8")
+        assert sent_string.startswith("HTTP/1.1 200 OK\r\n")
+        assert "Content-Length: 123456\r\n" in sent_string
+        assert sent_string.endswith("\r\n\r\n")
+
+        mock_client_socket.sendfile.assert_called_once_with(mock_file, 0, 123456)
+        # The file is closed once it is sent.
+        mock_file.close.assert_called_once()
+
+    # Test that the Date header is only formatted once per second.
+    def test_http_date_cached_per_second(self, mocker):
+        mocker.patch.object(webserver, "_date_header_cache", (0, b""))
+        mocker.patch("time.time", return_value=784111777.5)
+        mock_formatdate = mocker.patch.object(
+            webserver, "formatdate", wraps=webserver.formatdate
+        )
+
+        assert webserver._http_date() == b"Sun, 06 Nov 1994 08:49:37 GMT"
+        assert webserver._http_date() == b"Sun, 06 Nov 1994 08:49:37 GMT"
+        mock_formatdate.assert_called_once_with(784111777, usegmt=True)
+
+        time.time.return_value = 784111778.0
+        assert webserver._http_date() == b"Sun, 06 Nov 1994 08:49:38 GMT"
+        assert mock_formatdate.call_count == 2
+
     # Test error handling when sendall fails.
     def test_send_response_error_handling(
-        self, web_server_instance, mock_client_socket, mocker
+        self, web_server_instance, mock_client_socket, caplog
     ):
         status_code = 200
         content_type = "text/plain"
@@ -843,10 +1397,7 @@ class TestWebServer:
         mock_exception = socket.error("Mock socket error")
         mock_client_socket.sendall.side_effect = mock_exception
 
-        # Use patch to capture print statements.
-        mock_print = mocker.patch("builtins.print")
-
-        # Call the method that should trigger the print statement.
+        # Call the method that should log the error instead of raising it.
         web_server_instance.send_response(
             mock_client_socket, status_code, content_type, content
         )
@@ -854,20 +1405,7 @@ class TestWebServer:
         # Assert sendall was attempted once (and raised the side_effect).
         mock_client_socket.sendall.assert_called_once()
 
-        # Assert that print was called exactly once.
-        mock_print.assert_called_once()
-
-        # Get the arguments that print was called with. The first positional argument is the message string.
-        actual_printed_message = mock_print.call_args[0][0]
-
-        # Construct the expected parts of the message for flexible assertion.
-        expected_message_prefix = (
-            f"Error sending response to {mock_client_socket.getpeername()}: "
-        )
-        # Convert the mock_exception instance to string to match how print() handles it.
-        expected_exception_str = str(mock_exception)
-
-        # Assert that the actual message starts with the expected prefix.
-        assert actual_printed_message.startswith(expected_message_prefix)
-        # Assert that the actual message contains the string representation of the exception.
-        assert expected_exception_str in actual_printed_message
+        # Assert that the error was logged exactly once, with the exception in the message.
+        warnings = [r for r in caplog.records if r.levelname == "WARNING"]
+        assert len(warnings) == 1
+        assert warnings[0].getMessage() == f"Error sending response: {mock_exception}"